@@ -0,0 +1,18 @@
+""" Tasks run by the benchmark workers """
+import os
+
+from odq import Odq
+from odq.client import Client
+
+
+o = Odq(Client([os.environ.get('ODQ_BENCH_DISQUE', 'localhost:7711')]))
+
+
+@o.task
+def noop(i):
+    return i
+
+
+@o.task
+def add(a, b):
+    return a + b
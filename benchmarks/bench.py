@@ -0,0 +1,313 @@
+""" ODQ Benchmarks
+
+Runs against the disque stand-in of server.py, started on --port, or
+against a running disque with --disque host:port, and writes the results
+as JSON, one record per benchmark:
+
+    {"name": ..., "params": {...}, "ops": ..., "seconds": ...,
+     "ops_per_sec": ...}
+
+usage: python bench.py --output results.json
+"""
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+import platform
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from odq.client import Client  # noqa: E402
+from odq.broker import MemoryBroker  # noqa: E402
+from odq.serializers import (PickleSerializer, CompactSerializer,  # noqa
+                             task_id)
+
+
+QUEUE = 'odq.bench'
+PAYLOAD = b'x' * 64
+MODES = {
+    # name: worker arguments, {c} is the concurrency level
+    'thread': ['-w1', 'thread', '-c1', '{c}'],
+    'process': ['-w1', 'process', '-c1', '{c}'],
+    'gevent': ['-w1', 'gevent', '-c1', '{c}'],
+    'asyncio': ['-w1', 'asyncio', '-c1', '{c}'],
+    'process+thread': ['-w1', 'process', '-c1', '{c}',
+                       '-w2', 'thread', '-c2', '4'],
+    'thread+dispatch': ['-w1', 'thread', '-c1', '{c}', '--dispatch'],
+}
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='ODQ Benchmarks')
+    parser.add_argument(
+        '--disque', type=str, default=None,
+        help='benchmark a running disque node, e.g. localhost:7711, or '
+        '"memory" for the client benchmarks on the embedded broker, '
+        'if not provided, the stand-in server is started')
+    parser.add_argument(
+        '--port', type=int, default=7799,
+        help='port of the stand-in server, DEFAULT to 7799')
+    parser.add_argument(
+        '--ops', type=int, default=10000,
+        help='operations per micro benchmark, DEFAULT to 10000')
+    parser.add_argument(
+        '--jobs', type=int, default=2000,
+        help='jobs per end-to-end benchmark, DEFAULT to 2000')
+    parser.add_argument(
+        '--modes', type=str, default='thread,process,gevent,process+thread',
+        help='comma separated worker modes to run end-to-end, '
+        'of {}'.format(', '.join(MODES)))
+    parser.add_argument(
+        '--concurrency', type=str, default='1,4,16',
+        help='comma separated concurrency levels, DEFAULT to 1,4,16')
+    parser.add_argument(
+        '--only', type=str, default='',
+        help='comma separated benchmark groups to run, of client, '
+        'enqueue, serializer, e2e, DEFAULT to all')
+    parser.add_argument(
+        '--output', '-o', type=str, default='-',
+        help='file to write the JSON results to, DEFAULT to stdout')
+    return parser
+
+
+def record(name, ops, seconds, **params):
+    result = {'name': name, 'params': params, 'ops': ops,
+              'seconds': round(seconds, 6),
+              'ops_per_sec': round(ops / seconds, 2) if seconds else None}
+    sys.stderr.write('{:<40} {:>12} ops/s  {}\n'.format(
+        name, result['ops_per_sec'], params or ''))
+    return result
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - t0
+
+
+def flush(client):
+    client.execute_command('DEBUG', 'FLUSHALL')
+
+
+def bench_client(client, n):
+    """ ADDJOB / GETJOB / ACKJOB round-trips """
+    results = []
+    flush(client)
+
+    seconds = timed(lambda: [client.add_job(QUEUE, PAYLOAD)
+                             for _ in range(n)])
+    results.append(record('client.add_job', n, seconds))
+
+    seconds = timed(lambda: [client.get_job([QUEUE], nohang=True)
+                             for _ in range(n)])
+    results.append(record('client.get_job', n, seconds))
+
+    seconds = timed(client.add_jobs, QUEUE, [PAYLOAD] * n)
+    results.append(record('client.add_jobs', n, seconds, chunk_size=1000))
+
+    jobids = []
+
+    def take():
+        for _ in range(n // 100):
+            jobids.extend(jobid for _, jobid, _ in client.get_job(
+                [QUEUE], count=100, nohang=True))
+
+    seconds = timed(take)
+    results.append(record('client.get_job', len(jobids), seconds,
+                          count=100))
+
+    half = len(jobids) // 2
+    seconds = timed(lambda: [client.ack_job(jobid)
+                             for jobid in jobids[:half]])
+    results.append(record('client.ack_job', half, seconds))
+
+    rest = jobids[half:]
+    seconds = timed(lambda: [client.ack_job(*rest[i:i + 100])
+                             for i in range(0, len(rest), 100)])
+    results.append(record('client.ack_job', len(rest), seconds, ids=100))
+    return results
+
+
+def bench_enqueue(client, n):
+    """ overhead of a task call over a plain ADDJOB of its payload """
+    import app
+    results = []
+    flush(client)
+    payload = app.o.encode_job(app.add.__func__, app.add.__func__.__odq__,
+                               (1, 2), {})
+    raw = timed(lambda: [client.add_job('add', payload)
+                         for _ in range(n)])
+    results.append(record('enqueue.add_job', n, raw))
+    task = timed(lambda: [app.add(1, 2) for _ in range(n)])
+    results.append(record('enqueue.task', n, task,
+                          overhead_us=round((task - raw) / n * 1e6, 3)))
+    task = timed(app.add.starmap, [(1, 2)] * n)
+    results.append(record('enqueue.task.starmap', n, task))
+    flush(client)
+    return results
+
+
+def bench_serializer(n):
+    results = []
+    calls = {
+        'small': ((1, 2), {}),
+        'large': ((list(range(1000)), 'x' * 10000), {'flag': True}),
+    }
+    serializers = {
+        'pickle': PickleSerializer(),
+        'compact': CompactSerializer(compression=None),
+        'compact+zlib': CompactSerializer(),
+    }
+    names = {task_id('add'): 'add'}
+    for size, (args, kwargs) in calls.items():
+        for name, serializer in serializers.items():
+            payload = serializer.dumps('add', args, kwargs)
+            seconds = timed(lambda: [serializer.dumps('add', args, kwargs)
+                                     for _ in range(n)])
+            results.append(record('serializer.dumps', n, seconds,
+                                  serializer=name, call=size,
+                                  bytes=len(payload)))
+            seconds = timed(lambda: [serializer.loads(payload, names)
+                                     for _ in range(n)])
+            results.append(record('serializer.loads', n, seconds,
+                                  serializer=name, call=size,
+                                  bytes=len(payload)))
+    return results
+
+
+def wait_drained(o, queue, timeout=300):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if not o.disque_client.qlen(queue) and \
+                not o.count_jobs(queue, 'active'):
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def bench_e2e(client, modes, concurrencies, n, env):
+    """ jobs per second of a worker process tree draining `n` jobs """
+    import app
+    results = []
+    for mode in modes:
+        if mode == 'gevent' and not has_module('gevent'):
+            sys.stderr.write('skipping gevent, it is not installed\n')
+            continue
+        for c in concurrencies:
+            flush(client)
+            argv = [sys.executable, '-c',
+                    'from odq.worker import main; main()', 'app:o',
+                    '-q', 'noop', '--log-sample', '0']
+            argv += [arg.format(c=c) for arg in MODES[mode]]
+            worker = subprocess.Popen(argv, cwd=HERE, env=env,
+                                      stdout=subprocess.DEVNULL,
+                                      stderr=subprocess.DEVNULL,
+                                      start_new_session=True)
+            try:
+                # warm up, until every worker has imported and polls
+                app.noop.map(range(c * 10))
+                if not wait_drained(app.o, 'noop'):
+                    raise RuntimeError('{} workers never started'
+                                       ''.format(mode))
+                t0 = time.perf_counter()
+                app.noop.map(range(n))
+                drained = wait_drained(app.o, 'noop')
+                seconds = time.perf_counter() - t0
+            finally:
+                os.killpg(worker.pid, signal.SIGTERM)
+                try:
+                    worker.wait(10)
+                except subprocess.TimeoutExpired:
+                    os.killpg(worker.pid, signal.SIGKILL)
+                    worker.wait()
+            if drained:
+                results.append(record('e2e', n, seconds, mode=mode,
+                                      concurrency=c))
+    return results
+
+
+def has_module(name):
+    import importlib.util
+    return importlib.util.find_spec(name) is not None
+
+
+def wait_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return
+        except socket.error:
+            time.sleep(0.05)
+    raise RuntimeError('stand-in server did not start')
+
+
+def main():
+    args = get_parser().parse_args()
+    only = set(args.only.split(',')) if args.only else \
+        {'client', 'enqueue', 'serializer', 'e2e'}
+
+    server = None
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(HERE)] + env.get('PYTHONPATH', '').split(os.pathsep))
+    if args.disque == 'memory':
+        only &= {'client', 'serializer'}
+    elif args.disque:
+        env['ODQ_BENCH_DISQUE'] = args.disque
+    else:
+        env['ODQ_BENCH_DISQUE'] = 'localhost:{}'.format(args.port)
+        server = subprocess.Popen(
+            [sys.executable, os.path.join(HERE, 'server.py'),
+             str(args.port)])
+        wait_port(args.port)
+    os.environ['ODQ_BENCH_DISQUE'] = env.get('ODQ_BENCH_DISQUE', '')
+    sys.path.insert(0, HERE)
+
+    try:
+        if args.disque == 'memory':
+            client = MemoryBroker()
+        else:
+            client = Client([env['ODQ_BENCH_DISQUE']])
+        results = []
+        if 'client' in only:
+            results += bench_client(client, args.ops)
+        if 'enqueue' in only:
+            results += bench_enqueue(client, args.ops)
+        if 'serializer' in only:
+            results += bench_serializer(args.ops)
+        if 'e2e' in only:
+            results += bench_e2e(client, args.modes.split(','),
+                                 [int(c) for c in
+                                  args.concurrency.split(',')],
+                                 args.jobs, env)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    output = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'disque': args.disque or 'stand-in',
+        },
+        'results': results,
+    }
+    if args.output == '-':
+        json.dump(output, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,378 @@
+""" Disque Stand-in
+
+A single node RESP server emulating the disque commands used by odq:
+HELLO, ADDJOB, GETJOB, ACKJOB, FASTACK, DELJOB, ENQUEUE, DEQUEUE, NACK,
+WORKING, QLEN, QPEEK, SHOW, JSCAN, PING, INFO and DEBUG FLUSHALL.
+
+It keeps jobs in memory, without replication or persistence, so
+benchmarks run anywhere and measure odq rather than a disque deployment.
+
+usage: python server.py [port]
+"""
+import sys
+import time
+import heapq
+import random
+import select
+import socket
+import string
+import threading
+import socketserver
+from collections import deque
+
+
+NODE_ID = ''.join(random.choice('0123456789abcdef') for _ in range(40))
+
+
+class Error(Exception):
+    pass
+
+
+class Job(object):
+
+    def __init__(self, id, queue, body):
+        self.id = id
+        self.queue = queue
+        self.body = body
+        self.state = 'queued'
+        self.ctime = time.time()
+        self.retry = 0
+        self.expire = 0
+        self.nacks = 0
+        self.deliveries = 0
+        # bumped on every state change, so stale timers are ignored
+        self.gen = 0
+
+
+class State(object):
+    """ jobs, queues and timers, guarded by `cond` """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.flush()
+
+    def flush(self):
+        self.jobs = {}
+        self.queues = {}
+        # heap of tuple(time, job id, job gen, kind)
+        self.timers = []
+
+    def new_id(self, ttl):
+        r = ''.join(random.choice(string.ascii_letters + string.digits)
+                    for _ in range(24))
+        return 'D-{}-{}-{:04x}'.format(NODE_ID[:8], r,
+                                       ttl & 0xffff).encode()
+
+    def enqueue(self, job):
+        job.state = 'queued'
+        job.gen += 1
+        self.queues.setdefault(job.queue, deque()).append(job.id)
+        self.cond.notify_all()
+
+    def remove(self, jid):
+        job = self.jobs.pop(jid, None)
+        if job and job.state == 'queued':
+            self.queues[job.queue].remove(jid)
+        return job
+
+    def tick(self):
+        """ fire due delay, retry and expire timers """
+        now = time.time()
+        while self.timers and self.timers[0][0] <= now:
+            _, jid, gen, kind = heapq.heappop(self.timers)
+            job = self.jobs.get(jid)
+            if job is None:
+                continue
+            if kind == 'expire':
+                self.remove(jid)
+            elif job.gen == gen and job.state != 'queued':
+                self.enqueue(job)
+
+    def next_timer(self):
+        return self.timers[0][0] - time.time() if self.timers else None
+
+    def schedule(self, job, seconds, kind):
+        heapq.heappush(self.timers, (time.time() + seconds, job.id, job.gen,
+                                     kind))
+
+
+STATE = State()
+LOCAL = threading.local()
+
+
+def client_gone():
+    """ whether the client of the current connection hung up, so a
+    blocked GETJOB doesn't hand jobs to a dead worker """
+    sock = LOCAL.sock
+    r, _, _ = select.select([sock], [], [], 0)
+    return bool(r) and not sock.recv(1, socket.MSG_PEEK)
+
+
+def options(args, flags=()):
+    d = {}
+    i = 0
+    while i < len(args):
+        k = args[i].upper().decode()
+        if k in flags:
+            d[k] = True
+            i += 1
+        else:
+            d[k] = args[i + 1]
+            i += 2
+    return d
+
+
+def cmd_addjob(s, args):
+    queue, body, _ = args[:3]
+    o = options(args[3:], ('ASYNC', ))
+    if 'MAXLEN' in o and len(s.queues.get(queue, ())) >= int(o['MAXLEN']):
+        raise Error('MAXLEN Queue is already longer than the specified '
+                    'MAXLEN count')
+    ttl = int(o.get('TTL', 86400))
+    job = Job(s.new_id(ttl), queue, body)
+    job.retry = int(o.get('RETRY', min(300, ttl // 10)))
+    s.jobs[job.id] = job
+    s.schedule(job, ttl, 'expire')
+    delay = int(o.get('DELAY', 0))
+    if delay:
+        job.state = 'delayed'
+        s.schedule(job, delay, 'delay')
+    else:
+        s.enqueue(job)
+    return job.id
+
+
+def cmd_getjob(s, args):
+    nohang = counters = False
+    timeout = 0
+    count = 1
+    i = 0
+    while True:
+        k = args[i].upper()
+        if k == b'NOHANG':
+            nohang = True
+            i += 1
+        elif k == b'WITHCOUNTERS':
+            counters = True
+            i += 1
+        elif k == b'TIMEOUT':
+            timeout = int(args[i + 1])
+            i += 2
+        elif k == b'COUNT':
+            count = int(args[i + 1])
+            i += 2
+        elif k == b'FROM':
+            queues = args[i + 1:]
+            break
+        else:
+            raise Error('ERR syntax error')
+
+    deadline = time.time() + timeout / 1000 if timeout else None
+    woken = False
+    while True:
+        if woken and client_gone():
+            return None
+        s.tick()
+        jobs = []
+        for q in queues:
+            dq = s.queues.get(q)
+            while dq and len(jobs) < count:
+                job = s.jobs[dq.popleft()]
+                job.state = 'active'
+                job.deliveries += 1
+                job.gen += 1
+                if job.retry:
+                    s.schedule(job, job.retry, 'retry')
+                jobs.append(job)
+        if jobs:
+            if counters:
+                return [[j.queue, j.id, j.body, b'nacks', j.nacks,
+                         b'additional-deliveries', j.deliveries - 1]
+                        for j in jobs]
+            return [[j.queue, j.id, j.body] for j in jobs]
+        if nohang or deadline and time.time() >= deadline:
+            return None
+        waits = [w for w in (s.next_timer(),
+                             deadline and deadline - time.time()) if w]
+        s.cond.wait(min(waits + [0.5]))
+        woken = True
+
+
+def cmd_ackjob(s, args):
+    return sum(1 for jid in args if s.remove(jid))
+
+
+cmd_fastack = cmd_deljob = cmd_ackjob
+
+
+def cmd_enqueue(s, args):
+    n = 0
+    for jid in args:
+        job = s.jobs.get(jid)
+        if job and job.state != 'queued':
+            s.enqueue(job)
+            n += 1
+    return n
+
+
+def cmd_nack(s, args):
+    for jid in args:
+        if jid in s.jobs:
+            s.jobs[jid].nacks += 1
+    return cmd_enqueue(s, args)
+
+
+def cmd_dequeue(s, args):
+    n = 0
+    for jid in args:
+        job = s.jobs.get(jid)
+        if job and job.state == 'queued':
+            s.queues[job.queue].remove(jid)
+            job.state = 'active'
+            job.gen += 1
+            n += 1
+    return n
+
+
+def cmd_working(s, args):
+    job = s.jobs.get(args[0])
+    if not job:
+        raise Error('NOJOB Job not known in the context of this node.')
+    job.gen += 1
+    s.schedule(job, job.retry, 'retry')
+    return job.retry
+
+
+def cmd_qlen(s, args):
+    return len(s.queues.get(args[0], ()))
+
+
+def cmd_qpeek(s, args):
+    ids = list(s.queues.get(args[0], ()))
+    n = int(args[1])
+    ids = ids[:n] if n >= 0 else ids[::-1][:-n]
+    return [[s.jobs[i].queue, i, s.jobs[i].body] for i in ids]
+
+
+def show(job):
+    return [b'id', job.id, b'queue', job.queue, b'state',
+            job.state.encode(), b'repl', 1, b'ctime', int(job.ctime * 1e9),
+            b'retry', job.retry, b'nacks', job.nacks,
+            b'additional-deliveries', max(0, job.deliveries - 1),
+            b'body', job.body]
+
+
+def cmd_show(s, args):
+    job = s.jobs.get(args[0])
+    return show(job) if job else None
+
+
+def cmd_jscan(s, args):
+    i = cursor = 0
+    if args and args[0].isdigit():
+        cursor = int(args[0])
+        i = 1
+    count = 100
+    queues, states, reply = [], [], 'id'
+    while i < len(args):
+        k = args[i].upper()
+        if k == b'BUSYLOOP':
+            i += 1
+            continue
+        v = args[i + 1]
+        if k == b'COUNT':
+            count = int(v)
+        elif k == b'QUEUE':
+            queues.append(v)
+        elif k == b'STATE':
+            states.append(v.decode())
+        elif k == b'REPLY':
+            reply = v.decode()
+        i += 2
+    ids = sorted(s.jobs)
+    page = ids[cursor:cursor + count]
+    cursor = cursor + count if cursor + count < len(ids) else 0
+    jobs = [s.jobs[jid] for jid in page]
+    jobs = [j for j in jobs if (not queues or j.queue in queues) and
+            (not states or j.state in states)]
+    return [str(cursor).encode(),
+            [show(j) if reply == 'all' else j.id for j in jobs]]
+
+
+def cmd_hello(s, args):
+    host, port = LOCAL.server.server_address
+    return [1, NODE_ID.encode(),
+            [NODE_ID.encode(), host.encode(), str(port).encode(), b'1']]
+
+
+def cmd_ping(s, args):
+    return 'PONG'
+
+
+def cmd_info(s, args):
+    return b'# Server\r\ndisque_version:stand-in\r\n'
+
+
+def cmd_debug(s, args):
+    s.flush()
+    return 'OK'
+
+
+def encode(v):
+    if v is None:
+        return b'$-1\r\n'
+    if isinstance(v, Error):
+        return '-{}\r\n'.format(v).encode()
+    if isinstance(v, str):
+        return '+{}\r\n'.format(v).encode()
+    if isinstance(v, int):
+        return ':{}\r\n'.format(v).encode()
+    if isinstance(v, bytes):
+        return b'$%d\r\n%s\r\n' % (len(v), v)
+    return b'*%d\r\n' % len(v) + b''.join(encode(x) for x in v)
+
+
+class Handler(socketserver.StreamRequestHandler):
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            size = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(size + 2)[:-2])
+        return args
+
+    def handle(self):
+        LOCAL.sock = self.request
+        LOCAL.server = self.server
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            name = args[0].decode().lower()
+            fn = globals().get('cmd_' + name)
+            with STATE.cond:
+                try:
+                    if fn is None:
+                        raise Error('ERR unknown command ' + name)
+                    STATE.tick()
+                    reply = fn(STATE, args[1:])
+                except Error as e:
+                    reply = e
+            self.wfile.write(encode(reply))
+
+
+class Server(socketserver.ThreadingTCPServer):
+    request_queue_size = 1024
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(port=7711, host='127.0.0.1'):
+    Server((host, port), Handler).serve_forever()
+
+
+if __name__ == '__main__':
+    serve(int(sys.argv[1]) if len(sys.argv) > 1 else 7711)
@@ -1,4 +1,5 @@
 from .odq import Odq
+from .workflow import chain, group, chord
 
 
-__all__ = ['Odq']
+__all__ = ['Odq', 'chain', 'group', 'chord']
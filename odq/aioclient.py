@@ -0,0 +1,263 @@
+""" Asyncio Disque Client
+
+speaks RESP over asyncio streams, replies are parsed by hiredis"""
+import asyncio
+import logging
+
+import hiredis
+from redis.exceptions import ConnectionError, ResponseError
+
+from .client import Client, Node, backoff_delay, is_write
+
+logger = logging.getLogger('odq')
+
+
+def encode(*args):
+    """ encode a command as RESP multi bulk """
+    out = [b'*', str(len(args)).encode(), b'\r\n']
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode()
+        elif not isinstance(arg, (bytes, bytearray, memoryview)):
+            arg = str(arg).encode()
+        out += [b'$', str(len(arg)).encode(), b'\r\n', arg, b'\r\n']
+    return b''.join(out)
+
+
+class Connection(object):
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+        self.parser = hiredis.Reader(replyError=ResponseError)
+
+    async def connect(self):
+        try:
+            self.reader, self.writer = await asyncio.open_connection(
+                self.host, self.port)
+        except OSError as e:
+            raise ConnectionError(str(e))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    async def read_response(self):
+        while True:
+            reply = self.parser.gets()
+            if reply is not False:
+                return reply
+            data = await self.reader.read(65536)
+            if not data:
+                self.close()
+                raise ConnectionError('connection closed by server')
+            self.parser.feed(data)
+
+    async def execute_pipeline(self, commands):
+        """ send commands at once, return replies with errors in place """
+        try:
+            self.writer.write(b''.join(encode(*c) for c in commands))
+            return [await self.read_response() for _ in commands]
+        except OSError as e:
+            self.close()
+            raise ConnectionError(str(e))
+
+    async def execute_command(self, *args):
+        reply, = await self.execute_pipeline([args])
+        if isinstance(reply, ResponseError):
+            raise reply
+        return reply
+
+
+class AsyncClient(object):
+
+    """
+    Asyncio Disque client, has the same methods as `Client`, as coroutines
+
+    Connections are pooled, so concurrent coroutines (e.g. one blocked in
+    GETJOB and others in ACKJOB) don't wait on each other, at most
+    `max_connections` commands are in flight at the same time.
+
+    Usage::
+
+    >>> client = AsyncClient(['localhost:7711', 'localhost:7712'])
+    >>> job_id = await client.add_job('test', 'hello')
+    """
+
+    add_job_command = Client.add_job_command
+
+    def __init__(self, nodes=None, max_connections=64, retry_count=2):
+        if nodes is None:
+            nodes = ['localhost:7711']
+
+        self.nodes = {}
+        for n in nodes:
+            self.nodes[n] = None
+
+        self.max_connections = max_connections
+        self.retry_count = retry_count
+        self.connected_node = None
+        self.pool = []
+        # created on first use, to bind them to the running loop
+        self.lock = None
+        self.semaphore = None
+
+    async def connect(self):
+        """
+        Connect to disque nodes
+
+        Connects to the first node that answers HELLO, node.connection is
+        unused here, connections are taken from the pool
+
+        :return: nothing
+        """
+        self.connected_node = None
+        self.close()
+        for i, node in self.nodes.items():
+            host, port = i.split(':')
+            port = int(port)
+            connection = Connection(host, port)
+            try:
+                await connection.connect()
+                ret = await connection.execute_command('HELLO')
+                node_id = ret[1]
+                self.nodes[i] = Node(node_id, host, port, None)
+                self.connected_node = self.nodes[i]
+                self.close()
+                self.pool = [connection]
+                break
+            except ConnectionError:
+                connection.close()
+        if not self.connected_node:
+            raise Exception('couldnt connect to any nodes')
+        logger.info("connected to node %s" % self.connected_node)
+
+    def close(self):
+        for connection in self.pool:
+            connection.close()
+        self.pool = []
+
+    async def get_connection(self):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            if not self.connected_node:
+                await self.connect()
+        if self.pool:
+            return self.pool.pop()
+        connection = Connection(self.connected_node.host,
+                                self.connected_node.port)
+        await connection.connect()
+        return connection
+
+    async def execute_pipeline(self, commands):
+        """ see `Client.execute_pipeline` """
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_connections)
+        writes = any(is_write(command) for command in commands)
+        c = 0
+        async with self.semaphore:
+            while True:
+                connection = None
+                try:
+                    connection = await self.get_connection()
+                    replies = await connection.execute_pipeline(commands)
+                except ConnectionError as e:
+                    self.connected_node = None
+                    # once sent, writes may have been applied
+                    if c == self.retry_count or writes and connection:
+                        raise
+                    delay = backoff_delay(c)
+                    logger.warning('pipeline failed: %s, retry %d of %d in '
+                                   '%.3fs', e, c + 1, self.retry_count, delay)
+                    await asyncio.sleep(delay)
+                    c += 1
+                else:
+                    self.pool.append(connection)
+                    return replies
+
+    async def execute_command(self, *args):
+        reply, = await self.execute_pipeline([args])
+        if isinstance(reply, ResponseError):
+            raise reply
+        return reply
+
+    async def add_job(self, queue_name, job, balanced=False, **options):
+        """
+        ADDJOB, options are the same as `Client.add_job`, jobs always go to
+        the connected node, `balanced` is ignored
+        :return: job_id
+        """
+        command = self.add_job_command(queue_name, job, **options)
+        return await self.execute_command(*command)
+
+    async def add_jobs(self, queue_name, jobs, chunk_size=1000,
+                       balanced=False, **options):
+        """
+        Pipelined ADDJOB, see `Client.add_jobs`
+        :return: list of job_id, or ResponseError for refused jobs
+        """
+        job_ids = []
+        commands = []
+        for job in jobs:
+            commands.append(self.add_job_command(queue_name, job, **options))
+            if len(commands) >= chunk_size:
+                job_ids.extend(await self.execute_pipeline(commands))
+                commands = []
+        if commands:
+            job_ids.extend(await self.execute_pipeline(commands))
+        return job_ids
+
+    async def get_job(self, queues, timeout=None, count=None, nohang=False):
+        """
+        GETJOB, see `Client.get_job`
+        :return: list of tuple(queue_name, job_id, payload) - or empty list
+        """
+        assert queues
+        command = ['GETJOB']
+        if nohang:
+            command += ['NOHANG']
+        if timeout:
+            command += ['TIMEOUT', timeout]
+        if count:
+            command += ['COUNT', count]
+
+        command += ['FROM'] + list(queues)
+        results = await self.execute_command(*command)
+        if not results:
+            return []
+        return [(queue_name, job_id, payload)
+                for queue_name, job_id, payload in results]
+
+    async def ack_job(self, *job_ids):
+        await self.execute_command('ACKJOB', *job_ids)
+
+    async def fast_ack(self, *job_ids):
+        await self.execute_command('FASTACK', *job_ids)
+
+    async def nack(self, *job_ids):
+        return await self.execute_command('NACK', *job_ids)
+
+    async def working(self, job_id):
+        return await self.execute_command('WORKING', job_id)
+
+    async def qlen(self, queue_name):
+        return await self.execute_command('QLEN', queue_name)
+
+    async def qpeek(self, queue_name, count):
+        return await self.execute_command('QPEEK', queue_name, count)
+
+    async def enqueue(self, *job_ids):
+        return await self.execute_command('ENQUEUE', *job_ids)
+
+    async def dequeue(self, *job_ids):
+        return await self.execute_command('DEQUEUE', *job_ids)
+
+    async def del_job(self, *job_ids):
+        return await self.execute_command('DELJOB', *job_ids)
+
+    async def show(self, job_id):
+        return await self.execute_command('SHOW', job_id)
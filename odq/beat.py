@@ -0,0 +1,175 @@
+""" Periodic Scheduler
+
+Enqueues a job of every task with a `cron` config at each of its cron
+times, e.g.
+
+    @o.task(cron='*/5 * * * *')
+    def report():
+        ...
+
+and run `odqbeat app:o` next to the workers.
+
+Next fire times are kept in a heap. Before enqueueing, the scheduler
+claims the slot, i.e. the task name and fire time, by an ADDJOB with
+MAXLEN 1 to the queue `odq.beat.<task>.<time>` on a node chosen by the
+queue name. Only the first claim of a slot is accepted, so redundant
+schedulers fire every slot once.
+"""
+import sys
+import time
+import heapq
+import signal
+import logging
+import argparse
+import threading
+from datetime import datetime
+
+from crontab import CronTab
+from redis.exceptions import ConnectionError, ResponseError
+
+from .prefork import load_odq
+
+
+logger = logging.getLogger('odq')
+
+
+class Beat(object):
+    """
+    Scheduler of the cron tasks of an odq object
+
+    :param target: odq object path, e.g. app:o
+    :param claim_ttl: seconds slot claims are kept, slots more than half of
+                      it late are skipped, so a late scheduler never fires a
+                      slot whose claim is gone
+    """
+
+    def __init__(self, target, claim_ttl=300):
+        self.module, self.odq = load_odq(target)
+        self.claim_ttl = claim_ttl
+        self.grace = claim_ttl / 2
+        self.stopped = threading.Event()
+        self.crontabs = {}
+        # (cron, slot) -> next slot, shared by tasks of the same cron
+        self.next_slots = {}
+        self.heap = []
+        now = time.time()
+        for name, config in self.odq.configs.items():
+            if config.get('cron') and name in self.odq.tasks:
+                heapq.heappush(self.heap, (self.next_slot(config['cron'],
+                                                          now), name))
+        logger.info('scheduling %d cron tasks', len(self.heap))
+
+    def next_slot(self, cron, now):
+        """ first cron time of `cron` after `now`, in whole seconds """
+        key = (cron, now)
+        if key not in self.next_slots:
+            if len(self.next_slots) > 10000:
+                self.next_slots.clear()
+            if cron not in self.crontabs:
+                self.crontabs[cron] = CronTab(cron)
+            local = datetime.fromtimestamp(now).astimezone()
+            self.next_slots[key] = int(round(
+                now + self.crontabs[cron].next(now=local)))
+        return self.next_slots[key]
+
+    def claim(self, name, slot):
+        """
+        Claim the slot of task `name` at `slot`
+        :return: True if no scheduler claimed it before
+        """
+        client = self.odq.disque_client
+        queue = 'odq.beat.{}.{}'.format(name, slot)
+        options = {'ttl': self.claim_ttl, 'retry': None, 'maxlen': 1}
+        try:
+            # every scheduler claims a slot on the same node, MAXLEN is
+            # checked per node
+            if getattr(client, 'prefixes', None):
+                node = client.hashed_node(queue)
+                try:
+                    node.connection.execute_command(
+                        *client.add_job_command(queue, b'1', **options))
+                    return True
+                except ConnectionError:
+                    logger.warning('node %s unreachable, claiming %s on '
+                                   'the connected node', node, queue)
+            client.add_job(queue, b'1', **options)
+            return True
+        except ResponseError:
+            return False
+
+    def enqueue(self, name):
+        """ add a job of task `name`, called without arguments """
+        func = self.odq.tasks[name].__func__
+        config = dict(func.__odq__)
+        config.pop('cron')
+        # nobody waits for the result
+        config.pop('result', None)
+        queue, options = self.odq.job_options(func, config)
+        return self.odq.disque_client.add_job(
+            queue, self.odq.encode_job(func, config, (), {}), **options)
+
+    def tick(self, now=None):
+        """
+        Fire the slots that are due
+        :return: list of tuple(name, slot) fired by this scheduler
+        """
+        now = now or time.time()
+        fired = []
+        while self.heap and self.heap[0][0] <= now:
+            slot, name = heapq.heappop(self.heap)
+            cron = self.odq.configs[name]['cron']
+            if now - slot > self.grace:
+                logger.warning('skipping %s at %s, %.0f seconds late',
+                               name, slot, now - slot)
+                # e.g. after a pause, skip all the late slots at once
+                heapq.heappush(self.heap, (
+                    self.next_slot(cron, int(now - self.grace)), name))
+                continue
+            heapq.heappush(self.heap, (self.next_slot(cron, slot), name))
+            try:
+                if self.claim(name, slot):
+                    self.enqueue(name)
+                    fired.append((name, slot))
+            except Exception:
+                logger.exception('firing %s at %s failed', name, slot)
+        return fired
+
+    def run(self):
+        while not self.stopped.is_set():
+            for name, slot in self.tick():
+                logger.info('fired %s at %s', name, slot)
+            if self.heap:
+                self.stopped.wait(min(1, max(0, self.heap[0][0] -
+                                             time.time())))
+            else:
+                self.stopped.wait(1)
+
+    def stop(self, signum=None, frame=None):
+        self.stopped.set()
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='ODQ Periodic Scheduler')
+    parser.add_argument('odq', type=str,
+                        help='odq object, e.g. app:o')
+    parser.add_argument(
+        '--claim-ttl', type=int, default=300,
+        help='seconds fired slots are remembered, slots more than half of '
+        'it late are skipped, DEFAULT to 300')
+    return parser
+
+
+def main():
+    formatter = logging.Formatter(
+        '[%(asctime)s] %(name)s<%(levelname)s> %(message)s')
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+    args = get_parser().parse_args()
+    sys.path.insert(0, '.')
+    beat = Beat(args.odq, claim_ttl=args.claim_ttl)
+    signal.signal(signal.SIGTERM, beat.stop)
+    signal.signal(signal.SIGINT, beat.stop)
+    beat.run()
@@ -0,0 +1,171 @@
+""" Large Payload Offloading
+
+Task calls whose pickled arguments are over a size threshold are written
+to a blob store on a local or shared filesystem, and the job only carries
+references to the blobs.
+
+    blobs/<sha256[:2]>/<sha256>     content addressed blob
+    refs/<expires>-<token>-<i>-<sha256>
+                                    hard link to a blob, held by a job
+
+A job holds its blobs by its references, a worker deletes them once the
+job is acked, and any process deletes them after the job's TTL. A blob
+without references is deleted along with its last reference.
+
+With pickle protocol 5, contiguous buffers such as numpy arrays are
+pickled out-of-band into their own blobs, and workers rebuild them on
+read-only memory maps of the blobs, without copies.
+"""
+import os
+import time
+import mmap
+import uuid
+import pickle
+import hashlib
+import logging
+import threading
+
+
+logger = logging.getLogger('odq')
+
+OUT_OF_BAND = pickle.HIGHEST_PROTOCOL >= 5
+
+
+class BlobStore(object):
+    """
+    :param path: directory of the store, shared by producers and workers
+    :param threshold: min size in bytes of the pickled arguments of a call
+                      to be offloaded
+    :param gc_interval: min seconds between scans for expired references
+    """
+
+    def __init__(self, path, threshold=1024 * 1024, gc_interval=60):
+        self.path = path
+        self.threshold = threshold
+        self.gc_interval = gc_interval
+        self.collected_at = 0
+        self.lock = threading.Lock()
+        for name in ('blobs', 'refs'):
+            os.makedirs(os.path.join(path, name), exist_ok=True)
+
+    def __repr__(self):
+        return '<BlobStore %s>' % self.path
+
+    def blob_path(self, digest):
+        return os.path.join(self.path, 'blobs', digest[:2], digest)
+
+    def ref_path(self, ref):
+        return os.path.join(self.path, 'refs', ref)
+
+    def put(self, data, token):
+        """ store `data` if no blob has the same content, and reference it
+        :param token: unique prefix of the reference
+        :return: reference name """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(digest)
+        ref = '{}-{}'.format(token, digest)
+        while True:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+                with open(tmp, 'wb') as f:
+                    f.write(data)
+                os.rename(tmp, path)
+            try:
+                os.link(path, self.ref_path(ref))
+                return ref
+            except FileNotFoundError:
+                # collected between the check and the link
+                continue
+
+    def offload(self, args, kwargs, meta, ttl=86400):
+        """
+        Move the arguments of a call to the store if they are large
+
+        :param meta: job meta, gets the references of the blobs
+        :param ttl: seconds the job lives at most
+        :return: tuple(args, kwargs) to put in the payload
+        """
+        buffers = []
+        if OUT_OF_BAND:
+            stream = pickle.dumps((args, kwargs), 5,
+                                  buffer_callback=buffers.append)
+            buffers = [b.raw() for b in buffers]
+        else:
+            stream = pickle.dumps((args, kwargs), pickle.HIGHEST_PROTOCOL)
+        if len(stream) + sum(b.nbytes for b in buffers) < self.threshold:
+            return args, kwargs
+
+        token = '{}-{}'.format(int(time.time() + ttl), uuid.uuid4().hex)
+        meta['blobs'] = [self.put(data, '{}-{}'.format(token, i))
+                         for i, data in enumerate([stream] + buffers)]
+        self.maybe_collect()
+        return (), {}
+
+    def map(self, ref):
+        """ read-only memory map of a referenced blob """
+        with open(self.ref_path(ref), 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return b''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def load(self, meta):
+        """ :return: tuple(args, kwargs) of a call offloaded to the store """
+        stream, *buffers = [self.map(ref) for ref in meta['blobs']]
+        if buffers:
+            return pickle.loads(stream, buffers=[memoryview(b)
+                                                 for b in buffers])
+        return pickle.loads(stream)
+
+    def release(self, meta):
+        """ drop the references of an acked job, and the blobs nobody else
+        references """
+        for ref in meta.get('blobs', ()):
+            try:
+                os.unlink(self.ref_path(ref))
+                self.drop(self.blob_path(ref.rsplit('-', 1)[1]))
+            except FileNotFoundError:
+                pass
+        self.maybe_collect()
+
+    def drop(self, path):
+        """ delete a blob if it has no references, a producer referencing
+        it meanwhile still has the data through its own hard link """
+        if os.stat(path).st_nlink == 1:
+            os.unlink(path)
+            return True
+        return False
+
+    def maybe_collect(self):
+        """ delete expired references at most every `gc_interval` seconds,
+        one thread collects and the others go on """
+        if time.time() - self.collected_at < self.gc_interval or \
+                not self.lock.acquire(False):
+            return
+        try:
+            self.collected_at = time.time()
+            self.collect()
+        finally:
+            self.lock.release()
+
+    def collect(self, now=None):
+        """ delete the references of expired jobs, and unreferenced blobs
+        :return: number of blobs deleted """
+        now = now or time.time()
+        for ref in os.listdir(os.path.join(self.path, 'refs')):
+            if int(ref.split('-', 1)[0]) < now:
+                try:
+                    os.unlink(self.ref_path(ref))
+                except FileNotFoundError:
+                    pass
+        deleted = 0
+        root = os.path.join(self.path, 'blobs')
+        for prefix in os.listdir(root):
+            for name in os.listdir(os.path.join(root, prefix)):
+                if name.endswith('.tmp'):
+                    continue
+                try:
+                    deleted += self.drop(os.path.join(root, prefix, name))
+                except FileNotFoundError:
+                    pass
+        return deleted
@@ -0,0 +1,420 @@
+""" Embedded Broker
+
+An in-process stand-in for a disque node, with the API of `Client`, so
+producers and thread or gevent workers of a single host can share jobs
+without network round-trips:
+
+    >>> o = Odq(disque_client=MemoryBroker())
+
+Jobs live in memory only, there is no replication or persistence. Like
+disque, delivery is at least once: a job that is not acked within its
+RETRY period is queued again, and jobs are deleted after their TTL.
+
+Queue names, job ids and payloads are returned as bytes, as by `Client`.
+"""
+import time
+import heapq
+import uuid
+import threading
+from bisect import bisect_left, insort
+from collections import deque
+
+from redis.exceptions import ResponseError
+
+
+def to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode()
+
+
+class Job(object):
+
+    __slots__ = ('id', 'queue', 'body', 'state', 'ctime', 'retry', 'ttl',
+                 'nacks', 'deliveries', 'gen')
+
+    def __init__(self, id, queue, body, retry, ttl):
+        self.id = id
+        self.queue = queue
+        self.body = body
+        self.state = 'queued'
+        self.ctime = time.time()
+        self.retry = retry
+        self.ttl = ttl
+        self.nacks = 0
+        self.deliveries = 0
+        # bumped on every state change, timers of an older gen are stale
+        self.gen = 0
+
+    def __repr__(self):
+        return '<Job id:%s queue_name:%s>' % (self.id, self.queue)
+
+
+class MemoryBroker(object):
+    """
+    Disque semantics in memory
+
+    queued job ids are kept in a deque per queue, all job ids in a sorted
+    list for JSCAN, delays, retries and TTLs are timers in a heap, and
+    blocked GETJOBs wait on a condition
+
+    >>> broker = MemoryBroker()
+    >>> broker.add_job('add', b'payload')
+    """
+
+    def __init__(self):
+        self.node_id = uuid.uuid4().hex
+        self.cond = threading.Condition()
+        self.flush()
+
+    def flush(self):
+        with self.cond:
+            self.jobs = {}
+            # sorted job ids, pages of JSCAN are bisected in it
+            self.ids = []
+            self.queues = {}
+            # heap of tuple(time, job id, job gen, kind)
+            self.timers = []
+            # timers of deleted jobs, dropped once they are the majority
+            self.stale = 0
+
+    # internals, called with self.cond held
+
+    def new_id(self, ttl):
+        return 'D-{}-{}-{:04x}'.format(self.node_id[:8], uuid.uuid4().hex,
+                                       ttl & 0xffff).encode()
+
+    def schedule(self, job, seconds, kind):
+        heapq.heappush(self.timers, (time.time() + seconds, job.id, job.gen,
+                                     kind))
+
+    def queue_job(self, job):
+        job.state = 'queued'
+        job.gen += 1
+        self.queues.setdefault(job.queue, deque()).append(job.id)
+        self.cond.notify_all()
+
+    def remove(self, job_id):
+        job = self.jobs.pop(job_id, None)
+        if job is not None:
+            del self.ids[bisect_left(self.ids, job_id)]
+            if job.state == 'queued':
+                self.queues[job.queue].remove(job_id)
+            self.stale += 1
+            if self.stale > 1024 and self.stale * 2 > len(self.timers):
+                self.compact()
+        return job
+
+    def compact(self):
+        """ drop the timers of deleted jobs and stale retries, acked jobs
+        would otherwise keep their TTL timers until they are due """
+        self.timers = [t for t in self.timers if t[1] in self.jobs and
+                       (t[3] == 'ttl' or self.jobs[t[1]].gen == t[2])]
+        heapq.heapify(self.timers)
+        self.stale = 0
+
+    def tick(self):
+        """ fire the delay, retry and TTL timers that are due """
+        now = time.time()
+        while self.timers and self.timers[0][0] <= now:
+            _, job_id, gen, kind = heapq.heappop(self.timers)
+            job = self.jobs.get(job_id)
+            if job is None:
+                continue
+            if kind == 'ttl':
+                self.remove(job_id)
+            elif job.gen == gen and job.state != 'queued':
+                self.queue_job(job)
+
+    def take(self, queues, count):
+        jobs = []
+        for queue in queues:
+            dq = self.queues.get(queue)
+            while dq and len(jobs) < count:
+                job = self.jobs[dq.popleft()]
+                job.state = 'active'
+                job.deliveries += 1
+                job.gen += 1
+                if job.retry:
+                    self.schedule(job, job.retry, 'retry')
+                jobs.append(job)
+        return jobs
+
+    # client api
+
+    def add_job(self, queue_name, job, timeout=200, replicate=None, delay=None,
+                retry=8640, ttl=86400, maxlen=None, **options):
+        """
+        Add a job, see `Client.add_job`, `timeout`, `replicate` and `async`
+        are meaningless for a single node in memory and are ignored
+
+        :raise: ResponseError if `maxlen` jobs are already queued
+        """
+        queue = to_bytes(queue_name)
+        ttl = int(ttl or 86400)
+        with self.cond:
+            if maxlen and len(self.queues.get(queue, ())) >= maxlen:
+                raise ResponseError('MAXLEN Queue is already longer than '
+                                    'the specified MAXLEN count')
+            item = Job(self.new_id(ttl), queue, to_bytes(job),
+                       min(300, ttl // 10) if retry is None else int(retry),
+                       ttl)
+            self.jobs[item.id] = item
+            insort(self.ids, item.id)
+            self.schedule(item, ttl, 'ttl')
+            if delay:
+                item.state = 'delayed'
+                self.schedule(item, delay, 'delay')
+                self.cond.notify_all()
+            else:
+                self.queue_job(item)
+        return item.id
+
+    def add_jobs(self, queue_name, jobs, chunk_size=1000, **options):
+        """ add many jobs, see `Client.add_jobs`, a refused job gets its
+        ResponseError instead of a job id """
+        job_ids = []
+        for job in jobs:
+            try:
+                job_ids.append(self.add_job(queue_name, job, **options))
+            except ResponseError as e:
+                job_ids.append(e)
+        return job_ids
+
+    def get_job(self, queues, timeout=None, count=None, nohang=False,
+                node=None):
+        """
+        Take jobs, see `Client.get_job`, there is no other node to poll
+
+        :param timeout: max milliseconds to block, forever if empty
+        :return: list of tuple(queue_name, job_id, payload)
+        """
+        assert queues
+        queues = [to_bytes(q) for q in queues]
+        deadline = time.time() + timeout / 1000 if timeout else None
+        with self.cond:
+            while True:
+                self.tick()
+                jobs = self.take(queues, count or 1)
+                if jobs:
+                    return [(job.queue, job.id, job.body) for job in jobs]
+                now = time.time()
+                if nohang or deadline and now >= deadline:
+                    return []
+                # wake up for the next timer, it may queue a job
+                waits = [deadline - now] if deadline else []
+                if self.timers:
+                    waits.append(self.timers[0][0] - now)
+                self.cond.wait(min(waits) if waits else None)
+
+    def ack_job(self, *job_ids):
+        """ acknowledge jobs, they are deleted """
+        with self.cond:
+            return sum(1 for job_id in job_ids
+                       if self.remove(to_bytes(job_id)))
+
+    fast_ack = del_job = ack_job
+
+    def enqueue(self, *job_ids):
+        """ queue jobs if not already queued """
+        n = 0
+        with self.cond:
+            for job_id in job_ids:
+                job = self.jobs.get(to_bytes(job_id))
+                if job is not None and job.state != 'queued':
+                    self.queue_job(job)
+                    n += 1
+        return n
+
+    def nack(self, *job_ids):
+        """ put jobs back in their queues, counting a failed delivery """
+        with self.cond:
+            for job_id in job_ids:
+                job = self.jobs.get(to_bytes(job_id))
+                if job is not None:
+                    job.nacks += 1
+            return self.enqueue(*job_ids)
+
+    def dequeue(self, *job_ids):
+        """ remove jobs from their queues, without deleting them """
+        n = 0
+        with self.cond:
+            for job_id in job_ids:
+                job = self.jobs.get(to_bytes(job_id))
+                if job is not None and job.state == 'queued':
+                    self.queues[job.queue].remove(job.id)
+                    job.state = 'active'
+                    job.gen += 1
+                    n += 1
+        return n
+
+    def working(self, job_id):
+        """ postpone the next delivery of a job by its RETRY period
+        :return: seconds postponed """
+        with self.cond:
+            job = self.jobs.get(to_bytes(job_id))
+            if job is None:
+                raise ResponseError('NOJOB Job not known in the context of '
+                                    'this node.')
+            job.gen += 1
+            self.schedule(job, job.retry, 'retry')
+            return job.retry
+
+    def qlen(self, queue_name):
+        with self.cond:
+            self.tick()
+            return len(self.queues.get(to_bytes(queue_name), ()))
+
+    def qpeek(self, queue_name, count):
+        """ see `Client.qpeek`
+        :return: list of [queue_name, job_id, payload] """
+        with self.cond:
+            self.tick()
+            ids = list(self.queues.get(to_bytes(queue_name), ()))
+            ids = ids[:count] if count >= 0 else ids[::-1][:-count]
+            return [[self.jobs[i].queue, i, self.jobs[i].body] for i in ids]
+
+    def show(self, job_id):
+        """ describe a job as disque does, a flat list of names and values,
+        or None if the job is unknown """
+        with self.cond:
+            job = self.jobs.get(to_bytes(job_id))
+            return self.describe(job) if job else None
+
+    def describe(self, job):
+        return [b'id', job.id, b'queue', job.queue,
+                b'state', job.state.encode(), b'repl', 1,
+                b'ttl', int(job.ctime + job.ttl - time.time()),
+                b'ctime', int(job.ctime * 1e9), b'delay', 0,
+                b'retry', job.retry, b'nacks', job.nacks,
+                b'additional-deliveries', max(0, job.deliveries - 1),
+                b'body', job.body]
+
+    def jscan(self, cursor=b'0', count=100, queues=(), states=(),
+              reply='id'):
+        """
+        One page of a job scan, the cursor is the smallest job id of the
+        next page, so jobs that exist during the whole scan are returned
+        once even if others are added or deleted meanwhile
+
+        :return: [next cursor, list of job ids or job descriptions]
+        """
+        with self.cond:
+            self.tick()
+            ids = self.ids
+            start = bisect_left(ids, cursor) if cursor != b'0' else 0
+            page = ids[start:start + count]
+            cursor = ids[start + count] if start + count < len(ids) else b'0'
+            jobs = [self.jobs[i] for i in page]
+            jobs = [job for job in jobs
+                    if (not queues or job.queue in queues) and
+                    (not states or job.state in states)]
+            return [cursor, [self.describe(job) if reply == 'all' else job.id
+                             for job in jobs]]
+
+    def execute_command(self, *args):
+        """ the raw commands odq sends besides the client api, i.e. JSCAN,
+        QLEN, QPEEK, SHOW, PING, HELLO and DEBUG FLUSHALL, and ADDJOB,
+        GETJOB and ACKJOB sent to a node of a cluster """
+        name = args[0].upper()
+        args = [to_bytes(arg) for arg in args[1:]]
+        if name == 'ADDJOB':
+            options = self.parse_options(args[3:])
+            # without RETRY, disque derives it from the TTL
+            options.setdefault('retry', None)
+            return self.add_job(args[0], args[1], **options)
+        elif name == 'GETJOB':
+            i = args.index(b'FROM')
+            options = self.parse_options(args[:i])
+            return [list(job) for job in self.get_job(args[i + 1:],
+                                                      **options)]
+        elif name == 'ACKJOB':
+            return self.ack_job(*args)
+        elif name == 'JSCAN':
+            return self.execute_jscan(args)
+        elif name == 'QLEN':
+            return self.qlen(args[0])
+        elif name == 'QPEEK':
+            return self.qpeek(args[0], int(args[1]))
+        elif name == 'SHOW':
+            return self.show(args[0])
+        elif name == 'PING':
+            return True
+        elif name == 'HELLO':
+            return [1, self.node_id.encode(),
+                    [self.node_id.encode(), b'memory', b'0', b'1']]
+        elif name == 'DEBUG' and args and args[0].upper() == b'FLUSHALL':
+            self.flush()
+            return True
+        raise ResponseError('unknown command {}'.format(name))
+
+    def parse_options(self, args):
+        """ keyword arguments of the options of ADDJOB or GETJOB """
+        options = {}
+        i = 0
+        while i < len(args):
+            key = args[i].decode().lower()
+            if key in ('nohang', 'async'):
+                options[key] = True
+                i += 1
+            else:
+                options[key] = int(args[i + 1])
+                i += 2
+        return options
+
+    def execute_jscan(self, args):
+        cursor = b'0'
+        if args and args[0].isdigit() or args and args[0].startswith(b'D-'):
+            cursor, args = args[0], args[1:]
+        options = {'count': 100, 'queues': [], 'states': [], 'reply': 'id'}
+        i = 0
+        while i < len(args):
+            key = args[i].upper()
+            if key == b'BUSYLOOP':
+                i += 1
+                continue
+            value = args[i + 1]
+            if key == b'COUNT':
+                options['count'] = int(value)
+            elif key == b'QUEUE':
+                options['queues'].append(value)
+            elif key == b'STATE':
+                options['states'].append(value.decode())
+            elif key == b'REPLY':
+                options['reply'] = value.decode()
+            i += 2
+        return self.jscan(cursor, **options)
+
+    def execute_pipeline(self, commands):
+        """ run commands one after another, see `Client.execute_pipeline` """
+        replies = []
+        for command in commands:
+            try:
+                replies.append(self.execute_command(*command))
+            except ResponseError as e:
+                replies.append(e)
+        return replies
+
+    def pipeline(self, transaction=False):
+        """ a pipeline as by redis.Redis, so that the broker can stand in
+        for the connection of a cluster node """
+        return Pipeline(self)
+
+
+class Pipeline(object):
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.commands = []
+
+    def execute_command(self, *args):
+        self.commands.append(args)
+
+    def execute(self, raise_on_error=True):
+        replies = self.broker.execute_pipeline(self.commands)
+        self.commands = []
+        if raise_on_error:
+            for reply in replies:
+                if isinstance(reply, ResponseError):
+                    raise reply
+        return replies
@@ -0,0 +1,131 @@
+""" Result Cache
+
+Workers reuse the results of tasks with `cache` set, instead of calling
+them again with the same arguments, for `cache` seconds:
+
+    @o.task(cache=3600)
+    def thumbnail(path, size):
+        ...
+
+The key of a call is a hash of the pickled (task, args, kwargs). A worker
+looks the key up in its local LRU, then in the broker, where a result is
+the body of a job in the queue `odq.cache.<task>.<key>` that lives `cache`
+seconds. QPEEK only sees the jobs queued on the node it runs on, so every
+worker sends these commands to the node picked by a hash of the queue.
+
+The cache is an optimization, errors of the broker are logged and taken
+as misses.
+
+A job found in the cache is ACKed at once, its producer gets the cached
+result. Calls with arguments that can't be pickled, and batch tasks, are
+not cached. Lookups are counted per task in `hits` and `misses`.
+"""
+import time
+import pickle
+import hashlib
+import logging
+import threading
+from collections import Counter, OrderedDict
+
+from redis.exceptions import ResponseError
+
+
+logger = logging.getLogger('odq')
+
+
+class ResultCache(object):
+    """
+    :param odq: Odq instance
+    :param size: max results in the local LRU
+    """
+
+    def __init__(self, odq, size=10000):
+        self.odq = odq
+        self.size = size
+        # (task, key) -> tuple(expires, value)
+        self.local = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def key(self, funcname, args, kwargs):
+        """ cache key of a call, None if the task is not cached or its
+        arguments can't be pickled """
+        config = self.odq.configs.get(funcname, {})
+        if not config.get('cache') or config.get('batch'):
+            return None
+        try:
+            data = pickle.dumps((funcname, args, sorted(kwargs.items())), 2)
+        except Exception:
+            return None
+        return hashlib.sha1(data).hexdigest()
+
+    def queue(self, funcname, key):
+        return 'odq.cache.{}.{}'.format(funcname, key)
+
+    def execute(self, queue, *args):
+        """ send a command to the node holding the results of `queue` """
+        client = self.odq.disque_client
+        if getattr(client, 'prefixes', None):
+            return client.execute_on_node(client.hashed_node(queue), *args)
+        return client.execute_command(*args)
+
+    def remember(self, local_key, value, expires):
+        with self.lock:
+            self.local[local_key] = (expires, value)
+            self.local.move_to_end(local_key)
+            while len(self.local) > self.size:
+                self.local.popitem(last=False)
+
+    def get(self, funcname, key):
+        """ :return: tuple(hit, value) """
+        local_key = (funcname, key)
+        with self.lock:
+            entry = self.local.get(local_key)
+            if entry and entry[0] > time.time():
+                self.local.move_to_end(local_key)
+                self.hits[funcname] += 1
+                return True, entry[1]
+
+        queue = self.queue(funcname, key)
+        try:
+            jobs = self.execute(queue, 'QPEEK', queue, 1)
+            if jobs:
+                expires, value = pickle.loads(jobs[0][2])
+        except Exception:
+            logger.exception('looking up the cached result of %s failed',
+                             funcname)
+            jobs = []
+        if jobs:
+            self.remember(local_key, value, expires)
+            self.hits[funcname] += 1
+            return True, value
+        self.misses[funcname] += 1
+        return False, None
+
+    def set(self, funcname, key, value):
+        """ store the result of a call, for its task's `cache` seconds """
+        ttl = int(self.odq.configs[funcname]['cache'])
+        expires = time.time() + ttl
+        try:
+            body = pickle.dumps((expires, value))
+        except Exception:
+            logger.warning('result of %s is not cached, it can\'t be '
+                           'pickled', funcname)
+            return
+        self.remember((funcname, key), value, expires)
+        queue = self.queue(funcname, key)
+        try:
+            self.execute(queue, 'ADDJOB', queue, body, 200, 'RETRY', 0,
+                         'TTL', ttl, 'MAXLEN', 1, 'ASYNC')
+        except ResponseError:
+            # another worker cached it meanwhile
+            pass
+        except Exception:
+            logger.exception('caching the result of %s failed', funcname)
+
+    def stats(self):
+        """ :return: dict of task -> dict(hits, misses) """
+        return dict((funcname, {'hits': self.hits[funcname],
+                                'misses': self.misses[funcname]})
+                    for funcname in set(self.hits) | set(self.misses))
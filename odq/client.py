@@ -1,14 +1,40 @@
 """ Disque Client
 
 adapted from https://github.com/ybrs/pydisque"""
+import os
+import time
+import zlib
+import random
 import logging
+import threading
 from functools import wraps
+from collections import OrderedDict
 
 import redis
-from redis.exceptions import ConnectionError
+from redis.exceptions import ConnectionError, TimeoutError
 
 logger = logging.getLogger('odq')
 
+# errors of a node, commands fail over to another node on them, errors
+# like a ResponseError for a bad command would just fail again
+NODE_ERRORS = (ConnectionError, TimeoutError)
+# commands that must not be applied twice, they are only sent again when
+# the connection failed before they were sent
+WRITES = ('ADDJOB', )
+# seconds a failed node is skipped for, doubled with each failure in a row
+CIRCUIT_BACKOFF = 1
+CIRCUIT_MAX_BACKOFF = 30
+
+
+def backoff_delay(attempt, backoff=0.02, max_backoff=1):
+    """
+    Exponential backoff with full jitter, a random delay up to
+    backoff * 2^attempt seconds, so that clients failing at the same time
+    don't retry at the same time
+    :param attempt: number of attempts that failed before, from 0
+    """
+    return random.uniform(0, min(max_backoff, backoff * 2 ** attempt))
+
 
 class Job(object):
 
@@ -35,30 +61,122 @@ class Node(object):
         self.host = host
         self.port = port
         self.connection = connection
+        # circuit breaker, a node that failed is skipped until down_until
+        self.failures = 0
+        self.down_until = 0
+        # connection with a socket timeout, for health checks
+        self.probe = None
 
     def __repr__(self):
         return '<Node %s:%s>' % (self.host, self.port)
 
+    def available(self, now=None):
+        """ whether the node may be used, i.e. its circuit is closed or the
+        backoff after its last failure is over """
+        return self.down_until <= (now or time.time())
+
+    def failed(self):
+        """ open the circuit, for a period growing with each failure in a
+        row, half of it jittered """
+        self.failures += 1
+        delay = min(CIRCUIT_MAX_BACKOFF,
+                    CIRCUIT_BACKOFF * 2 ** (self.failures - 1))
+        self.down_until = time.time() + delay / 2 + random.uniform(0,
+                                                                   delay / 2)
+
+    def recovered(self):
+        """ close the circuit """
+        if self.failures:
+            logger.info('node %s is back after %d failures', self,
+                        self.failures)
+        self.failures = 0
+        self.down_until = 0
+
+
+def node_prefix(id):
+    """
+    The node ID prefix of a node ID or of a job ID, job IDs look like
+    D-<first 8 chars of the node ID>-<random>-<ttl>
+    :param id: node ID or job ID
+    :rtype: str
+    """
+    if isinstance(id, bytes):
+        id = id.decode()
+    if id.startswith('D-'):
+        return id[2:10]
+    return id[:8]
+
+
+def is_write(command):
+    """ whether a command is one of WRITES
+    :param command: list of arguments """
+    name = command[0]
+    if isinstance(name, bytes):
+        name = name.decode()
+    return name.upper() in WRITES
+
+
+def send_command(connection, *args):
+    """
+    Execute a command on a redis.Redis, errors raised once the command was
+    sent get a `retry` attribute, false for timeouts and for WRITES, the
+    command may have been applied
+    """
+    pool = getattr(connection, 'connection_pool', None)
+    if pool is None:
+        # e.g. a MemoryBroker, errors are taken as raised once sent
+        try:
+            return connection.execute_command(*args)
+        except NODE_ERRORS as e:
+            e.retry = isinstance(e, ConnectionError) and not is_write(args)
+            raise
+    # connects, errors raised here are retried
+    conn = pool.get_connection(args[0])
+    try:
+        conn.send_command(*args)
+        return connection.parse_response(conn, args[0])
+    except NODE_ERRORS as e:
+        conn.disconnect()
+        e.retry = isinstance(e, ConnectionError) and not is_write(args)
+        raise
+    finally:
+        pool.release(conn)
+
 
 class retry(object):
+    """
+    Retry a client method on NODE_ERRORS, after a jittered backoff, unless
+    the error has a false `retry` attribute, see `send_command`, other
+    errors are raised at once. The method fails over to another node
+    before raising, so the first retry goes to a live node after a few ms.
+
+    :param retry_count: number of retries
+    :param backoff: max seconds before the first retry, doubled for each
+                    retry
+    :param max_backoff: max seconds between retries
+    """
 
-    def __init__(self, retry_count=2):
+    def __init__(self, retry_count=2, backoff=0.02, max_backoff=1):
         self.retry_count = retry_count
+        self.backoff = backoff
+        self.max_backoff = max_backoff
 
     def __call__(self, fn):
 
         @wraps(fn)
         def wrapped_f(*args, **kwargs):
             c = 0
-            while c <= self.retry_count:
+            while True:
                 try:
                     return fn(*args, **kwargs)
-                except:
-                    logging.critical(
-                        "retrying because of this exception - %s", c)
-                    logging.exception("exception to retry ")
-                    if c == self.retry_count:
+                except NODE_ERRORS as e:
+                    if c == self.retry_count or not getattr(e, 'retry', True):
                         raise
+                    delay = backoff_delay(c, self.backoff, self.max_backoff)
+                    logger.warning('%s failed: %s, retry %d of %d in %.3fs',
+                                   fn.__name__, e, c + 1, self.retry_count,
+                                   delay)
+                    time.sleep(delay)
                 c += 1
 
         return wrapped_f
@@ -76,63 +194,365 @@ class Client(object):
 
     >>> client = Client(['localhost:7711', 'localhost:7712'])
     >>> client.connect()
+
+    By default all commands go to the connected node. With `balance`, the
+    client uses every node of the cluster: ADDJOB of task jobs, i.e. with
+    `balanced`, goes to the nodes in turn ('round-robin'), or to the node
+    with the shortest queue ('qlen', QLEN is checked every `qlen_ttl`
+    seconds), and workers poll the nodes that hold jobs, see `poll_node`.
+    Jobs of internal queues, e.g. slot tokens, dedup markers and results,
+    stay on the node they are read from.
+
+    A node that fails a command is skipped for a while (its circuit is
+    open), for 1s after one failure, up to 30s after many in a row, and
+    commands to the connected node fail over to the next available node.
+    With `health_interval`, a background thread PINGs the nodes, so that
+    dead nodes are skipped before a command fails on them and are used
+    again as soon as they are back.
+
+    :param nodes: list of host:port
+    :param balance: None, 'round-robin' or 'qlen'
+    :param qlen_ttl: seconds queue lengths of the nodes are cached
+    :param connect_timeout: seconds to wait for a node to accept a
+                            connection
+    :param health_interval: seconds between health checks, None to only
+                            check nodes when they are used
     """
 
-    def __init__(self, nodes=None):
+    def __init__(self, nodes=None, balance=None, qlen_ttl=1,
+                 connect_timeout=0.5, health_interval=None):
         if nodes is None:
             nodes = ['localhost:7711']
-
+        assert balance in (None, 'round-robin', 'qlen')
+        self.balance = balance
+        self.qlen_ttl = qlen_ttl
+        # queue name -> tuple(expires, Node with the shortest queue)
+        self.shortest = {}
+        # tuple of queue names -> tuple(expires, dict of Node -> QLEN)
+        self.counts = {}
+        self.turn = 0
+        self.connect_timeout = connect_timeout
+        self.health_interval = health_interval
+        # pid of the process running the health check thread
+        self.health_pid = None
+
+        # host:port -> Node, node_id is None until the node answers HELLO
         self.nodes = {}
         for n in nodes:
-            self.nodes[n] = None
+            host, port = n.split(':')
+            port = int(port)
+            self.nodes[n] = Node(None, host, port,
+                                 self.new_connection(host, port))
 
         self.connected_node = None
+        # node ID prefix -> Node, for routing job commands to their owner
+        self.prefixes = {}
         self.connect()
 
+    def new_connection(self, host, port, timeout=None):
+        """
+        :param timeout: socket timeout of commands, None to block, e.g. in
+                        GETJOB
+        :rtype: redis.Redis
+        """
+        return redis.Redis(host, port, socket_timeout=timeout,
+                           socket_connect_timeout=self.connect_timeout)
+
     def connect(self):
         """
         Connect to disque nodes
 
-        Tries to connect to one of disque nodes, you can
-        get current connection with connected_node property
+        Connects to the first of the nodes that answers HELLO, skipping
+        nodes whose circuit is open unless all of them are, you can get
+        current connection with connected_node property
 
         :return: nothing
         """
+        now = time.time()
+        nodes = list(self.nodes.values())
+        for node in [n for n in nodes if n.available(now)] or nodes:
+            try:
+                ret = node.connection.execute_command('HELLO')
+            except NODE_ERRORS:
+                node.failed()
+                continue
+            node.recovered()
+            node.node_id = ret[1]
+            self.prefixes[node_prefix(node.node_id)] = node
+            self.add_cluster_nodes(ret[2:])
+            self.connected_node = node
+            logger.info("connected to node %s" % node)
+            return
         self.connected_node = None
-        for i, node in self.nodes.items():
-            host, port = i.split(':')
-            port = int(port)
-            redis_client = redis.Redis(host, port)
+        raise ConnectionError('couldnt connect to any nodes')
+
+    def failover(self, node):
+        """
+        Open the circuit of a node that failed, the next command connects
+        to another node if it was the connected node
+        :param node: Node, or None
+        """
+        if node is None:
+            return
+        node.failed()
+        logger.warning('node %s failed %d times in a row, skipped for '
+                       '%.1fs', node, node.failures,
+                       node.down_until - time.time())
+        if node is self.connected_node:
+            self.connected_node = None
+
+    def check_health(self):
+        """
+        PING every known node once, closing the circuit of nodes that
+        answer and opening it for nodes that don't
+        :return: list of failed nodes
+        """
+        failed = []
+        nodes = set(self.nodes.values()) | set(self.prefixes.values())
+        for node in nodes:
+            if node.probe is None:
+                node.probe = self.new_connection(
+                    node.host, node.port, timeout=self.connect_timeout)
+            try:
+                node.probe.ping()
+            except NODE_ERRORS:
+                self.failover(node)
+                failed.append(node)
+            else:
+                node.recovered()
+        return failed
+
+    def start_health_check(self):
+        """ run `check_health` every `health_interval` seconds in a
+        background thread, once per process """
+        if not self.health_interval or self.health_pid == os.getpid():
+            return
+        self.health_pid = os.getpid()
+
+        def run():
+            while True:
+                time.sleep(self.health_interval)
+                try:
+                    self.check_health()
+                except Exception:
+                    logger.exception('health check failed')
+
+        thread = threading.Thread(target=run, name='odq-health')
+        thread.daemon = True
+        thread.start()
+
+    def add_cluster_nodes(self, nodes):
+        """
+        Remember the cluster nodes listed by HELLO, connections to them are
+        only opened when a job command is routed to them
+        :param nodes: list of [node_id, host, port, priority]
+        """
+        for node_id, host, port, _ in nodes:
+            prefix = node_prefix(node_id)
+            if prefix not in self.prefixes:
+                host = host.decode() if isinstance(host, bytes) else host
+                port = int(port)
+                node = self.nodes.get('%s:%d' % (host, port))
+                if node is None:
+                    node = Node(node_id, host, port,
+                                self.new_connection(host, port))
+                node.node_id = node_id
+                self.prefixes[prefix] = node
+
+    def hashed_node(self, name):
+        """
+        Node picked by a hash of `name` over all known nodes, available or
+        not, so that every client of the cluster picks the same one, e.g.
+        for the jobs of a queue read with QPEEK or limited with MAXLEN,
+        which only see the jobs queued on the node they run on
+        :rtype: Node
+        """
+        prefixes = sorted(self.prefixes)
+        return self.prefixes[prefixes[zlib.crc32(name.encode()) %
+                                      len(prefixes)]]
+
+    def get_node(self, job_id):
+        """
+        returns the node owning a job, or the connected node if the owner is
+        unknown
+        :rtype: Node
+        """
+        return self.prefixes.get(node_prefix(job_id), self.connected_node)
+
+    def group_by_node(self, job_ids):
+        """
+        :return: OrderedDict of Node -> list of job_ids owned by the node
+        """
+        groups = OrderedDict()
+        for job_id in job_ids:
+            groups.setdefault(self.get_node(job_id), []).append(job_id)
+        return groups
+
+    def execute_on_owner(self, command, *job_ids):
+        """
+        Send `command` with job IDs to the nodes owning the jobs, one command
+        per node, this saves the cluster bus forwarding of the command.
+        If an owner can't be reached, its jobs go through the connected node.
+        :return: sum of replies
+        """
+        result = 0
+        for node, ids in self.group_by_node(job_ids).items():
+            result += self.execute_on_node(node, command, *ids)
+        return result
+
+    def cluster_nodes(self):
+        """ available nodes, in node ID order
+        :rtype: list of Node """
+        now = time.time()
+        return sorted((node for node in self.prefixes.values()
+                       if node.available(now)),
+                      key=lambda node: node.node_id)
+
+    def execute_on_node(self, node, *args):
+        """ send a command to `node`, or to the connected node if `node`
+        is None or unavailable, or failed before the command was sent or
+        on a command that may be sent again, see `send_command` """
+        if node is not None and node is not self.connected_node and \
+                node.available():
             try:
-                ret = redis_client.execute_command('HELLO')
-                node_id = ret[1]
-                self.nodes[i] = Node(node_id, host, port, redis_client)
-                self.connected_node = self.nodes[i]
-            except redis.exceptions.ConnectionError:
-                pass
-        if not self.connected_node:
-            raise Exception('couldnt connect to any nodes')
-        logger.info("connected to node %s" % self.connected_node)
+                return send_command(node.connection, *args)
+            except NODE_ERRORS as e:
+                self.failover(node)
+                if not getattr(e, 'retry', True):
+                    raise
+        return self.execute_command(*args)
+
+    def node_qlen(self, node, queues):
+        """ number of jobs queued on `node` in `queues`, QLENs are sent in
+        one pipeline """
+        if not node.available():
+            return float('inf')
+        pipeline = node.connection.pipeline(transaction=False)
+        for queue in queues:
+            pipeline.execute_command('QLEN', queue)
+        try:
+            return sum(pipeline.execute())
+        except NODE_ERRORS:
+            self.failover(node)
+            return float('inf')
+
+    def queue_counts(self, queues):
+        """ number of jobs queued in `queues` on each available node,
+        cached for `qlen_ttl` seconds
+        :return: dict of Node -> count """
+        key = tuple(queues)
+        expires, counts = self.counts.get(key, (0, None))
+        if expires < time.time():
+            counts = dict((n, self.node_qlen(n, queues))
+                          for n in self.cluster_nodes())
+            self.counts[key] = (time.time() + self.qlen_ttl, counts)
+        return counts
+
+    def pick_node(self, queue_name):
+        """ node to add a job of `queue_name` to, see `balance` """
+        nodes = self.cluster_nodes()
+        if not self.balance or len(nodes) < 2:
+            return self.connected_node
+        if self.balance == 'qlen':
+            expires, node = self.shortest.get(queue_name, (0, None))
+            if expires < time.time() or node not in nodes:
+                node = min(nodes, key=lambda n: self.node_qlen(n,
+                                                               [queue_name]))
+                self.shortest[queue_name] = (time.time() + self.qlen_ttl,
+                                             node)
+            return node
+        self.turn += 1
+        return nodes[self.turn % len(nodes)]
+
+    def poll_node(self, queues, node=None):
+        """
+        Node for a worker to poll `queues` on, GETJOB takes jobs queued on
+        the node it runs on at once, jobs of other nodes only once they are
+        moved over
+
+        :param node: node polled so far, kept unless another node holds
+                     more jobs, workers start on a random node, so that
+                     they poll the cluster concurrently, queue lengths
+                     are checked at most every `qlen_ttl` seconds
+        :return: Node, or None for the connected node without `balance`
+        """
+        if not self.balance or len(self.prefixes) < 2:
+            return None
+        counts = self.queue_counts(queues)
+        # without the nodes that failed meanwhile
+        nodes = [n for n in self.cluster_nodes() if n in counts]
+        if not nodes:
+            return None
+        if node not in nodes:
+            node = random.choice(nodes)
+        busiest = max(nodes, key=counts.get)
+        return busiest if counts[busiest] > counts[node] else node
 
     def get_connection(self):
         """
-        returns current connected_nodes connection
+        returns current connected_nodes connection, connects first after a
+        failover
         :rtype: redis.Redis
         """
-        return self.connected_node.connection
+        self.start_health_check()
+        node = self.connected_node
+        if node is None:
+            self.connect()
+            node = self.connected_node
+        return node.connection
 
     @retry()
-    def execute_command(self, *args, **kwargs):
+    def execute_command(self, *args):
+        node = self.connected_node
         try:
-            return self.get_connection().execute_command(*args, **kwargs)
-        except ConnectionError:
-            logger.warn('trying to reconnect')
-            self.connect()
-            logger.warn('connected')
+            connection = self.get_connection()
+            node = self.connected_node
+            return send_command(connection, *args)
+        except NODE_ERRORS:
+            self.failover(node)
+            raise
+
+    @retry()
+    def execute_pipeline(self, commands, node=None):
+        """
+        Send commands in one non-transactional pipeline, a pipeline with
+        WRITES is not sent again after an error, some of them may have been
+        applied
+        :param commands: list of commands, each a list of arguments
+        :param node: node to send them to, DEFAULT to the connected node
+        :return: list of replies, errors are returned in place of the reply
+                 instead of being raised
+        """
+        writes = any(is_write(command) for command in commands)
+        if node is not None and node is not self.connected_node and \
+                node.available():
+            pipeline = node.connection.pipeline(transaction=False)
+            for command in commands:
+                pipeline.execute_command(*command)
+            try:
+                return pipeline.execute(raise_on_error=False)
+            except NODE_ERRORS as e:
+                self.failover(node)
+                if writes or not isinstance(e, ConnectionError):
+                    e.retry = False
+                    raise
+        # errors raised while connecting are retried
+        connection = self.get_connection()
+        node = self.connected_node
+        try:
+            pipeline = connection.pipeline(transaction=False)
+            for command in commands:
+                pipeline.execute_command(*command)
+            return pipeline.execute(raise_on_error=False)
+        except NODE_ERRORS as e:
+            self.failover(node)
+            if writes or not isinstance(e, ConnectionError):
+                e.retry = False
             raise
 
     def add_job(self, queue_name, job, timeout=200, replicate=None, delay=None,
-                retry=8640, ttl=86400, maxlen=None, async=False):
+                retry=8640, ttl=86400, maxlen=None, async=False,
+                balanced=False):
         """
         ADDJOB queue_name job <ms-timeout> [REPLICATE <count>] [DELAY <sec>]
                [RETRY <sec>] [TTL <sec>] [MAXLEN <count>] [ASYNC]
@@ -157,8 +577,61 @@ class Client(object):
                       The job gets queued ASAP, while normally the job is put
                       into the queue only when the client gets a positive
                       reply.
+        :param balanced: spread the jobs of the queue over the nodes, see
+                         `balance`, for task queues only, other queues are
+                         read on the connected node
         :return: job_id
         """
+        command = self.add_job_command(queue_name, job, timeout, replicate,
+                                       delay, retry, ttl, maxlen, async)
+
+        logger.debug("sending job - %s", command)
+        node = self.pick_node(queue_name) if balanced else None
+        job_id = self.execute_on_node(node, *command)
+        logger.debug("sent job - %s", command)
+        logger.debug("job_id: %s " % job_id)
+        return job_id
+
+    def add_jobs(self, queue_name, jobs, chunk_size=1000, balanced=False,
+                 **options):
+        """
+        Add many jobs to the same queue, ADDJOB commands are sent in
+        pipelines of `chunk_size` commands, so a chunk costs one round-trip
+
+        :param queue_name: is the name of the queue
+        :param jobs: iterable of job strings
+        :param chunk_size: number of ADDJOB commands per pipeline
+        :param balanced: see `add_job`
+        :param options: timeout, replicate, delay, retry, ttl, maxlen and
+                        async, same as `add_job`
+        :return: list of job_id in the order of `jobs`, a job refused by the
+                 server (e.g. because of MAXLEN) gets its
+                 redis.exceptions.ResponseError instead of a job_id
+        :rtype: list
+        :raise: ConnectionError or TimeoutError of a chunk, which is not
+                sent again, its jobs may have been added
+        """
+        job_ids = []
+        commands = []
+        for job in jobs:
+            commands.append(self.add_job_command(queue_name, job, **options))
+            if len(commands) >= chunk_size:
+                node = self.pick_node(queue_name) if balanced else None
+                job_ids.extend(self.execute_pipeline(commands, node))
+                commands = []
+        if commands:
+            node = self.pick_node(queue_name) if balanced else None
+            job_ids.extend(self.execute_pipeline(commands, node))
+        logger.debug("sent %d jobs to %s", len(job_ids), queue_name)
+        return job_ids
+
+    def add_job_command(self, queue_name, job, timeout=200, replicate=None,
+                        delay=None, retry=8640, ttl=86400, maxlen=None,
+                        async=False):
+        """
+        Build an ADDJOB command, see `add_job` for the parameters
+        :rtype: list
+        """
         command = ['ADDJOB', queue_name, job, timeout]
 
         if replicate:
@@ -173,31 +646,34 @@ class Client(object):
             command += ['MAXLEN', maxlen]
         if async:
             command += ['ASYNC']
+        return command
 
-        logger.debug("sending job - %s", command)
-        job_id = self.execute_command(*command)
-        logger.debug("sent job - %s", command)
-        logger.debug("job_id: %s " % job_id)
-        return job_id
-
-    def get_job(self, queues, timeout=None, count=None):
+    def get_job(self, queues, timeout=None, count=None, nohang=False,
+                node=None):
         """
-        GETJOB [TIMEOUT <ms-timeout>] [COUNT <count>] FROM queue1 queue2 ...
-               queueN
+        GETJOB [NOHANG] [TIMEOUT <ms-timeout>] [COUNT <count>] FROM queue1
+               queue2 ... queueN
 
         :param queues: name of queues
+        :param timeout: max milliseconds to block waiting for jobs
+        :param count: max number of jobs to return
+        :param nohang: return immediately if no job is available
+        :param node: node to poll, see `poll_node`, DEFAULT to the connected
+                     node
         :return: list of tuple(queue_name, job_id, payload) - or empty list
         :rtype: list
         """
         assert queues
         command = ['GETJOB']
+        if nohang:
+            command += ['NOHANG']
         if timeout:
             command += ['TIMEOUT', timeout]
         if count:
             command += ['COUNT', count]
 
         command += ['FROM'] + queues
-        results = self.execute_command(*command)
+        results = self.execute_on_node(node, *command)
         if not results:
             return []
         return [(queue_name, job_id, payload)
@@ -209,7 +685,7 @@ class Client(object):
         Acknowledges the execution of one or more jobs via job IDs.
         :param job_ids: list of job_ids
         """
-        self.execute_command('ACKJOB', *job_ids)
+        self.execute_on_owner('ACKJOB', *job_ids)
 
     def fast_ack(self, *job_ids):
         """
@@ -217,7 +693,26 @@ class Client(object):
         Performs a best effort cluster wide deletion of the specified job IDs.
         :param job_ids:
         """
-        self.execute_command('FASTACK', *job_ids)
+        self.execute_on_owner('FASTACK', *job_ids)
+
+    def nack(self, *job_ids):
+        """
+        NACK jobid1 jobid2 ... jobidN
+        Put jobs back in their queues as soon as possible, and count a
+        failed delivery, e.g. when a worker gives up jobs on shutdown.
+        :param job_ids:
+        """
+        return self.execute_on_owner('NACK', *job_ids)
+
+    def working(self, job_id):
+        """
+        WORKING jobid
+        Claim to be still working on a job, postponing its next delivery
+        by its RETRY period.
+        :param job_id:
+        :return: seconds the delivery is postponed
+        """
+        return self.execute_on_owner('WORKING', job_id)
 
     def qlen(self, queue_name):
         """
@@ -246,14 +741,14 @@ class Client(object):
         Queue jobs if not already queued.
         :param job_ids:
         """
-        return self.execute_command("ENQUEUE", *job_ids)
+        return self.execute_on_owner("ENQUEUE", *job_ids)
 
     def dequeue(self, *job_ids):
         """
         Remove the job from the queue.
         :param job_ids: list of job_ids
         """
-        return self.execute_command("DEQUEUE", *job_ids)
+        return self.execute_on_owner("DEQUEUE", *job_ids)
 
     def del_job(self, *job_ids):
         """
@@ -263,11 +758,11 @@ class Client(object):
         Note that this is similar to FASTACK,
         :param job_ids:
         """
-        return self.execute_command("DELJOB", *job_ids)
+        return self.execute_on_owner("DELJOB", *job_ids)
 
     def show(self, job_id):
         """
-        Describe the job.
+        Describe the job, asks the node owning the job.
         :param job_id:
         """
-        return self.execute_command("SHOW", job_id)
+        return self.execute_on_node(self.get_node(job_id), "SHOW", job_id)
@@ -0,0 +1,151 @@
+""" Job Deduplication
+
+Calls of a task with `dedup` set are coalesced into a queued job with the
+same key, the call returns the id of that job instead of adding another.
+
+    @o.task(dedup=True, dedup_window=60)          # key is a hash of args
+    def reindex(user_id):
+        ...
+
+    @o.task(dedup=lambda user, **kwargs: user.id)  # key function
+    def notify(user, message=None):
+        ...
+
+A producer remembers the jobs it added in a local LRU. Across producers,
+the job id of a key is the body of a marker job in the queue
+`odq.dedup.<task>.<key>`, which lives `dedup_window` seconds. MAXLEN and
+QPEEK only see the jobs queued on the node they run on, so every producer
+sends marker commands to the node picked by a hash of the marker queue.
+Either way the job is only reused while SHOW reports it queued, so a call
+never coalesces into a job a worker already started.
+
+A call coalesced into a job the producer knows costs a SHOW instead of an
+ADDJOB. A call coalesced into a job of another producer costs a QPEEK and
+a SHOW. A call that isn't coalesced costs the ADDJOB of its job and of its
+marker, plus a QPEEK unless the producer knows the marker of the key.
+
+Direct task calls, `map` and `starmap` are deduplicated, `map` and
+`starmap` add the jobs one by one instead of in pipelines. `aio` calls
+are not deduplicated.
+Tasks with `result` can't be deduplicated, the result of a job goes to
+the producer that added it.
+"""
+import time
+import pickle
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from redis.exceptions import ResponseError
+
+
+logger = logging.getLogger('odq')
+
+# states of a job that no worker has started yet
+PENDING = (b'queued', b'delayed', 'queued', 'delayed')
+
+
+class Dedup(object):
+    """
+    :param odq: Odq instance
+    :param size: max keys in the local LRU
+    """
+
+    def __init__(self, odq, size=10000):
+        self.odq = odq
+        self.size = size
+        # (task, key) -> tuple(job id, expires, id of its marker or None)
+        self.local = OrderedDict()
+        self.lock = threading.Lock()
+
+    def key(self, func, config, args, kwargs):
+        """ dedup key of a call, hashed so that it fits in a queue name """
+        dedup = config['dedup']
+        if callable(dedup):
+            data = str(dedup(*args, **kwargs)).encode()
+        else:
+            data = pickle.dumps((args, sorted(kwargs.items())), 2)
+        return hashlib.sha1(data).hexdigest()
+
+    def pending(self, jobid):
+        """ whether a job is queued and not started yet """
+        job = self.odq.disque_client.show(jobid)
+        if not job:
+            return False
+        return dict(zip(job[::2], job[1::2])).get(b'state') in PENDING
+
+    def execute(self, marker_queue, *args):
+        """ send a command to the node holding the marker of a key """
+        client = self.odq.disque_client
+        if getattr(client, 'prefixes', None):
+            return client.execute_on_node(client.hashed_node(marker_queue),
+                                          *args)
+        return client.execute_command(*args)
+
+    def remember(self, local_key, jobid, window, marker=None):
+        with self.lock:
+            self.local[local_key] = (jobid, time.time() + window, marker)
+            self.local.move_to_end(local_key)
+            while len(self.local) > self.size:
+                self.local.popitem(last=False)
+
+    def lookup(self, local_key, marker_queue, window):
+        """ look the marker of a key up in the broker
+        :return: tuple(id of a pending job or None, id of a marker whose
+                 job started or None) """
+        markers = self.execute(marker_queue, 'QPEEK', marker_queue, 1)
+        if markers:
+            _, marker, jobid = markers[0]
+            if self.pending(jobid):
+                self.remember(local_key, jobid, window, marker)
+                return jobid, None
+            return None, marker
+        return None, None
+
+    def find(self, local_key, marker_queue, window):
+        """ see `lookup`, a key known locally isn't looked up """
+        with self.lock:
+            entry = self.local.get(local_key)
+        if entry and entry[1] > time.time():
+            jobid, _, marker = entry
+            if self.pending(jobid):
+                return jobid, None
+            if marker:
+                return None, marker
+        return self.lookup(local_key, marker_queue, window)
+
+    def add_job(self, func, config, args, kwargs):
+        """
+        Add a job of a task call, unless a job with the same key is pending
+        :return: job id
+        """
+        client = self.odq.disque_client
+        window = int(config.get('dedup_window') or 60)
+        key = self.key(func, config, args, kwargs)
+        local_key = (func.__name__, key)
+        marker_queue = 'odq.dedup.{}.{}'.format(func.__name__, key)
+
+        jobid, stale = self.find(local_key, marker_queue, window)
+        if jobid:
+            return jobid
+        if stale:
+            # its job started, make room for a new marker
+            client.fast_ack(stale)
+
+        queue, options = self.odq.job_options(func, config)
+        jobid = client.add_job(queue, self.odq.encode_job(func, config, args,
+                                                          kwargs), **options)
+        marker = None
+        try:
+            marker = self.execute(marker_queue, 'ADDJOB', marker_queue, jobid,
+                                  200, 'TTL', window, 'MAXLEN', 1, 'ASYNC')
+        except ResponseError:
+            # another producer added a job with the key meanwhile, take
+            # ours back if no worker has it yet
+            other, _ = self.lookup(local_key, marker_queue, window)
+            if other and other != jobid and client.dequeue(jobid):
+                client.fast_ack(jobid)
+                return other
+        self.remember(local_key, jobid, window, marker)
+        return jobid
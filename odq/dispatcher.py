@@ -0,0 +1,201 @@
+""" Prefetching Dispatcher
+
+Sub workers usually take one job each with a blocking GETJOB, run it and
+block in ACKJOB, so every job waits for two round-trips to disque. With
+`--dispatch`, a process runs
+
+    one fetcher: takes jobs with GETJOB COUNT into a bounded local buffer
+    executors: run the jobs of the buffer, as threads or greenlets
+    one acker: acks the jobs executed within `interval` seconds with a
+               single ACKJOB
+
+The fetcher takes a job for every idle executor, plus up to `prefetch`
+more, so executors don't wait for disque. How many more adapts to the
+load: one more whenever an executor finds the buffer empty, one less
+whenever the fetcher finds jobs still waiting in it. Jobs waiting in the
+buffer are held by the heartbeat, like running ones.
+
+On shutdown the fetcher stops, executors finish the job they run, and the
+jobs left in the buffer are NACKed, so that other workers take them at
+once.
+"""
+import queue
+import logging
+import threading
+
+
+logger = logging.getLogger('odq')
+
+# GETJOB timeout in milliseconds, the fetcher checks between polls whether
+# it has to stop
+POLL_TIMEOUT = 1000
+
+
+class Acker(object):
+    """
+    Acks executed jobs in the background, many at once
+
+    :param ack: called with the list of jobs to ack
+    :param interval: max seconds a job waits for its ACKJOB
+    :param size: max jobs per ACKJOB
+    :param failed: called with the jobs `ack` raised for, e.g. to release
+                   them from the heartbeat, so that disque delivers them
+                   again after their RETRY period
+    """
+
+    def __init__(self, ack, interval=0.05, size=1000, failed=None):
+        self.ack = ack
+        self.failed = failed or (lambda jobs: None)
+        self.interval = interval
+        self.size = size
+        self.jobs = []
+        self.closed = False
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, jobs):
+        with self.cond:
+            self.jobs.extend(jobs)
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.jobs or self.closed)
+                # coalesce the jobs of the next `interval` seconds
+                self.cond.wait_for(
+                    lambda: len(self.jobs) >= self.size or self.closed,
+                    timeout=self.interval)
+                jobs, self.jobs = self.jobs[:self.size], self.jobs[self.size:]
+                closed = self.closed and not self.jobs
+            if jobs:
+                try:
+                    self.ack(jobs)
+                except Exception:
+                    logger.exception('acking %d jobs failed', len(jobs))
+                    self.failed(jobs)
+            if closed:
+                return
+
+    def close(self):
+        """ ack the jobs left and stop """
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+
+
+class Dispatcher(object):
+    """
+    :param client: disque client
+    :param order: QueueOrder of the polled queues
+    :param execute: called by executors with tuple(queue, jobid, payload)
+    :param concurrency: number of executors
+    :param prefetch: max jobs fetched on top of one per idle executor,
+                     DEFAULT to `concurrency`
+    :param heartbeat: Heartbeat holding fetched jobs
+    :param retry: called with a queue name, RETRY period of its jobs
+                  until they run, when the RETRY of their meta applies
+    :param stopped: called between jobs, whether to stop
+    """
+
+    def __init__(self, client, order, execute, concurrency, prefetch=None,
+                 heartbeat=None, retry=None, stopped=None):
+        self.client = client
+        self.order = order
+        self.execute = execute
+        self.concurrency = concurrency
+        self.prefetch = concurrency if prefetch is None else prefetch
+        self.heartbeat = heartbeat
+        self.retry = retry or (lambda queue: None)
+        self.stopped = stopped or (lambda: False)
+        self.buffer = queue.Queue(concurrency + self.prefetch)
+        # jobs fetched on top of one per idle executor
+        self.ahead = 0
+        self.idle = 0
+        self.cond = threading.Condition()
+        # node of a balancing client to poll, see `Client.poll_node`
+        self.node = None
+
+    def __repr__(self):
+        return '<Dispatcher %d executors, %d ahead>' % (
+            self.concurrency, self.ahead)
+
+    def wanted(self):
+        """ number of jobs to fetch, should be called with self.cond held """
+        buffered = self.buffer.qsize()
+        return min(self.idle + self.ahead - buffered,
+                   self.buffer.maxsize - buffered)
+
+    def fetch(self):
+        while not self.stopped():
+            with self.cond:
+                if self.buffer.qsize() and self.ahead:
+                    # jobs wait, executors keep up without them
+                    self.ahead -= 1
+                count = self.wanted()
+                if count <= 0:
+                    self.cond.wait(POLL_TIMEOUT / 1000)
+                    continue
+            queues = self.order.next()
+            results = self.client.get_job(queues, timeout=POLL_TIMEOUT,
+                                          count=count, node=self.node)
+            if not results and hasattr(self.client, 'poll_node'):
+                self.node = self.client.poll_node(queues, self.node)
+            for result in results:
+                self.order.served(result[0])
+                if self.heartbeat is not None:
+                    self.heartbeat.add(self.client, self.retry(result[0]),
+                                       result[1])
+                self.buffer.put(result)
+
+    def work(self):
+        while not self.stopped():
+            try:
+                result = self.buffer.get_nowait()
+            except queue.Empty:
+                with self.cond:
+                    # starving, fetch more ahead
+                    self.ahead = min(self.ahead + 1, self.prefetch)
+                    self.idle += 1
+                    self.cond.notify()
+                try:
+                    result = self.buffer.get(timeout=POLL_TIMEOUT / 1000)
+                except queue.Empty:
+                    continue
+                finally:
+                    with self.cond:
+                        self.idle -= 1
+            try:
+                self.execute(result)
+            except Exception:
+                logger.exception('executing job %s failed', result[1])
+
+    def drain(self):
+        """ NACK the jobs left in the buffer
+        :return: number of jobs NACKed """
+        job_ids = []
+        while True:
+            try:
+                job_ids.append(self.buffer.get_nowait()[1])
+            except queue.Empty:
+                break
+        if job_ids:
+            self.client.nack(*job_ids)
+            if self.heartbeat is not None:
+                self.heartbeat.remove(*job_ids)
+            logger.info('NACKed %d prefetched jobs', len(job_ids))
+        return len(job_ids)
+
+    def run(self):
+        """ fetch and execute jobs until stopped """
+        threads = [threading.Thread(target=self.fetch)] + \
+            [threading.Thread(target=self.work)
+             for _ in range(self.concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.drain()
@@ -0,0 +1,138 @@
+""" Heartbeats and Graceful Shutdown
+
+A worker registers the jobs it holds, from GETJOB until they are acked
+or given up. A background thread sends WORKING for jobs held longer than
+half of their RETRY period, so disque doesn't deliver them again while
+they run, and a short RETRY only matters for workers that died.
+
+On SIGTERM or SIGINT, workers stop fetching jobs and finish the ones they
+hold. Jobs still held after the grace period are NACKed, i.e. queued
+again right away for other workers, and the process exits.
+"""
+import os
+import time
+import signal
+import logging
+import threading
+
+from redis.exceptions import ResponseError
+
+
+logger = logging.getLogger('odq')
+
+
+class Heartbeat(object):
+    """
+    Jobs held by the workers of a process
+
+    :param fraction: share of the RETRY period after which WORKING is sent
+    """
+
+    def __init__(self, fraction=0.5):
+        self.fraction = fraction
+        # job id -> [client, seconds between heartbeats, last heartbeat]
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.pid = None
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def add(self, client, retry, *job_ids):
+        """ hold jobs, jobs held already keep their last heartbeat, e.g.
+        when a job fetched by a dispatcher gets the RETRY of its meta
+        :param client: disque client the jobs were fetched with
+        :param retry: RETRY period of the jobs, 0 or None for no heartbeat
+        """
+        interval = retry * self.fraction if retry else None
+        now = time.time()
+        with self.lock:
+            for job_id in job_ids:
+                last = self.jobs[job_id][2] if job_id in self.jobs else now
+                self.jobs[job_id] = [client, interval, last]
+        if interval and self.pid != os.getpid():
+            # started lazily, and again in a forked child
+            self.pid = os.getpid()
+            t = threading.Thread(target=self.run)
+            t.daemon = True
+            t.start()
+        if interval:
+            self.wakeup.set()
+
+    def remove(self, *job_ids):
+        """ release jobs that were acked or failed """
+        with self.lock:
+            for job_id in job_ids:
+                self.jobs.pop(job_id, None)
+
+    def beat(self, now=None):
+        """
+        Send WORKING for jobs that are due
+        :return: seconds until the next heartbeat is due
+        """
+        now = now or time.time()
+        with self.lock:
+            due = [(job_id, job) for job_id, job in self.jobs.items()
+                   if job[1] and now - job[2] >= job[1]]
+        for job_id, job in due:
+            try:
+                job[0].working(job_id)
+            except ResponseError:
+                # acked meanwhile
+                self.remove(job_id)
+            except Exception:
+                logger.exception('heartbeat of job %s failed', job_id)
+            job[2] = now
+        with self.lock:
+            waits = [job[2] + job[1] - now for job in self.jobs.values()
+                     if job[1]]
+        return min(waits) if waits else None
+
+    def run(self):
+        while True:
+            wait = self.beat()
+            self.wakeup.clear()
+            self.wakeup.wait(max(0.1, min(wait, 60)) if wait else 60)
+
+    def nack_all(self):
+        """ give all held jobs back to disque
+        :return: number of jobs NACKed """
+        with self.lock:
+            jobs, self.jobs = self.jobs, {}
+        by_client = {}
+        for job_id, (client, _, _) in jobs.items():
+            by_client.setdefault(client, []).append(job_id)
+        for client, job_ids in by_client.items():
+            try:
+                client.nack(*job_ids)
+            except Exception:
+                logger.exception('NACK of %d jobs failed', len(job_ids))
+        return len(jobs)
+
+    def shutdown(self, grace):
+        """ stop fetching, and give held jobs back after `grace` seconds """
+        if self.stopping.is_set():
+            return
+        self.stopping.set()
+        logger.info('stopping, %d jobs in flight, grace period %s seconds',
+                    len(self), grace)
+
+        def expire():
+            if self.jobs:
+                logger.warning('grace period over, NACKed %d jobs',
+                               self.nack_all())
+                os._exit(1)
+
+        t = threading.Timer(grace, expire)
+        t.daemon = True
+        t.start()
+
+    def install(self, grace=30):
+        """ shut down on SIGTERM and SIGINT, must be called in the main
+        thread """
+        def handler(signum, frame):
+            self.shutdown(grace)
+        signal.signal(signal.SIGTERM, handler)
+        signal.signal(signal.SIGINT, handler)
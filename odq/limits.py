@@ -0,0 +1,91 @@
+""" Concurrency Limits
+
+The slots of a limited queue are token jobs in the queue
+`odq.slots.<queue>`, so the limit holds cluster wide.
+
+A worker leases a slot by taking a token with GETJOB, and releases it
+with ENQUEUE once its job is acked or failed. Tokens have a short RETRY,
+the lease, which the heartbeat of the worker renews with WORKING while it
+holds them, however long its job runs. If the worker dies, disque puts
+its tokens back once their lease is over.
+"""
+import time
+import logging
+import threading
+
+
+logger = logging.getLogger('odq')
+
+
+class Limiter(object):
+    """
+    Cluster wide limit of jobs of `queue` being executed at the same time
+
+    :param odq: Odq instance
+    :param queue: queue name
+    :param limit: max number of jobs executed at the same time
+    :param lease: seconds after which the slot of a dead worker is freed
+    :param interval: seconds between checks of the number of tokens
+    :param heartbeat: Heartbeat renewing the lease of the tokens held
+    """
+
+    def __init__(self, odq, queue, limit, lease=30, interval=60,
+                 heartbeat=None):
+        self.odq = odq
+        self.queue = queue
+        self.limit = limit
+        self.lease = lease
+        self.interval = interval
+        self.heartbeat = heartbeat
+        self.slots_queue = 'odq.slots.{}'.format(queue)
+        self.reconciled_at = 0
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return '<Limiter %s:%s>' % (self.queue, self.limit)
+
+    def reconcile(self):
+        """
+        Make the number of tokens match the limit
+
+        Tokens go missing when they expire and are duplicated when workers
+        reconcile at the same time, so this runs every `interval` seconds.
+        """
+        client = self.odq.disque_client
+        queued = list(self.odq.iter_jobs(self.slots_queue, 'queued'))
+        active = self.odq.count_jobs(self.slots_queue, 'active')
+        missing = self.limit - len(queued) - active
+        if missing > 0:
+            client.add_jobs(self.slots_queue, [b'slot'] * missing,
+                            retry=self.lease, ttl=86400 * 7)
+        elif missing < 0 and queued:
+            client.fast_ack(*queued[:-missing])
+        self.reconciled_at = time.time()
+        if missing:
+            logger.info('%s tokens adjusted by %d', self, missing)
+
+    def acquire(self):
+        """
+        Take a slot without waiting
+        :return: token, or None if all slots are taken
+        """
+        if time.time() - self.reconciled_at > self.interval:
+            # one thread reconciles, the others go on with current tokens
+            if self.lock.acquire(False):
+                try:
+                    self.reconcile()
+                finally:
+                    self.lock.release()
+        client = self.odq.disque_client
+        results = client.get_job([self.slots_queue], nohang=True)
+        if results:
+            token = results[0][1]
+            if self.heartbeat is not None:
+                self.heartbeat.add(client, self.lease, token)
+            return token
+
+    def release(self, token):
+        """ give a slot back """
+        if self.heartbeat is not None:
+            self.heartbeat.remove(token)
+        self.odq.disque_client.enqueue(token)
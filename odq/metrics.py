@@ -0,0 +1,193 @@
+""" Worker Metrics
+
+Per task counters and latency histograms, rendered in the prometheus text
+format and exported by sinks, i.e. a text file rewritten periodically, or
+a local HTTP endpoint.
+
+latencies recorded by workers:
+    odq_queue_wait_seconds: enqueue to start of execution, for jobs
+                            stamped by producers with `timestamp=True`
+    odq_execution_seconds: execution of the task function
+    odq_ack_seconds: ACKJOB round-trip
+
+counters:
+    odq_jobs_total: executed jobs, by status ok or failed
+    odq_cache_total: cache lookups of tasks with `cache`, by result hit or
+                     miss
+"""
+import os
+import time
+import logging
+import threading
+from collections import defaultdict
+
+
+logger = logging.getLogger('odq')
+
+BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10,
+           30, 60, 300)
+
+
+class Histogram(object):
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics(object):
+    """ counters and histograms keyed by metric name and task name """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(int)
+        self.histograms = {}
+
+    def inc(self, name, task, n=1, **labels):
+        key = (name, task, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += n
+
+    def observe(self, name, task, value):
+        with self.lock:
+            h = self.histograms.get((name, task))
+            if h is None:
+                h = self.histograms[(name, task)] = Histogram()
+            h.observe(value)
+
+    def executed(self, task, metas, started, seconds, ok=True):
+        """
+        Record jobs executed by one call of a task
+
+        :param metas: meta of each job, a batch call executes many jobs
+        :param started: unix time the execution started
+        :param seconds: execution time
+        """
+        self.inc('odq_jobs_total', task, len(metas),
+                 status='ok' if ok else 'failed')
+        self.observe('odq_execution_seconds', task, seconds)
+        for meta in metas:
+            if 't' in meta:
+                self.observe('odq_queue_wait_seconds', task,
+                             max(0, started - meta['t']))
+
+    def render(self):
+        """ :return: metrics in the prometheus text format """
+        lines = []
+        with self.lock:
+            names = set()
+            for (name, task, labels), value in sorted(self.counters.items()):
+                if name not in names:
+                    names.add(name)
+                    lines.append('# TYPE {} counter'.format(name))
+                labels = ''.join(',{}="{}"'.format(k, v) for k, v in labels)
+                lines.append('{}{{task="{}"{}}} {}'.format(name, task, labels,
+                                                           value))
+            for (name, task), h in sorted(self.histograms.items()):
+                if name not in names:
+                    names.add(name)
+                    lines.append('# TYPE {} histogram'.format(name))
+                total = 0
+                for le, n in zip(h.buckets + ('+Inf', ), h.counts):
+                    total += n
+                    lines.append('{}_bucket{{task="{}",le="{}"}} {}'
+                                 ''.format(name, task, le, total))
+                lines.append('{}_sum{{task="{}"}} {}'.format(name, task,
+                                                             h.sum))
+                lines.append('{}_count{{task="{}"}} {}'.format(name, task,
+                                                               h.count))
+        return '\n'.join(lines) + '\n'
+
+
+class FileSink(object):
+    """
+    Rewrite `path` with the rendered metrics every `interval` seconds,
+    e.g. for the textfile collector of the prometheus node exporter
+
+    the file is replaced atomically, so readers never see half of it
+    """
+
+    def __init__(self, metrics, path, interval=10):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+
+    def write(self):
+        tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(self.metrics.render())
+        os.rename(tmp, self.path)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.write()
+            except Exception:
+                logger.exception('writing metrics to %s failed', self.path)
+
+    def start(self):
+        t = threading.Thread(target=self.run)
+        t.daemon = True
+        t.start()
+
+
+class HttpSink(object):
+    """ serve the rendered metrics on http://<host>:<port>/metrics """
+
+    def __init__(self, metrics, port, host='127.0.0.1'):
+        self.metrics = metrics
+        self.port = port
+        self.host = host
+
+    def start(self):
+        from http.server import HTTPServer, BaseHTTPRequestHandler
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer((self.host, self.port), Handler)
+        t = threading.Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+        logger.info('serving metrics on http://%s:%d/metrics',
+                    self.host, self.port)
+
+
+def setup(path=None, port=None, index=0):
+    """
+    :param path: metrics file, `{index}` and `{pid}` are replaced by the
+                 worker process index and id
+    :param port: metrics HTTP port, worker process `index` listens on
+                 `port + index`
+    :return: Metrics exported by the sinks, or None if neither is set
+    """
+    if not path and not port:
+        return None
+    metrics = Metrics()
+    if path:
+        FileSink(metrics, path.format(index=index, pid=os.getpid())).start()
+    if port:
+        HttpSink(metrics, port + index).start()
+    return metrics
@@ -1,31 +1,93 @@
 """ Task Manager """
 import time
+import inspect
 import logging
-from pickle import dumps
+import importlib
+from functools import partial
 
 from crontab import CronTab
 
 from .client import Client
+from .stats import QueueStats
+from .cache import ResultCache
+from .dedup import Dedup
+from .workflow import Signature
+from .retries import dead_queue, add_options
+from .results import Results, AsyncResult
+from .serializers import PickleSerializer, loads, task_id
 
 
 logger = logging.getLogger('odq')
 
 
+async def awaitable(result):
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+async def then(coro, fn):
+    return fn(await coro)
+
+
 class Odq(object):
     queues = set()
     configs = {}
+    task_ids = {}
+    # task registry of the process, task name -> task, and qualified name,
+    # i.e. module:func -> task
+    tasks = {}
+    registry = {}
 
     def __init__(self, disque_client=None, queue=None,
                  debug=False, ttl=86400, retry=8640,
-                 max_workers=None):
+                 max_workers=None, aio_client=None, serializer=None,
+                 stats_ttl=5, result_ttl=3600, timestamp=False,
+                 blob_store=None, include=None, profile=None):
         if not disque_client:
             disque_client = Client()
         self.disque_client = disque_client
+        self._aio_client = aio_client
         self.debug = debug
         self.queue = queue
         self.ttl = ttl
         self.retry = retry
         self.max_workers = max_workers
+        self.serializer = serializer or PickleSerializer()
+        # stamp payloads with the enqueue time, for queue wait metrics
+        self.timestamp = timestamp
+        # BlobStore for large arguments
+        self.blob_store = blob_store
+        # modules with tasks, imported by workers along with the odq object
+        self.include = list(include or [])
+        # fraction of task executions profiled by workers, see `profiling`
+        self.profile = profile
+        self.stats = QueueStats(self, ttl=stats_ttl)
+        self.results = Results(self.disque_client, ttl=result_ttl)
+        self.dedup = Dedup(self)
+        self.cache = ResultCache(self)
+
+    @property
+    def aio_client(self):
+        """ AsyncClient on the same nodes as disque_client, created lazily
+        so that it binds to the event loop it is first used in
+        :raise: RuntimeError if disque_client has no nodes, e.g. a
+                MemoryBroker, and no `aio_client` was given """
+        if self._aio_client is None:
+            from .aioclient import AsyncClient
+            nodes = getattr(self.disque_client, 'nodes', None)
+            if nodes is None:
+                raise RuntimeError(
+                    '{} has no asyncio client, .aio() calls and asyncio '
+                    'workers need a Client of disque nodes'.format(
+                        type(self.disque_client).__name__))
+            self._aio_client = AsyncClient(list(nodes) if nodes else None)
+        return self._aio_client
+
+    def discover(self):
+        """ import the modules of `include`, registering their tasks """
+        for module in self.include:
+            importlib.import_module(module)
 
     def get_config(self):
         return {
@@ -34,12 +96,112 @@ class Odq(object):
             'retry': self.retry,
             'debug': self.debug,
             'max_workers': self.max_workers,
+            'serializer': self.serializer,
+            'timestamp': self.timestamp,
+            'blob_store': self.blob_store,
+            'profile': self.profile,
         }
 
     def add_queue(self, queue):
         if self.queue is None:
             self.queues.add(queue)
 
+    def job_options(self, func, config):
+        """ queue name and ADDJOB options of a task call
+
+        :param func: the task function, or its name
+        :param config: task config
+        :return: tuple(queue_name, options for `Client.add_job`)
+        """
+        queue = config['queue']
+        if queue is None:
+            queue = func if isinstance(func, str) else func.__name__
+        delay = config.get('delay') or 0
+        if 'at' in config:
+            delay += config['at'].timestamp() - time.time()
+        elif 'cron' in config:
+            cron = config['cron']
+            delay += CronTab(cron).next()
+        return queue, {
+            'timeout': config.get('timeout', 200),
+            'replicate': config.get('replicate'),
+            'delay': delay,
+            'ttl': config.get('ttl'),
+            'retry': config.get('retry'),
+            'maxlen': config.get('maxlen'),
+            'async': config.get('async', False),
+            # internal queues are read on the connected node
+            'balanced': True,
+        }
+
+    def job_meta(self, config):
+        """ metadata carried by the payload of a task call """
+        meta = {}
+        if config.get('result'):
+            meta.update(self.results.meta(config))
+        if config.get('timestamp'):
+            meta['t'] = time.time()
+        return meta
+
+    def job_retry(self, funcname, meta):
+        """ RETRY period a job was added with, in seconds, or None, the
+        task's unless the call changed it """
+        return meta.get('retry', self.configs[funcname].get('retry'))
+
+    def encode_job(self, func, config, args, kwargs):
+        """ payload of a task call, encoded by the task's serializer, large
+        arguments go to the task's blob store """
+        meta = self.job_meta(config)
+        if config.get('retry') != self.configs[func.__name__].get('retry'):
+            # e.g. `with_config(retry=...)`, see `job_retry`
+            meta['retry'] = config.get('retry')
+        if config.get('blob_store'):
+            args, kwargs = config['blob_store'].offload(
+                args, kwargs, meta, config.get('ttl') or self.ttl)
+        return config['serializer'].dumps(func.__name__, args, kwargs, meta)
+
+    def add_step(self, step, meta):
+        """ add a job of a workflow step, see `workflow`
+
+        :param step: tuple(task name, args, kwargs)
+        :param meta: job meta, e.g. the steps that follow
+        :return: job id
+        """
+        name, args, kwargs = step
+        config = self.configs[name]
+        if config.get('timestamp'):
+            meta = dict(meta, t=time.time())
+        queue, options = self.job_options(name, config)
+        return self.disque_client.add_job(
+            queue, config['serializer'].dumps(name, tuple(args), kwargs, meta),
+            **options)
+
+    def wrap_result(self, config, jobid):
+        """ what a task call returns, job id or AsyncResult """
+        if config.get('result') and not isinstance(jobid, Exception):
+            return AsyncResult(self.results, jobid)
+        return jobid
+
+    def get_many(self, results, timeout=None, return_exceptions=False):
+        """ wait for many AsyncResult, see `Results.get_many` """
+        return self.results.get_many(results, timeout, return_exceptions)
+
+    def decode_job(self, payload):
+        """ decode a payload of any serializer
+
+        :return: tuple(funcname, args, kwargs, meta)
+        """
+        name, args, kwargs, meta = loads(payload, self.task_ids)
+        if meta.get('blobs'):
+            args, kwargs = self.configs[name]['blob_store'].load(meta)
+        return name, args, kwargs, meta
+
+    def release_jobs(self, names, metas):
+        """ free what acked jobs held, i.e. their blobs """
+        for name, meta in zip(names, metas):
+            if meta.get('blobs'):
+                self.configs[name]['blob_store'].release(meta)
+
     def task(self, func=None, **config):
         def wrapper(func):
             config = self.get_config()
@@ -48,14 +210,21 @@ class Odq(object):
         def wrapper_with_config(config):
             def outer(func):
                 def with_config(**config):
-                    def deco(*args, **kwargs):
-                        oldconfig = func.__odq__
-                        newconfig = oldconfig.copy()
-                        newconfig.update(config)
-                        setattr(func, '__odq__', newconfig)
-                        result = inner(*args, **kwargs)
-                        setattr(func, '__odq__', oldconfig)
-                        return result
+                    def swap(fn):
+                        def deco(*args, **kwargs):
+                            oldconfig = func.__odq__
+                            newconfig = oldconfig.copy()
+                            newconfig.update(config)
+                            setattr(func, '__odq__', newconfig)
+                            result = fn(*args, **kwargs)
+                            setattr(func, '__odq__', oldconfig)
+                            return result
+                        return deco
+
+                    deco = swap(inner)
+                    setattr(deco, 'aio', swap(aio))
+                    setattr(deco, 'map', swap(map))
+                    setattr(deco, 'starmap', swap(starmap))
                     return deco
 
                 def run(*args, **kwargs):
@@ -64,40 +233,70 @@ class Odq(object):
                 def inner(*args, **kwargs):
                     config = func.__odq__
                     if config['debug']:
+                        if config.get('batch'):
+                            return func([(args, kwargs)])
                         return func(*args, **kwargs)
+                    elif config.get('dedup'):
+                        jobid = self.dedup.add_job(func, config, args, kwargs)
+                        return self.wrap_result(config, jobid)
                     else:
-                        queue = config['queue']
-                        if queue is None:
-                            queue = func.__name__
-                        delay = config.get('delay') or 0
-                        if 'at' in config:
-                            delay += config['at'].timestamp() - time.time()
-                        elif 'cron' in config:
-                            cron = config['cron']
-                            delay += CronTab(cron).next()
+                        queue, options = self.job_options(func, config)
                         jobid = self.disque_client.add_job(
                             queue_name=queue,
-                            job=dumps([func.__name__, args, kwargs]),
-                            timeout=config.get('timeout', 200),
-                            replicate=config.get('replicate'),
-                            delay=delay,
-                            ttl=config.get('ttl'),
-                            retry=config.get('retry'),
-                            maxlen=config.get('maxlen'),
-                            async=config.get('async', False))
-                        return jobid
-
-                    return inner
+                            job=self.encode_job(func, config, args, kwargs),
+                            **options)
+                        return self.wrap_result(config, jobid)
+
+                def aio(*args, **kwargs):
+                    # config is read here and not in a coroutine,
+                    # so that with_config(...).aio(...) works
+                    config = func.__odq__
+                    if config['debug']:
+                        return awaitable(inner(*args, **kwargs))
+                    queue, options = self.job_options(func, config)
+                    return then(self.aio_client.add_job(
+                        queue, self.encode_job(func, config, args, kwargs),
+                        **options), partial(self.wrap_result, config))
+
+                def map(iterable, chunk_size=1000):
+                    return starmap(((arg, ) for arg in iterable),
+                                   chunk_size=chunk_size)
 
+                def starmap(iterable, chunk_size=1000):
+                    config = func.__odq__
+                    if config['debug'] or config.get('dedup'):
+                        # deduplicated one call at a time, not pipelined
+                        return [inner(*args) for args in iterable]
+                    queue, options = self.job_options(func, config)
+                    jobids = self.disque_client.add_jobs(
+                        queue,
+                        (self.encode_job(func, config, tuple(args), {})
+                         for args in iterable),
+                        chunk_size=chunk_size,
+                        **options)
+                    return [self.wrap_result(config, jobid)
+                            for jobid in jobids]
+
+                self.register(func, inner)
                 self.add_queue(func.__name__)
                 self.configs[func.__name__] = config
+                self.task_ids[task_id(func.__name__)] = func.__name__
                 setattr(func, '__odq__', config)
                 setattr(inner, 'with_config', with_config)
                 setattr(inner, 'run', run)
+                setattr(inner, 'aio', aio)
+                setattr(inner, 'map', map)
+                setattr(inner, 'starmap', starmap)
+                setattr(inner, 's', lambda *args, **kwargs: Signature(
+                    self, inner, args, kwargs))
                 setattr(inner, '__func__', func)
                 return inner
             return outer
 
+        if config.get('dedup') and config.get('result'):
+            raise ValueError('dedup and result can\'t be combined, a call '
+                             'coalesced into the job of another producer '
+                             'would never get its result')
         if not config and callable(func):
             return wrapper(func)
         else:
@@ -105,16 +304,103 @@ class Odq(object):
             newconfig.update(config)
             return wrapper_with_config(newconfig)
 
-    def filter_jobs(self, queue, state, count=100):
+    def register(self, func, task):
+        """ add a task to the registry, payloads name tasks by function
+        name, so it must be unique across modules, compact payloads by
+        `task_id`, so ids must be unique too
+        :raise: ValueError if a task of another module has the name, or
+                another task has the id """
+        other = self.task_ids.get(task_id(func.__name__), func.__name__)
+        if other != func.__name__:
+            raise ValueError('tasks {} and {} have the same task id, rename '
+                             'one of them'.format(func.__name__, other))
+        qualified = '{}:{}'.format(func.__module__, func.__name__)
+        previous = self.tasks.get(func.__name__)
+        if previous is not None and previous.qualified_name != qualified:
+            raise ValueError('task {} has the name of {}, jobs of both would '
+                             'run {}'.format(qualified,
+                                             previous.qualified_name,
+                                             qualified))
+        setattr(task, 'qualified_name', qualified)
+        self.tasks[func.__name__] = task
+        self.registry[qualified] = task
+
+    def get_task(self, name):
+        """ :return: task by name, or by qualified name, i.e. module:func """
+        return self.tasks.get(name) or self.registry[name]
+
+    def iter_jobs(self, queue, state, count=100):
+        """
+        Iterate over job ids with JSCAN, one page of `count` jobs is
+        fetched at a time, so memory use doesn't grow with the queue
+
+        :param queue: queue name
+        :param state: job state, e.g. 'queued' or 'active'
+        :param count: JSCAN page size
+        """
         command = ['JSCAN', 'COUNT', count, 'QUEUE', queue, 'STATE', state]
         code, jobs = self.disque_client.execute_command(*command)
+        for job in jobs:
+            yield job
         while code != b'0':
             command = command[:1] + [code] + command[-6:]
-            code, njobs = self.disque_client.execute_command(*command)
-            jobs.extend(njobs)
-        return jobs
+            code, jobs = self.disque_client.execute_command(*command)
+            for job in jobs:
+                yield job
+
+    def filter_jobs(self, queue, state, count=100):
+        return list(self.iter_jobs(queue, state, count))
+
+    def count_jobs(self, queue, state, count=1000):
+        return sum(1 for _ in self.iter_jobs(queue, state, count))
+
+    def dead_jobs(self, task, count=100):
+        """
+        Jobs of a task that failed their last attempt, see `retries`
+
+        :param task: task function or name
+        :param count: max number of jobs, oldest first
+        :return: list of tuple(jobid, funcname, args, kwargs, meta), the
+                 traceback of the last failure is in meta['traceback']
+        """
+        name = task if isinstance(task, str) else task.__func__.__name__
+        return [(jobid, ) + loads(body, self.task_ids) for _, jobid, body
+                in self.disque_client.qpeek(dead_queue(name), count)]
+
+    def requeue_dead(self, task, count=None, chunk_size=100):
+        """
+        Move dead jobs of a task back to its queue, with all their attempts
+        again, their results are not sent
+
+        :param task: task function or name
+        :param count: max number of jobs, all if None
+        :return: number of jobs requeued
+        """
+        name = task if isinstance(task, str) else task.__func__.__name__
+        config = self.configs[name]
+        client = self.disque_client
+        moved = 0
+        while count is None or moved < count:
+            size = chunk_size if count is None \
+                else min(chunk_size, count - moved)
+            jobs = client.get_job([dead_queue(name)], count=size, nohang=True)
+            if not jobs:
+                break
+            payloads = []
+            for _, _, body in jobs:
+                funcname, args, kwargs, meta = loads(body, self.task_ids)
+                for key in ('id', 'attempt', 'traceback', 'reply_to',
+                            'result_ttl'):
+                    meta.pop(key, None)
+                payloads.append(config['serializer'].dumps(
+                    funcname, args, kwargs, meta))
+            client.add_jobs(config['queue'] or name, payloads,
+                            **add_options(config))
+            client.ack_job(*[jobid for _, jobid, _ in jobs])
+            moved += len(jobs)
+        return moved
 
     def num_processing(self, queue):
-        # TODO: this is a terrible implementation
+        # cached for stats.ttl seconds,
         # should rewrite when QSTAT command is available
-        return len(self.filter_jobs(queue, 'active'))
+        return self.stats.num_processing(queue)
@@ -0,0 +1,60 @@
+""" Queue Polling Order
+
+GETJOB serves the first non-empty queue of its list, so the order of the
+list decides which queue a worker drains first. Tasks set
+
+    priority: queues of a higher priority come first, lower ones are only
+              served while all higher ones are empty, DEFAULT to 0
+    weight: share of the jobs of a queue among the queues of the same
+            priority, e.g. 7, 2 and 1 for a 70/20/10 split, DEFAULT to 1
+
+Within a priority, queues are ordered by stride scheduling: every job
+served advances its queue's pass by 1 / weight, and the queue with the
+lowest pass comes first. Queues polled ahead of the one that served a
+job were empty, they catch up to its pass, so an idle queue can't save
+up turns for a burst later. Every queue keeps its share of the turns,
+none starves.
+"""
+
+
+class QueueOrder(object):
+    """
+    :param queues: queue names
+    :param configs: task configs by queue name, see `Odq.configs`
+    """
+
+    def __init__(self, queues, configs):
+        self.queues = list(queues)
+        self.priority = {}
+        self.weight = {}
+        self.bands = {}
+        for queue in self.queues:
+            config = configs.get(queue, {})
+            self.priority[queue] = config.get('priority') or 0
+            self.weight[queue] = config.get('weight') or 1
+            self.bands.setdefault(self.priority[queue], []).append(queue)
+        self.passes = dict.fromkeys(self.queues, 0.0)
+        self.order = list(self.queues)
+
+    def __repr__(self):
+        return '<QueueOrder %s>' % self.queues
+
+    def next(self):
+        """ :return: queues in the order to poll them in the next GETJOB """
+        self.order = []
+        for priority in sorted(self.bands, reverse=True):
+            self.order.extend(sorted(self.bands[priority],
+                                     key=self.passes.get))
+        return self.order
+
+    def served(self, queue, count=1):
+        """ advance `queue` for `count` jobs taken from it """
+        if isinstance(queue, bytes):
+            queue = queue.decode()
+        if queue not in self.passes:
+            return
+        current = self.passes[queue]
+        for ahead in self.order[:self.order.index(queue)]:
+            if self.priority[ahead] == self.priority[queue]:
+                self.passes[ahead] = max(self.passes[ahead], current)
+        self.passes[queue] = current + count / self.weight[queue]
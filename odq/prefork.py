@@ -0,0 +1,129 @@
+""" Prefork Process Supervisor
+
+The odq target is imported once in the parent, children are forked from
+it and share the warmed up code copy-on-write. Children that die are
+respawned, and children are recycled after a number of jobs or when their
+memory grows over a limit. Stopped children finish their jobs in flight
+within a grace period, see `heartbeat`.
+"""
+import os
+import sys
+import time
+import signal
+import logging
+import resource
+import importlib
+
+
+logger = logging.getLogger('odq')
+
+
+def load_odq(target):
+    """
+    :param target: odq object path, e.g. app:o
+    :return: tuple(module, odq object), with the tasks of the modules it
+             includes registered
+    """
+    path, name = target.split(':')
+    m = importlib.import_module(path)
+    o = getattr(m, name)
+    o.discover()
+    return m, o
+
+
+def rss():
+    """ resident memory of the current process, in MB """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() / 1024 / 1024
+    except (IOError, OSError):
+        # peak instead of current, KB on linux and bytes on mac
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss / 1024 / (1024 if sys.platform == 'darwin' else 1)
+
+
+class Supervisor(object):
+    """
+    Keeps `concurrency` forked workers running
+
+    :param target: odq object path, e.g. app:o
+    :param concurrency: number of child processes
+    :param metrics_file: metrics file of each child, see `metrics.setup`
+    :param metrics_port: metrics HTTP port of the first child
+    :param grace: seconds a child has to finish its jobs once stopped
+    :param worker_kwargs: keyword arguments of `run_worker` in children,
+                          e.g. queue, subworker, max_tasks, max_memory
+    """
+
+    def __init__(self, target, concurrency, metrics_file=None,
+                 metrics_port=None, grace=30, **worker_kwargs):
+        self.target = target
+        self.concurrency = concurrency
+        self.metrics_file = metrics_file
+        self.metrics_port = metrics_port
+        self.grace = grace
+        self.worker_kwargs = worker_kwargs
+        # pid -> tuple(start time, index), a respawned child takes the
+        # index of the one it replaces, so its metrics keep their port
+        self.children = {}
+        self.stopping = False
+
+    def spawn(self, index):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = (time.time(), index)
+            return pid
+
+        # child
+        code = 0
+        try:
+            from .worker import run_worker
+            from .metrics import setup
+            from .heartbeat import Heartbeat
+            heartbeat = Heartbeat()
+            heartbeat.install(self.grace)
+            metrics = setup(self.metrics_file, self.metrics_port, index)
+            run_worker(self.target, worker='process', metrics=metrics,
+                       heartbeat=heartbeat, **self.worker_kwargs)
+        except BaseException:
+            logger.exception('worker %d crashed', os.getpid())
+            code = 1
+        finally:
+            os._exit(code)
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def run(self):
+        load_odq(self.target)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for index in range(self.concurrency):
+            self.spawn(index)
+        logger.info('started %d workers', self.concurrency)
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except InterruptedError:
+                continue
+            except ChildProcessError:
+                break
+            child = self.children.pop(pid, None)
+            if child is None or self.stopping:
+                continue
+            started, index = child
+            if os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0:
+                logger.info('worker %d recycled', pid)
+            else:
+                logger.warning('worker %d died with status %d', pid, status)
+                # don't respawn in a tight loop if children crash at start
+                if time.time() - started < 1:
+                    time.sleep(1)
+            self.spawn(index)
@@ -0,0 +1,160 @@
+""" Sampled Profiling
+
+Workers run a fraction of task executions under cProfile, and optionally
+tracemalloc, and aggregate the stats per task. The fraction is set per
+task, or for every task of an Odq instance or of a worker, a task is
+profiled at the highest of its rate and the rate of the worker:
+
+    @o.task(profile=0.01)
+    def render(report_id):
+        ...
+
+    o = Odq(profile=0.001)
+    python -m odq.worker app:o --profile 0.01 --profile-memory
+
+The aggregated stats are written every `interval` seconds, and when the
+worker returns, to `<path>/<task>.<pid>.prof`, in the pstats format, e.g.
+for `python -m pstats` or snakeviz, files of many processes can be merged
+with `pstats.Stats(*files)`. `<path>/memory.<pid>.txt` has the peak
+traced memory of each task.
+
+cProfile and tracemalloc apply to the whole process, so one execution is
+profiled at a time, sampled executions of other threads meanwhile run
+unprofiled, and memory peaks include allocations of other threads.
+`async def` tasks of asyncio workers are not profiled.
+"""
+import os
+import time
+import random
+import pstats
+import cProfile
+import logging
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+
+logger = logging.getLogger('odq')
+
+
+class Profiler(object):
+    """
+    :param rate: fraction of executions profiled, of every task
+    :param memory: also trace memory allocations
+    :param path: directory of the stats files
+    :param interval: seconds between writes of the stats files
+    """
+
+    def __init__(self, rate=0, memory=False, path='odq-profiles',
+                 interval=60):
+        self.rate = rate
+        self.memory = memory
+        self.path = path
+        self.interval = interval
+        self.lock = threading.Lock()
+        # held while an execution is profiled
+        self.busy = threading.Lock()
+        # task -> pstats.Stats
+        self.stats = {}
+        # task -> number of profiled executions
+        self.samples = {}
+        # task -> max peak of traced memory in bytes
+        self.peaks = {}
+        self.changed = set()
+        # pid of the process running the writer thread
+        self.pid = None
+
+    def sampled(self, rate):
+        """ whether to profile an execution
+        :param rate: task `profile` config, or None """
+        rate = max(rate or 0, self.rate)
+        return rate >= 1 or rate > 0 and random.random() < rate
+
+    @contextmanager
+    def profile(self, task, rate=None):
+        """ profile the block, if sampled at `rate` and no other execution
+        is profiled """
+        if not self.sampled(rate) or not self.busy.acquire(False):
+            yield
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is active, e.g. a debugger
+            self.busy.release()
+            yield
+            return
+        tracing = self.memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0] if self.memory else 0
+        try:
+            yield
+        finally:
+            profile.disable()
+            peak = None
+            if self.memory:
+                peak = tracemalloc.get_traced_memory()[1] - before
+            if tracing:
+                tracemalloc.stop()
+            self.busy.release()
+            self.add(task, profile, peak)
+
+    def call(self, task, rate, fn, *args, **kwargs):
+        """ call `fn`, profiled if sampled, see `profile` """
+        with self.profile(task, rate):
+            return fn(*args, **kwargs)
+
+    def add(self, task, profile, peak=None):
+        """ aggregate the stats of a profiled execution """
+        with self.lock:
+            if task in self.stats:
+                self.stats[task].add(profile)
+            else:
+                self.stats[task] = pstats.Stats(profile)
+            self.samples[task] = self.samples.get(task, 0) + 1
+            if peak is not None:
+                self.peaks[task] = max(self.peaks.get(task, 0), peak)
+            self.changed.add(task)
+        self.start()
+
+    def write(self):
+        """ write the stats of the tasks profiled since the last write """
+        if not self.changed:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        pid = os.getpid()
+        with self.lock:
+            for task in self.changed:
+                self.stats[task].dump_stats(os.path.join(
+                    self.path, '{}.{}.prof'.format(task, pid)))
+            self.changed = set()
+            lines = ['{} samples={} peak_bytes={}'.format(
+                task, self.samples[task], self.peaks[task])
+                for task in sorted(self.peaks)]
+        if lines:
+            with open(os.path.join(self.path, 'memory.{}.txt'.format(pid)),
+                      'w') as f:
+                f.write('\n'.join(lines) + '\n')
+
+    def flush(self):
+        """ `write`, logging errors """
+        try:
+            self.write()
+        except Exception:
+            logger.exception('writing profiles to %s failed', self.path)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def start(self):
+        """ start the writer thread, once per process """
+        if self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        t = threading.Thread(target=self.run)
+        t.daemon = True
+        t.start()
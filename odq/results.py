@@ -0,0 +1,207 @@
+""" Result Backend
+
+Tasks with `result=True` carry the name of a reply queue, one per
+producer process. Workers add the return value, or the exception, of a job
+to that queue, and the producer waits for it with a blocking GETJOB, so
+there is no polling.
+"""
+import os
+import time
+import uuid
+import pickle
+import logging
+import threading
+import traceback
+
+
+logger = logging.getLogger('odq')
+
+
+class TaskError(Exception):
+    """ raised for a failed job whose exception could not be pickled """
+
+    def __init__(self, error, tb=''):
+        super(TaskError, self).__init__(error, tb)
+        self.error = error
+        self.traceback = tb
+
+    def __str__(self):
+        return self.error
+
+
+class AsyncResult(object):
+    """
+    Result of a job, returned by calls of tasks with `result=True`
+
+    :param results: Results of the producer
+    :param id: job id
+    """
+
+    def __init__(self, results, id):
+        self.results = results
+        self.id = id
+
+    def __repr__(self):
+        return '<AsyncResult id:%s>' % self.id
+
+    def get(self, timeout=None):
+        """
+        Wait for the result of the job
+
+        :param timeout: max seconds to wait, forever if None
+        :return: return value of the task
+        :raise: the exception raised by the task, or TimeoutError
+        """
+        return self.results.wait(self.id, timeout)
+
+    def ready(self):
+        """ check whether the result is there, without waiting """
+        return self.results.poll(self.id)
+
+
+class Results(object):
+    """
+    Reply queue of a producer and the results received on it
+
+    :param client: disque client
+    :param ttl: default seconds a result is kept in the reply queue
+    """
+
+    def __init__(self, client, ttl=3600):
+        self.client = client
+        self.ttl = ttl
+        self.received = {}
+        self.lock = threading.Lock()
+        self.pid = None
+        self.queue = None
+
+    @property
+    def reply_to(self):
+        """ reply queue name, a forked child gets its own queue """
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.queue = 'odq.reply.{}'.format(uuid.uuid4().hex)
+            self.received = {}
+        return self.queue
+
+    def meta(self, config):
+        """ job meta for a call of a task with `config` """
+        return {'reply_to': self.reply_to,
+                'result_ttl': config.get('result_ttl') or self.ttl}
+
+    def fetch(self, timeout=None, count=1000):
+        """ move results from the reply queue into self.received, should be
+        called with self.lock held
+
+        :param timeout: max seconds to block, don't block if 0
+        """
+        if timeout:
+            jobs = self.client.get_job([self.reply_to], count=count,
+                                       timeout=max(1, int(timeout * 1000)))
+        else:
+            jobs = self.client.get_job([self.reply_to], count=count,
+                                       nohang=True)
+        now = time.time()
+        for _, jobid, payload in jobs:
+            id, ok, value = pickle.loads(payload)
+            self.received[id] = (now, ok, value)
+        if jobs:
+            self.client.ack_job(*[jobid for _, jobid, _ in jobs])
+            # results nobody waits for, e.g. of a job that failed and
+            # then succeeded on retry
+            for id in [id for id, (t, _, _) in self.received.items()
+                       if now - t > self.ttl]:
+                del self.received[id]
+        return len(jobs)
+
+    def pop(self, id):
+        _, ok, value = self.received.pop(id)
+        if not ok:
+            raise value
+        return value
+
+    def poll(self, id):
+        with self.lock:
+            if id not in self.received:
+                self.fetch()
+            return id in self.received
+
+    def wait(self, id, timeout=None):
+        """ wait for the result of job `id`, see `AsyncResult.get` """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with self.lock:
+                if id in self.received:
+                    return self.pop(id)
+                remaining = 1 if deadline is None else \
+                    min(1, deadline - time.time())
+                if remaining <= 0:
+                    raise TimeoutError('no result of job {}'.format(id))
+                self.fetch(remaining)
+
+    def get_many(self, results, timeout=None, return_exceptions=False):
+        """
+        Wait for the results of many jobs, e.g. of a `task.map` fan-out,
+        each GETJOB takes up to 1000 results
+
+        :param results: list of AsyncResult
+        :param timeout: max seconds to wait for all of them
+        :param return_exceptions: put exceptions in the returned list
+                                  instead of raising them
+        :return: list of return values, in the order of `results`
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        ids = [r.id for r in results]
+        pending = set(ids)
+        values = {}
+        while pending:
+            with self.lock:
+                for id in [id for id in pending if id in self.received]:
+                    try:
+                        values[id] = self.pop(id)
+                    except Exception as e:
+                        if not return_exceptions:
+                            raise
+                        values[id] = e
+                    pending.discard(id)
+                if not pending:
+                    break
+                remaining = 1 if deadline is None else \
+                    min(1, deadline - time.time())
+                if remaining <= 0:
+                    raise TimeoutError('no result of {} jobs'
+                                       ''.format(len(pending)))
+                self.fetch(remaining)
+        return [values[id] for id in ids]
+
+
+def reply_job(jobid, ok, value):
+    """
+    Payload of a result, an exception that can't be pickled is sent as a
+    TaskError
+
+    :param jobid: id of the job that produced the result
+    :param ok: whether the job succeeded
+    :param value: return value, or exception
+    """
+    try:
+        return pickle.dumps((jobid, ok, value))
+    except Exception:
+        if ok:
+            raise
+        tb = ''.join(traceback.format_exception(type(value), value,
+                                                value.__traceback__))
+        return pickle.dumps((jobid, ok, TaskError(repr(value), tb)))
+
+
+def send_reply(client, meta, jobid, ok, value):
+    """ send a result to the reply queue of the job's producer, if any, a
+    retried job replies for the first job """
+    jobid = meta.get('id', jobid)
+    if meta.get('reply_to'):
+        try:
+            client.add_job(meta['reply_to'], reply_job(jobid, ok, value),
+                           ttl=meta.get('result_ttl'))
+        except Exception:
+            logger.exception('sending result of job {} failed'
+                             ''.format(jobid))
@@ -0,0 +1,92 @@
+""" Retries and Dead Letters
+
+A job of a task with `max_retries` set that raises is acked, and added
+again with a growing delay, instead of waiting for its RETRY period:
+
+    @o.task(max_retries=5, backoff=2, backoff_max=3600)
+    def fetch(url):
+        ...
+
+    max_retries: number of times a failed job is retried
+    backoff: delay in seconds of the first retry, doubled for each of the
+             next ones up to `backoff_max`, DEFAULT to 1 and 3600
+    dead_ttl: seconds a dead job is kept, DEFAULT to a week
+
+The payload of a retried job carries the attempt number, and the id of
+the first job, which is the id its result is sent for. After its last
+attempt, a job moves to the dead-letter queue `odq.dead.<task>`, along
+with the traceback of its last failure, and its result is the exception.
+Dead jobs are listed by `Odq.dead_jobs`, and moved back to their queue by
+`Odq.requeue_dead` once the cause is fixed.
+
+Tasks without `max_retries` keep the disque behavior, a failed job is not
+acked, and it is queued again after its RETRY period.
+"""
+import math
+import logging
+
+
+logger = logging.getLogger('odq')
+
+DEAD_TTL = 7 * 86400
+
+
+def dead_queue(name):
+    """ dead-letter queue of a task """
+    return 'odq.dead.{}'.format(name)
+
+
+def retry_delay(config, attempt):
+    """ seconds before the `attempt`th retry of a job, starting at 1,
+    rounded up to whole seconds, the unit of DELAY """
+    delay = (config.get('backoff') or 1) * 2 ** (attempt - 1)
+    return int(math.ceil(min(delay, config.get('backoff_max') or 3600)))
+
+
+def add_options(config):
+    """ ADDJOB options of a retried or requeued job, without the delay of
+    its task, see `Odq.job_options` """
+    return {'timeout': config.get('timeout', 200),
+            'replicate': config.get('replicate'),
+            'retry': config.get('retry'),
+            'ttl': config.get('ttl')}
+
+
+def failed_job(o, jobid, funcname, args, kwargs, meta, tb):
+    """
+    Job to add in place of a failed one, either its next attempt, or a
+    dead letter after the last one
+
+    :param o: Odq instance
+    :param tb: formatted traceback of the failure
+    :return: tuple(dead, queue_name, payload, options for `Client.add_job`),
+             or None if the task has no `max_retries`
+    """
+    config = o.configs[funcname]
+    max_retries = config.get('max_retries')
+    if max_retries is None:
+        return None
+
+    meta = dict(meta, id=meta.get('id', jobid),
+                attempt=meta.get('attempt', 0) + 1)
+    if meta.get('blobs'):
+        # the arguments stay in the blob store
+        args, kwargs = (), {}
+    options = add_options(config)
+    options['retry'] = o.job_retry(funcname, meta)
+    if meta['attempt'] <= max_retries:
+        queue = config['queue'] or funcname
+        options['delay'] = retry_delay(config, meta['attempt'])
+        logger.info('retrying job %s of %s in %d seconds, attempt %d of %d',
+                    meta['id'], funcname, options['delay'], meta['attempt'],
+                    max_retries)
+        dead = False
+    else:
+        queue = dead_queue(funcname)
+        meta['traceback'] = tb
+        options.update(retry=0, ttl=config.get('dead_ttl') or DEAD_TTL)
+        logger.warning('job %s of %s failed %d times, moved to %s',
+                       meta['id'], funcname, meta['attempt'], queue)
+        dead = True
+    payload = config['serializer'].dumps(funcname, args, kwargs, meta)
+    return dead, queue, payload, options
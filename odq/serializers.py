@@ -0,0 +1,141 @@
+""" Job Payload Serializers
+
+A payload encodes a task call, i.e. task name, args and kwargs, plus an
+optional dict of job metadata, e.g. where to send the result.
+
+Serializers other than the legacy pickle one start their payloads with
+a 2 bytes magic, so a worker can tell payloads apart by their header and
+consume old and new payloads side by side.
+"""
+import zlib
+import pickle
+import struct
+
+
+SERIALIZERS = {}
+
+
+def register(cls):
+    """ register a serializer class by its magic, so that `loads` can
+    detect its payloads """
+    SERIALIZERS[cls.magic] = cls
+    return cls
+
+
+def task_id(name):
+    """ interned id of a task name, stable across processes """
+    return zlib.crc32(name.encode()) & 0xffffffff
+
+
+def loads(payload, names=None):
+    """ decode a payload of any registered serializer
+
+    :param payload: job body
+    :param names: dict of task_id -> task name, required by serializers that
+                  intern task names
+    :return: tuple(name, args, kwargs, meta)
+    """
+    cls = SERIALIZERS.get(payload[:2], PickleSerializer)
+    return cls.loads(payload, names)
+
+
+class Serializer(object):
+    """ base class of serializers
+
+    subclasses define a unique 2 bytes `magic`, which starts their payloads
+    """
+    magic = None
+
+    def dumps(self, name, args, kwargs, meta=None):
+        raise NotImplementedError
+
+    @classmethod
+    def loads(cls, payload, names=None):
+        raise NotImplementedError
+
+
+class PickleSerializer(Serializer):
+    """ legacy format, pickle of [name, args, kwargs], or of
+    [name, args, kwargs, meta] if there is any meta """
+
+    def dumps(self, name, args, kwargs, meta=None):
+        if meta:
+            return pickle.dumps([name, args, kwargs, meta])
+        return pickle.dumps([name, args, kwargs])
+
+    @classmethod
+    def loads(cls, payload, names=None):
+        call = pickle.loads(payload)
+        if len(call) == 3:
+            call.append({})
+        name, args, kwargs, meta = call
+        return name, args, kwargs, meta
+
+
+def _lz4():
+    try:
+        import lz4.frame
+    except ImportError:
+        raise RuntimeError('lz4 compression requires the lz4 package')
+    return lz4.frame
+
+
+COMPRESSIONS = {
+    # flag: (name, compress, decompress)
+    0: (None, None, None),
+    1: ('zlib', zlib.compress, zlib.decompress),
+    2: ('lz4', lambda data: _lz4().compress(data),
+        lambda data: _lz4().decompress(data)),
+}
+
+
+@register
+class CompactSerializer(Serializer):
+    """ compact binary format
+
+    header: magic(2) version(1) compression(1) task_id(4)
+    body: pickle of (args, kwargs) or (args, kwargs, meta), compressed if it
+          is at least `threshold` bytes and compression makes it smaller
+
+    :param compression: 'zlib', 'lz4' or None
+    :param threshold: min body size in bytes to be compressed
+    :raise: ValueError for an unknown compression
+    """
+    magic = b'OQ'
+    version = 1
+    header = struct.Struct('>2sBBI')
+
+    def __init__(self, compression='zlib', threshold=1024):
+        flags = [flag for flag, (name, _, _) in COMPRESSIONS.items()
+                 if name == compression]
+        if not flags:
+            raise ValueError('unknown compression {!r}, use one of {}'.format(
+                compression, ', '.join(repr(name) for name, _, _ in
+                                       COMPRESSIONS.values())))
+        self.flag = flags[0]
+        self.threshold = threshold
+
+    def dumps(self, name, args, kwargs, meta=None):
+        call = (args, kwargs, meta) if meta else (args, kwargs)
+        body = pickle.dumps(call, pickle.HIGHEST_PROTOCOL)
+        flag = 0
+        if self.flag and len(body) >= self.threshold:
+            compressed = COMPRESSIONS[self.flag][1](body)
+            if len(compressed) < len(body):
+                flag, body = self.flag, compressed
+        return self.header.pack(self.magic, self.version, flag,
+                                task_id(name)) + body
+
+    @classmethod
+    def loads(cls, payload, names=None):
+        _, version, flag, tid = cls.header.unpack_from(payload)
+        if version > cls.version:
+            raise ValueError('unsupported payload version {}'.format(version))
+        body = payload[cls.header.size:]
+        if flag:
+            body = COMPRESSIONS[flag][2](body)
+        call = pickle.loads(body)
+        args, kwargs, meta = call if len(call) == 3 else call + ({}, )
+        if names is None or tid not in names:
+            raise KeyError('unknown task id {}'.format(tid))
+        return names[tid], args, kwargs, meta
@@ -0,0 +1,64 @@
+""" Queue Statistics """
+import time
+import threading
+
+
+class QueueStats(object):
+    """
+    Queue counts from QLEN / JSCAN, cached for `ttl` seconds, so workers and
+    dashboards can ask for them often without rescanning the cluster.
+
+    :param odq: Odq instance
+    :param ttl: seconds a count is cached
+    """
+
+    def __init__(self, odq, ttl=5):
+        self.odq = odq
+        self.ttl = ttl
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def cached(self, key, fn):
+        now = time.time()
+        with self.lock:
+            expires, value = self.cache.get(key, (0, None))
+        if expires > now:
+            return value
+        value = fn()
+        with self.lock:
+            self.cache[key] = (now + self.ttl, value)
+        return value
+
+    def invalidate(self, queue=None):
+        """ drop cached counts of `queue`, or of all queues """
+        with self.lock:
+            if queue is None:
+                self.cache.clear()
+            else:
+                for key in [k for k in self.cache if k[1] == queue]:
+                    del self.cache[key]
+
+    def qlen(self, queue):
+        """ number of queued jobs """
+        return self.cached(('qlen', queue),
+                           lambda: self.odq.disque_client.qlen(queue))
+
+    def count(self, queue, state):
+        """ number of jobs in `state` """
+        return self.cached((state, queue),
+                           lambda: self.odq.count_jobs(queue, state))
+
+    def num_processing(self, queue):
+        """ number of jobs delivered to workers and not acked yet """
+        return self.count(queue, 'active')
+
+    def summary(self, queues=None):
+        """
+        :param queues: queue names, defaults to all known queues
+        :return: dict of queue -> {'queued': n, 'active': n}
+        """
+        if queues is None:
+            queues = sorted(self.odq.queues)
+        return dict((queue, {'queued': self.qlen(queue),
+                             'active': self.num_processing(queue)})
+                    for queue in queues)
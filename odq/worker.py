@@ -1,14 +1,36 @@
 """ Command Line Helpers """
+import os
 import sys
+import time
+import random
+import asyncio
 import logging
 import argparse
+import threading
+import traceback
 
-from pickle import loads
+from functools import partial
+from collections import OrderedDict
+
+from .limits import Limiter
+from .polling import QueueOrder
+from .heartbeat import Heartbeat
+from .dispatcher import Acker, Dispatcher
+from .metrics import setup as setup_metrics
+from .prefork import load_odq, rss
+from .profiling import Profiler
+from .results import reply_job, send_reply
+from .retries import failed_job
+from .workflow import advance
 
 sys.path.insert(0, '.')
 
 logger = logging.getLogger('odq')
 
+# GETJOB timeout in milliseconds, the worker loop checks between polls
+# whether it has to stop, and queue limits
+POLL_TIMEOUT = 1000
+
 
 def get_parser():
     parser = argparse.ArgumentParser(description='ODQ Worker')
@@ -16,24 +38,68 @@ def get_parser():
                         help='odq object, e.g. app:o')
     parser.add_argument(
         '--worker', '-w1', type=str, default='thread',
-        choices=['gevent', 'thread', 'process'],
+        choices=['gevent', 'thread', 'process', 'asyncio'],
         help='worker type to use, DEFAULT to "thread"')
     parser.add_argument(
         '--subworker', '-w2', type=str, default='',
-        choices=['gevent', 'thread', ''],
+        choices=['gevent', 'thread', 'asyncio', ''],
         help='additional sub worker inside worker, this is '
         'to overcome python\'s single core limit, '
         'if empty, no sub worker will be used'
         ', DEFAULT to ""')
     parser.add_argument(
         '--concurrency', '-c1', type=int, default=1,
-        help='concurrency level of selected worker')
+        help='concurrency level of selected worker, for asyncio this is '
+        'the max number of jobs in flight')
     parser.add_argument(
         '--subconcurrency', '-c2', type=int, default=1,
         help='concurrency level of selected sub worker')
     parser.add_argument(
         '--queue', '-q', type=str, default='',
         help='queue to listen on, if not provided, listen on all queues')
+    parser.add_argument(
+        '--max-tasks-per-child', type=int, default=None,
+        help='process worker is replaced after executing this many jobs')
+    parser.add_argument(
+        '--max-memory-per-child', type=int, default=None,
+        help='process worker is replaced after its resident memory '
+        'exceeds this many MB')
+    parser.add_argument(
+        '--metrics-file', type=str, default=None,
+        help='write prometheus metrics to this file every 10 seconds, '
+        'for process workers "{index}" is replaced by the worker index')
+    parser.add_argument(
+        '--metrics-port', type=int, default=None,
+        help='serve prometheus metrics on this port, process workers '
+        'listen on port + worker index')
+    parser.add_argument(
+        '--log-sample', type=float, default=1.0,
+        help='fraction of executed jobs that are logged, DEFAULT to 1')
+    parser.add_argument(
+        '--grace', type=float, default=30,
+        help='seconds to finish jobs in flight on SIGTERM, jobs still '
+        'running then are NACKed, DEFAULT to 30')
+    parser.add_argument(
+        '--dispatch', action='store_true',
+        help='fetch jobs for all threads or greenlets of a worker with one '
+        'GETJOB COUNT, and ack them in batches, asyncio workers always do')
+    parser.add_argument(
+        '--prefetch', type=int, default=None,
+        help='max jobs a dispatching worker takes ahead of its idle '
+        'threads or greenlets, DEFAULT to their number')
+    parser.add_argument(
+        '--profile', type=float, default=0,
+        help='fraction of task executions run under cProfile, on top of '
+        'the `profile` rate of tasks, DEFAULT to 0')
+    parser.add_argument(
+        '--profile-memory', action='store_true',
+        help='also trace memory allocations of profiled executions')
+    parser.add_argument(
+        '--profile-dir', type=str, default='odq-profiles',
+        help='directory of the per task pstats files')
+    parser.add_argument(
+        '--profile-interval', type=float, default=60,
+        help='seconds between writes of the pstats files, DEFAULT to 60')
     return parser
 
 
@@ -51,18 +117,48 @@ def main():
         logger.error('using subworkers requires worker set to be "process"')
         return
 
-    if args.worker == 'thread':
-        from concurrent.futures import ThreadPoolExecutor
+    profile = {'rate': args.profile, 'memory': args.profile_memory,
+               'path': args.profile_dir, 'interval': args.profile_interval}
+    options = {'log_sample': args.log_sample, 'profiler': Profiler(**profile)}
+    if args.dispatch:
+        options.update(dispatch=True, prefetch=args.prefetch)
+    if args.worker != 'process':
+        options['metrics'] = setup_metrics(args.metrics_file,
+                                           args.metrics_port)
+        options['heartbeat'] = Heartbeat()
+        options['heartbeat'].install(args.grace)
+
+    if args.worker in ('thread', 'gevent') and args.dispatch:
+        run_worker(args.odq, args.queue, args.worker, args.worker,
+                   args.concurrency, **options)
+
+    elif args.worker == 'thread':
+        from concurrent.futures import ThreadPoolExecutor, wait
         e = ThreadPoolExecutor(args.concurrency)
-        for _ in range(args.concurrency):
-            e.submit(run_worker, args.odq, args.queue, args.worker)
+        # wait in the main thread, where signal handlers run
+        wait([e.submit(run_worker, args.odq, args.queue, args.worker,
+                       **options) for _ in range(args.concurrency)])
+
+    elif args.worker == 'process' and hasattr(os, 'fork'):
+        from .prefork import Supervisor
+        Supervisor(args.odq, args.concurrency, queue=args.queue,
+                   subworker=args.subworker,
+                   subconcurrency=args.subconcurrency,
+                   max_tasks=args.max_tasks_per_child,
+                   max_memory=args.max_memory_per_child,
+                   metrics_file=args.metrics_file,
+                   metrics_port=args.metrics_port,
+                   grace=args.grace,
+                   **options).run()
 
     elif args.worker == 'process':
         from concurrent.futures import ProcessPoolExecutor
+        # arguments are pickled, a Profiler holds locks
+        options['profiler'] = profile
         e = ProcessPoolExecutor(args.concurrency)
         for _ in range(args.concurrency):
             e.submit(run_worker, args.odq, args.queue, args.worker,
-                     args.subworker, args.subconcurrency)
+                     args.subworker, args.subconcurrency, **options)
 
     elif args.worker == 'gevent':
         from gevent import monkey
@@ -70,78 +166,549 @@ def main():
         from gevent.pool import Pool
         pool = Pool(args.concurrency)
         for _ in range(args.concurrency):
-            pool.spawn(run_worker, args.odq, args.queue, args.worker)
+            pool.spawn(run_worker, args.odq, args.queue, args.worker,
+                       **options)
         pool.join()
 
+    elif args.worker == 'asyncio':
+        options.pop('dispatch', None)
+        options.pop('prefetch', None)
+        run_worker(args.odq, args.queue, args.worker, 'asyncio',
+                   args.concurrency, **options)
+
+
+def fetch_batch(client, queue, count, wait=None, node=None):
+    """ top up a batch with at most `count` more jobs from `queue`
+
+    :param client: disque client
+    :param queue: queue to fetch from
+    :param count: max number of jobs to fetch
+    :param wait: max milliseconds to wait for the batch to fill up,
+                 if empty, only take what is already queued
+    :param node: node the first job of the batch was taken from, see
+                 `Client.poll_node`
+    :return: list of tuple(queue_name, job_id, payload)
+    """
+    jobs = []
+    deadline = time.time() + (wait or 0) / 1000
+    while len(jobs) < count:
+        timeout = int((deadline - time.time()) * 1000)
+        if timeout > 0:
+            results = client.get_job([queue], timeout=timeout,
+                                     count=count - len(jobs), node=node)
+        else:
+            results = client.get_job([queue], count=count - len(jobs),
+                                     nohang=True, node=node)
+        jobs.extend(results)
+        if not results or timeout <= 0:
+            break
+    return jobs
+
+
+def job_results(jobs, ok, result, batch=False):
+    """ result of each executed job, a batch task returning one value per
+    job gets each job its own value
+
+    :param jobs: list of tuple(jobid, funcname, args, kwargs, meta)
+    :return: list of tuple(job, value)
+    """
+    values = [result] * len(jobs)
+    if batch and ok and isinstance(result, (list, tuple)) and \
+            len(result) == len(jobs):
+        values = result
+    return list(zip(jobs, values))
+
+
+def queue_name(queue):
+    """ queue name as configured, GETJOB replies with bytes """
+    return queue.decode() if isinstance(queue, bytes) else queue
+
+
+def sampled(rate):
+    """ whether to log an executed job, `rate` is the fraction logged """
+    return rate >= 1 or rate > 0 and random.random() < rate
+
+
+def run_coroutine(coro):
+    """ run an `async def` task outside of the asyncio worker """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+async def run_async_worker(odq, queue='', concurrency=1, logger=logger,
+                           max_tasks=None, max_memory=None, metrics=None,
+                           log_sample=1.0, heartbeat=None, profiler=None):
+    """ run jobs on the current event loop, at most `concurrency` jobs are
+    in flight, they are fetched by a single GETJOB COUNT <free slots>
+
+    `async def` tasks are awaited, plain tasks run in the default executor
+
+    returns after `max_tasks` jobs, once resident memory is over
+    `max_memory` MB, or once `heartbeat` is stopping, when jobs in flight
+    are done
+
+    executed jobs are recorded in `metrics`, and a `log_sample` fraction
+    of them is logged, plain tasks are sampled by `profiler`
+    """
+    _, o = load_odq(odq)
+    client = o.aio_client
+    if heartbeat is None:
+        heartbeat = Heartbeat()
+    if profiler is None:
+        profiler = Profiler()
+    count = 0
+    loop = asyncio.get_event_loop()
+
+    async def finish(job, ok, value, done=True):
+        """ add what follows a job that is `done` in its workflow, and send
+        its result """
+        jobid, meta = job[0], job[4]
+        if done and (meta.get('link') or meta.get('chord')):
+            if not await loop.run_in_executor(None, advance, o, jobid, meta,
+                                              ok, value):
+                return
+        if meta.get('reply_to'):
+            await client.add_job(meta['reply_to'],
+                                 reply_job(meta.get('id', jobid), ok, value),
+                                 ttl=meta.get('result_ttl'))
+
+    async def execute(funcname, jobs):
+        func = o.tasks[funcname]
+        batch = o.configs[funcname].get('batch')
+        key = None
+        if batch:
+            args, kwargs = ([(args, kwargs)
+                             for _, _, args, kwargs, _ in jobs], ), {}
+        else:
+            (_, _, args, kwargs, _), = jobs
+            key = o.cache.key(funcname, args, kwargs)
+        if key:
+            hit, value = await loop.run_in_executor(None, o.cache.get,
+                                                    funcname, key)
+            if metrics:
+                metrics.inc('odq_cache_total', funcname,
+                            result='hit' if hit else 'miss')
+            if hit:
+                await finish(jobs[0], True, value)
+                await client.ack_job(jobs[0][0])
+                heartbeat.remove(jobs[0][0])
+                o.release_jobs([funcname], [jobs[0][4]])
+                return
+        t0 = time.time()
+        try:
+            if asyncio.iscoroutinefunction(func.__func__):
+                result = await func.__func__(*args, **kwargs)
+            else:
+                result = await loop.run_in_executor(
+                    None, partial(profiler.call, funcname,
+                                  o.configs[funcname].get('profile'),
+                                  func.__func__, *args, **kwargs))
+            seconds = time.time() - t0
+        except Exception as e:
+            if metrics:
+                metrics.executed(funcname, [job[4] for job in jobs], t0,
+                                 time.time() - t0, False)
+            logger.exception('executing {}(*{}, **{}) failed'
+                             ''.format(funcname, args, kwargs))
+            tb = traceback.format_exc()
+            for job in jobs:
+                failed = failed_job(o, *job, tb)
+                if failed:
+                    dead, queue, payload, options = failed
+                    await client.add_job(queue, payload, **options)
+                if not failed or dead:
+                    await finish(job, False, e, done=bool(failed))
+                if failed:
+                    await client.ack_job(job[0])
+            heartbeat.remove(*[job[0] for job in jobs])
+        else:
+            if metrics:
+                metrics.executed(funcname, [job[4] for job in jobs], t0,
+                                 seconds)
+            if sampled(log_sample):
+                logger.info('job {}(*{}, **{}) executed in {:.6f} '
+                            'seconds, returns {}'
+                            ''.format(funcname, args,
+                                      kwargs, seconds, result))
+            if key:
+                await loop.run_in_executor(None, o.cache.set, funcname, key,
+                                           result)
+            for job, value in job_results(jobs, True, result, batch):
+                await finish(job, True, value)
+            t1 = time.time()
+            await client.ack_job(*[jobid for jobid, _, _, _, _ in jobs])
+            heartbeat.remove(*[job[0] for job in jobs])
+            if metrics:
+                metrics.observe('odq_ack_seconds', funcname,
+                                time.time() - t1)
+            o.release_jobs([funcname] * len(jobs), [job[4] for job in jobs])
+
+    queues = [queue] if queue else list(o.queues)
+    limited = [q for q in queues if o.configs.get(q, {}).get('max_workers')]
+    if limited:
+        # jobs in flight don't hold slots here, leave these queues to
+        # thread, gevent or process workers
+        queues = [q for q in queues if q not in limited]
+        if not queues:
+            raise ValueError('asyncio workers can\'t run queues limited by '
+                             'max_workers: {}'.format(', '.join(limited)))
+        logger.warning('asyncio workers skip queues limited by '
+                       'max_workers: %s', ', '.join(limited))
+    order = QueueOrder(queues, o.configs)
+    inflight = set()
+    while True:
+        inflight = set(f for f in inflight if not f.done())
+        if max_tasks and count >= max_tasks or \
+                max_memory and rss() > max_memory or \
+                heartbeat.stopping.is_set():
+            if inflight:
+                await asyncio.wait(inflight)
+            profiler.flush()
+            return
+        if len(inflight) >= concurrency:
+            await asyncio.wait(inflight, return_when=asyncio.FIRST_COMPLETED)
+            continue
+
+        results = await client.get_job(order.next(), timeout=POLL_TIMEOUT,
+                                       count=concurrency - len(inflight))
+        count += len(results)
+        groups = OrderedDict()
+        for queue, jobid, payload in results:
+            order.served(queue)
+            job = (jobid, ) + o.decode_job(payload)
+            heartbeat.add(o.disque_client, o.job_retry(job[1], job[4]),
+                          jobid)
+            groups.setdefault(job[1], []).append(job)
+        for funcname, jobs in groups.items():
+            batch = o.configs[funcname].get('batch') or 1
+            for i in range(0, len(jobs), batch):
+                inflight.add(asyncio.ensure_future(
+                    execute(funcname, jobs[i:i + batch])))
+
 
 def run_worker(odq, queue='', worker='thread',
-               subworker='', subconcurrency=1, logger=logger):
+               subworker='', subconcurrency=1, logger=logger,
+               max_tasks=None, max_memory=None, metrics=None,
+               log_sample=1.0, heartbeat=None, dispatch=False,
+               prefetch=None, profiler=None):
+    """ run jobs until `max_tasks` jobs are executed, resident memory is
+    over `max_memory` MB, or `heartbeat` is stopping, forever if none is set
+
+    executed jobs are recorded in `metrics`, and a `log_sample` fraction
+    of them is logged
+
+    jobs are held by `heartbeat` while they run, which keeps them from
+    being delivered again before their RETRY
+
+    with `dispatch`, sub workers run jobs fetched by a `Dispatcher` that
+    takes up to `prefetch` jobs ahead, see `dispatcher`
+
+    a sample of executions is profiled by `profiler`, a Profiler or a dict
+    of its arguments, see `profiling`, its stats are written on return
+    """
+    if heartbeat is None:
+        heartbeat = Heartbeat()
+    if profiler is None:
+        profiler = Profiler()
+    elif isinstance(profiler, dict):
+        profiler = Profiler(**profiler)
+    if subworker == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+    # tasks are registered once per process, for all sub workers
+    _, o = load_odq(odq)
 
     odqcount = 0
+    # limiters are shared by sub workers
+    shared_limiters = {}
+    stop = threading.Event()
+    acker = None
+
+    def check_limits():
+        if max_tasks and odqcount >= max_tasks or \
+                max_memory and rss() > max_memory:
+            stop.set()
 
     def do_work(logger=logger, queue=queue):
-        # TODO: support batch job execution in single worker
-        # this can reduce broker overhead when there's tons of tiny jobs
-        import time
-        import importlib
+        queues = [queue] if queue else list(o.queues)
+        order = QueueOrder(queues, o.configs)
+        limiters = {}
+        for queue in queues:
+            configs = o.configs.get(queue, {})
+            if configs.get('max_workers'):
+                limiters[queue] = shared_limiters.setdefault(queue, Limiter(
+                    o, queue, configs['max_workers'], heartbeat=heartbeat))
+        # a balancing client spreads workers over the nodes holding jobs
+        poll_node = getattr(o.disque_client, 'poll_node', None)
+        node = poll_node(queues) if poll_node else None
+
+        while not stop.is_set() and not heartbeat.stopping.is_set():
+            # limited queues are polled only while we hold one of their
+            # slots, slots are taken again before every GETJOB
+            tokens = {}
+            for queue, limiter in limiters.items():
+                token = limiter.acquire()
+                if token:
+                    tokens[queue] = token
+            polled = [q for q in order.next()
+                      if q not in limiters or q in tokens]
+            if not polled:
+                time.sleep(POLL_TIMEOUT / 1000)
+                continue
+
+            try:
+                results = []
+                blocking = polled
+                if tokens:
+                    # don't sit on slots while blocking, take what is
+                    # queued and keep the slot of the queue served only
+                    results = o.disque_client.get_job(polled, nohang=True,
+                                                      node=node)
+                    served = set(queue_name(r[0]) for r in results)
+                    for queue in list(tokens):
+                        if queue not in served:
+                            limiters[queue].release(tokens.pop(queue))
+                    blocking = [q for q in polled if q not in limiters]
+                if not results and blocking:
+                    results = o.disque_client.get_job(
+                        blocking, timeout=POLL_TIMEOUT, node=node)
+                elif not results:
+                    time.sleep(POLL_TIMEOUT / 1000)
+                if not results and poll_node:
+                    # move to the node holding jobs, if any
+                    node = poll_node(polled, node)
+                for queue, jobid, payload in results:
+                    order.served(queue)
+                    run_fetched(o, queue, jobid, payload,
+                                limiters.get(queue_name(queue)), node)
+            finally:
+                for queue, token in tokens.items():
+                    limiters[queue].release(token)
+            check_limits()
+
+    def run_fetched(o, queue, jobid, payload, limiter=None, node=None):
+        """ run a job, or a batch starting with it, a `limiter` of the
+        queue gives a slot for every other job of the batch, which is
+        taken from the `node` the job came from """
+        job = (jobid, ) + o.decode_job(payload)
+        funcname = job[1]
+        heartbeat.add(o.disque_client, o.job_retry(funcname, job[4]), jobid)
+        batch = o.configs[funcname].get('batch')
+        if batch and batch > 1:
+            jobs = [job]
+            tokens = []
+            count = batch - 1
+            if limiter:
+                while len(tokens) < count:
+                    token = limiter.acquire()
+                    if not token:
+                        break
+                    tokens.append(token)
+                count = len(tokens)
+            try:
+                if count:
+                    for _, jobid, payload in fetch_batch(
+                            o.disque_client, queue, count,
+                            o.configs[funcname].get('batch_wait'), node):
+                        fetched = (jobid, ) + o.decode_job(payload)
+                        heartbeat.add(o.disque_client,
+                                      o.job_retry(fetched[1], fetched[4]),
+                                      jobid)
+                        jobs.append(fetched)
+                # slots left over by a short batch
+                while len(tokens) > len(jobs) - 1:
+                    limiter.release(tokens.pop())
+                run_batch(o, jobs)
+            finally:
+                for token in tokens:
+                    limiter.release(token)
+        else:
+            run_job(o, *job)
+
+    def run_job(o, jobid, funcname, args, kwargs, meta):
         nonlocal odqcount
+        func = o.tasks[funcname]
+        odqcount += 1
+        key = o.cache.key(funcname, args, kwargs)
+        if key and cached(o, (jobid, funcname, args, kwargs, meta), key):
+            return
+        t0 = time.time()
+        try:
+            with profiler.profile(funcname,
+                                  o.configs[funcname].get('profile')):
+                result = func.__func__(*args, **kwargs)
+                if asyncio.iscoroutine(result):
+                    result = run_coroutine(result)
+            seconds = time.time() - t0
+        except Exception as e:
+            if metrics:
+                metrics.executed(funcname, [meta], t0, time.time() - t0,
+                                 False)
+            logger.exception('executing {}(*{}, **{}) failed'
+                             ''.format(funcname, args, kwargs))
+            fail_jobs(o, [(jobid, funcname, args, kwargs, meta)], e)
+        else:
+            if metrics:
+                metrics.executed(funcname, [meta], t0, seconds)
+            if sampled(log_sample):
+                logger.info('job {}(*{}, **{}) executed in {:.6f} '
+                            'seconds, returns {}'
+                            ''.format(funcname, args,
+                                      kwargs, seconds, result))
+            if key:
+                o.cache.set(funcname, key, result)
+            job = (jobid, funcname, args, kwargs, meta)
+            finish(o, job, True, result)
+            ack(o, [job])
 
-        path, name = odq.split(':')
-        m = importlib.import_module(path)
-        o = getattr(m, name)
+    def cached(o, job, key):
+        """ finish a job with its cached result, if any, and ack it at
+        once
+        :return: whether the result was cached """
+        hit, value = o.cache.get(job[1], key)
+        if metrics:
+            metrics.inc('odq_cache_total', job[1],
+                        result='hit' if hit else 'miss')
+        if hit:
+            finish(o, job, True, value)
+            ack_jobs(o, [job])
+        return hit
 
-        if queue:
-            queues = [queue]
+    def ack_jobs(o, jobs):
+        """ ack executed jobs, of any tasks, with one ACKJOB """
+        t1 = time.time()
+        o.disque_client.ack_job(*[job[0] for job in jobs])
+        heartbeat.remove(*[job[0] for job in jobs])
+        if metrics:
+            seconds = time.time() - t1
+            for funcname in set(job[1] for job in jobs):
+                metrics.observe('odq_ack_seconds', funcname, seconds)
+        o.release_jobs([job[1] for job in jobs], [job[4] for job in jobs])
+
+    def ack(o, jobs):
+        """ ack executed jobs, by the acker of the dispatcher if any """
+        if acker:
+            acker.add(jobs)
         else:
-            queues = []
-            for queue in o.queues:
-                configs = o.configs[queue]
-                max_workers = configs.get('max_workers')
-                if max_workers:
-                    if o.num_processing(queue) < max_workers:
-                        queues.append(queue)
-                else:
-                    queues.append(queue)
-
-        while True:
-            queues = queues[1:] + queues[:1]
-            results = o.disque_client.get_job(queues)
-            for queue, jobid, payload in results:
-                funcname, args, kwargs = loads(payload)
-                func = getattr(m, funcname)
-                odqcount += 1
-                setattr(func, '__odqcount__', odqcount)
-                try:
-                    t0 = time.time()
-                    result = func.__func__(*args, **kwargs)
-                    seconds = time.time() - t0
-                except:
-                    logger.exception('executing {}(*{}, **{}) failed'
-                                     ''.format(funcname, args, kwargs))
-                    # TODO: log error message to error queue
-                else:
-                    logger.info('job {}(*{}, **{}) executed in {:.6f} '
+            ack_jobs(o, jobs)
+
+    def finish(o, job, ok, value, done=True):
+        """ add what follows a job that is `done` in its workflow, and send
+        its result """
+        if not done or advance(o, job[0], job[4], ok, value):
+            send_reply(o.disque_client, job[4], job[0], ok, value)
+
+    def fail_jobs(o, jobs, error):
+        """ retry failed jobs, or move them to their dead-letter queue,
+        the producer gets the error once there is no retry left, must be
+        called in the `except` block """
+        tb = traceback.format_exc()
+        client = o.disque_client
+        for job in jobs:
+            failed = failed_job(o, *job, tb)
+            if failed:
+                dead, queue, payload, options = failed
+                client.add_job(queue, payload, **options)
+            if not failed or dead:
+                finish(o, job, False, error, done=bool(failed))
+            if failed:
+                client.ack_job(job[0])
+        heartbeat.remove(*[job[0] for job in jobs])
+
+    def run_batch(o, jobs):
+        """ group jobs by task, batch tasks are called once with a list of
+        (args, kwargs) and acked with a single ACKJOB """
+        nonlocal odqcount
+        groups = OrderedDict()
+        for job in jobs:
+            if o.configs[job[1]].get('batch'):
+                groups.setdefault(job[1], []).append(job)
+            else:
+                # shared queue, not every task in it is batch-aware
+                run_job(o, *job)
+
+        for funcname, group in groups.items():
+            func = o.tasks[funcname]
+            odqcount += len(group)
+            t0 = time.time()
+            try:
+                with profiler.profile(funcname,
+                                      o.configs[funcname].get('profile')):
+                    result = func.__func__([(args, kwargs) for _, _, args,
+                                            kwargs, _ in group])
+                    if asyncio.iscoroutine(result):
+                        result = run_coroutine(result)
+                seconds = time.time() - t0
+            except Exception as e:
+                if metrics:
+                    metrics.executed(funcname, [job[4] for job in group], t0,
+                                     time.time() - t0, False)
+                logger.exception('executing batch {}({} jobs) failed'
+                                 ''.format(funcname, len(group)))
+                fail_jobs(o, group, e)
+            else:
+                if metrics:
+                    metrics.executed(funcname, [job[4] for job in group], t0,
+                                     seconds)
+                if sampled(log_sample):
+                    logger.info('batch {}({} jobs) executed in {:.6f} '
                                 'seconds, returns {}'
-                                ''.format(funcname, args,
-                                          kwargs, seconds, result))
-                    o.disque_client.ack_job(jobid)
-
-    if subworker == 'thread':
-        import threading
-        tasks = [threading.Thread(target=do_work)
-                 for _ in range(subconcurrency)]
-        for t in tasks:
-            t.start()
-        for t in tasks:
-            t.join()
-
-    elif subworker == 'gevent':
-        from gevent import monkey
-        from gevent.pool import Pool
-        monkey.patch_all()
-        pool = Pool(subconcurrency)
-        for _ in range(subconcurrency):
-            pool.spawn(do_work)
-        pool.join()
-    else:
-        do_work()
+                                ''.format(funcname, len(group), seconds,
+                                          result))
+                for job, value in job_results(group, True, result, True):
+                    finish(o, job, True, value)
+                ack(o, group)
+
+    def execute(result):
+        """ run a job taken by the dispatcher """
+        run_fetched(o, *result)
+        check_limits()
+
+    def retry(queue):
+        return o.configs.get(queue_name(queue), {}).get('retry', o.retry)
+
+    queues = [queue] if queue else list(o.queues)
+    if dispatch and any(o.configs.get(q, {}).get('max_workers')
+                        for q in queues):
+        logger.warning('queues with max_workers are not prefetched, '
+                       'dispatching is off')
+        dispatch = False
+
+    try:
+        if dispatch:
+            acker = Acker(partial(ack_jobs, o), failed=lambda jobs:
+                          heartbeat.remove(*[job[0] for job in jobs]))
+            Dispatcher(o.disque_client, QueueOrder(queues, o.configs),
+                       execute, subconcurrency, prefetch, heartbeat, retry,
+                       lambda: stop.is_set() or
+                       heartbeat.stopping.is_set()).run()
+            acker.close()
+
+        elif subworker == 'thread':
+            tasks = [threading.Thread(target=do_work)
+                     for _ in range(subconcurrency)]
+            for t in tasks:
+                t.start()
+            for t in tasks:
+                t.join()
+
+        elif subworker == 'asyncio':
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(run_async_worker(
+                odq, queue, subconcurrency, logger, max_tasks, max_memory,
+                metrics, log_sample, heartbeat, profiler))
+
+        elif subworker == 'gevent':
+            from gevent.pool import Pool
+            pool = Pool(subconcurrency)
+            for _ in range(subconcurrency):
+                pool.spawn(do_work)
+            pool.join()
+        else:
+            do_work()
+    finally:
+        profiler.flush()
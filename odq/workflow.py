@@ -0,0 +1,243 @@
+""" Task Workflows
+
+Signatures are task calls to make later, workflows combine them:
+
+    chain(fetch.s(url), parse.s(), store.s(key='x'))()
+    group([resize.s(path, size) for size in sizes])()
+    chord(group([count.s(part) for part in parts]), total.s())()
+
+A chain runs its steps one after the other, each step is called with the
+return value of the previous one as first argument. A group runs its
+calls in parallel. A chord runs a group, then its callback with the list
+of the return values of the group.
+
+There is no coordinator, the steps that follow a job travel in its meta,
+and the worker that runs it adds them once it succeeds:
+
+    link: steps of a chain after the job, the result of the last step is
+          sent for the first job
+    chord: members add their results to `odq.chord.<id>.results`, the
+           member that finds the results of every member there takes the
+           token job of the queue `odq.chord.<id>`, collects the results
+           and adds the callback. Results are keyed by member index, so a
+           member that runs twice, e.g. after a worker died before acking
+           it, is counted once. QLEN, QPEEK and GETJOB only see the jobs
+           of the node they run on, so members send these commands to the
+           node owning the token.
+
+A chain ends at a step that fails, its error is sent as its result. A
+chord member that fails for good, i.e. after `max_retries`, counts as done,
+and the chord sends the error instead of calling the callback. Members of
+tasks without `max_retries` are retried by disque until they succeed.
+"""
+import uuid
+import pickle
+import logging
+
+from .results import reply_job, send_reply
+
+
+logger = logging.getLogger('odq')
+
+
+class Signature(object):
+    """
+    A task call to make later, created by `task.s(*args, **kwargs)`
+
+    :param odq: Odq instance of the task
+    :param task: the task, as returned by `Odq.task`
+    """
+
+    def __init__(self, odq, task, args=(), kwargs=None):
+        self.odq = odq
+        self.task = task
+        self.args = tuple(args)
+        self.kwargs = kwargs or {}
+
+    def __repr__(self):
+        return '<Signature %s%s>' % (self.name, self.args)
+
+    def __call__(self):
+        return self.task(*self.args, **self.kwargs)
+
+    @property
+    def name(self):
+        return self.task.__func__.__name__
+
+    @property
+    def step(self):
+        """ the call as carried by job meta, tuple(name, args, kwargs) """
+        return self.name, self.args, self.kwargs
+
+
+class chain(object):
+    """ run signatures one after the other, each one gets the return value
+    of the previous one as first argument """
+
+    def __init__(self, *signatures):
+        assert signatures
+        self.signatures = signatures
+
+    def __call__(self):
+        """ :return: job id, or AsyncResult of the last step """
+        first, rest = self.signatures[0], self.signatures[1:]
+        if not rest:
+            return first()
+        o = first.odq
+        config = o.configs[rest[-1].name]
+        meta = {'link': [sig.step for sig in rest]}
+        if config.get('result'):
+            meta.update(o.results.meta(config))
+        return o.wrap_result(config, o.add_step(first.step, meta))
+
+
+class group(object):
+    """ run signatures in parallel """
+
+    def __init__(self, signatures):
+        self.signatures = list(signatures)
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def __call__(self):
+        """ :return: list of job ids, or AsyncResult """
+        return [sig() for sig in self.signatures]
+
+
+class chord(object):
+    """ run a group, then `callback` with the list of its return values """
+
+    def __init__(self, header, callback):
+        if not isinstance(header, group):
+            header = group(header)
+        self.header = header
+        self.callback = callback
+
+    def __call__(self):
+        """ :return: chord id, or AsyncResult of the callback """
+        o = self.callback.odq
+        config = o.configs[self.callback.name]
+        if not self.header:
+            return self.callback.task([], *self.callback.args,
+                                      **self.callback.kwargs)
+
+        queue = 'odq.chord.{}'.format(uuid.uuid4().hex)
+        ttl = max(o.configs[sig.name].get('ttl') or o.ttl
+                  for sig in self.header.signatures)
+        token = o.disque_client.add_job(queue, b'1', retry=0, ttl=ttl)
+        meta = {'queue': queue, 'size': len(self.header), 'ttl': ttl,
+                'token': token, 'callback': self.callback.step}
+        if config.get('result'):
+            meta['reply'] = o.results.meta(config)
+        for index, sig in enumerate(self.header.signatures):
+            o.add_step(sig.step, {'chord': dict(meta, index=index)})
+        return o.wrap_result(config, queue)
+
+
+class Pinned(object):
+    """
+    Commands of a chord on the node owning its first token, or on the
+    connected node
+
+    :param client: disque client
+    :param job_id: id of the token
+    """
+
+    def __init__(self, client, job_id):
+        self.client = client
+        self.node = None
+        get_node = getattr(client, 'get_node', None)
+        if job_id and get_node:
+            node = get_node(job_id)
+            if node is not client.connected_node:
+                self.node = node
+
+    def add(self, queue, body, ttl):
+        if self.node:
+            command = self.client.add_job_command(queue, body, retry=0,
+                                                  ttl=ttl)
+            return self.node.connection.execute_command(*command)
+        return self.client.add_job(queue, body, retry=0, ttl=ttl)
+
+    def qlen(self, queue):
+        if self.node:
+            return self.node.connection.execute_command('QLEN', queue)
+        return self.client.qlen(queue)
+
+    def peek(self, queue, count):
+        """ :return: list of [queue_name, job_id, payload] """
+        if self.node:
+            return self.node.connection.execute_command('QPEEK', queue,
+                                                        count)
+        return self.client.qpeek(queue, count)
+
+    def take(self, queue, count=1):
+        """ :return: list of tuple(queue_name, job_id, payload) """
+        if self.node:
+            return self.node.connection.execute_command(
+                'GETJOB', 'NOHANG', 'COUNT', count, 'FROM', queue) or []
+        return self.client.get_job([queue], count=count, nohang=True)
+
+
+def advance(o, jobid, meta, ok, value):
+    """
+    Add what follows a finished job in its workflow, i.e. the next step of
+    its chain, or the callback of its chord once all members are done
+
+    :param ok: whether the job succeeded, a failed job must be done for
+               good, i.e. not retried
+    :param value: return value, or exception
+    :return: whether the job sends its result, False if a later step does
+    """
+    if ok and meta.get('link'):
+        (name, args, kwargs), rest = meta['link'][0], meta['link'][1:]
+        step_meta = {key: meta[key] for key in ('reply_to', 'result_ttl')
+                     if key in meta}
+        step_meta['id'] = meta.get('id', jobid)
+        if rest:
+            step_meta['link'] = rest
+        o.add_step((name, (value, ) + tuple(args), kwargs), step_meta)
+        return False
+    if meta.get('chord'):
+        chord_done(o, meta['chord'], ok, value)
+    return True
+
+
+def chord_done(o, chord, ok, value):
+    """ add the result of a member of a chord, the member that finds the
+    results of all members adds the callback """
+    client = o.disque_client
+    node = Pinned(client, chord['token'])
+    results_queue = chord['queue'] + '.results'
+    node.add(results_queue, reply_job(chord['index'], ok, value),
+             chord['ttl'])
+    # members that ran twice only add to the length
+    count = node.qlen(results_queue)
+    if count < chord['size']:
+        return
+    jobs = node.peek(results_queue, count)
+    # index -> tuple(ok, value), a success of a member that ran twice wins
+    results = {}
+    for _, _, body in jobs:
+        index, ok, value = pickle.loads(body)
+        if ok or index not in results:
+            results[index] = (ok, value)
+    if len(results) < chord['size']:
+        return
+    # the token goes to one of the members that found every result
+    tokens = node.take(chord['queue'])
+    if not tokens:
+        return
+    client.ack_job(*[job_id for _, job_id, _ in tokens + jobs])
+
+    values = [results[index][1] for index in range(chord['size'])]
+    errors = [value for ok, value in results.values() if not ok]
+    reply = dict(chord.get('reply') or {}, id=chord['queue'])
+    if errors:
+        logger.warning('chord %s failed with %d errors, first %r',
+                       chord['queue'], len(errors), errors[0])
+        send_reply(client, reply, chord['queue'], False, errors[0])
+        return
+    name, args, kwargs = chord['callback']
+    o.add_step((name, (values, ) + tuple(args), kwargs), reply)
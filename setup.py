@@ -15,4 +15,5 @@ setup(name='odq',
       entry_points="""\
       [console_scripts]
       odqw=odq.worker:main
+      odqbeat=odq.beat:main
       """)
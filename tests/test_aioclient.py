@@ -0,0 +1,46 @@
+import json
+import asyncio
+
+from odq import Odq
+from odq.aioclient import AsyncClient
+
+
+def test_aioclient():
+    async def run():
+        c = AsyncClient(['localhost:7711'])
+        await c.execute_command('DEBUG', 'FLUSHALL')
+        job_id = await c.add_job("test", json.dumps(["hello", "1234"]))
+
+        jobs = await c.get_job(['test'], timeout=5)
+        assert [job_id] == [jid for _, jid, _ in jobs]
+        await c.ack_job(job_id)
+
+        job_ids = await asyncio.gather(*[c.add_job("test", str(i))
+                                         for i in range(100)])
+        assert len(set(job_ids)) == 100
+        assert await c.qlen("test") == 100
+
+    asyncio.get_event_loop().run_until_complete(run())
+
+
+def test_aio_task():
+    o = Odq()
+    @o.task
+    async def aio_add(a, b):
+        return a + b
+
+    async def run():
+        await o.aio_client.execute_command('DEBUG', 'FLUSHALL')
+        jid = await aio_add.aio(1, 2)
+        queue, jobid, payload = (await o.aio_client.get_job(['aio_add']))[0]
+        assert jid == jobid
+        await o.aio_client.ack_job(jobid)
+
+        assert await aio_add.with_config(debug=True).aio(1, 2) == 3
+
+    asyncio.get_event_loop().run_until_complete(run())
+
+
+if __name__ == '__main__':
+    test_aioclient()
+    test_aio_task()
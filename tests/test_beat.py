@@ -0,0 +1,34 @@
+from odq import Odq
+from odq.beat import Beat
+from odq.broker import MemoryBroker
+
+o = Odq(MemoryBroker())
+
+
+@o.task(cron='*/10 * * * * * *')
+def tick():
+    return 1
+
+
+def test_beat():
+    a = Beat('test_beat:o')
+    b = Beat('test_beat:o')
+    slot = a.heap[0][0]
+    assert slot % 10 == 0
+
+    # redundant schedulers fire every slot once
+    assert a.tick(slot - 1) == []
+    assert a.tick(slot) == [('tick', slot)]
+    assert b.tick(slot + 1) == []
+    assert a.heap[0] == b.heap[0] == (slot + 10, 'tick')
+    assert o.disque_client.qlen('tick') == 1
+
+    # slots too late to be claimed safely are skipped
+    now = slot + 10 + a.grace + 1
+    fired = a.tick(now)
+    assert fired[0] == ('tick', slot + 20)
+    assert fired[-1] == ('tick', now // 10 * 10)
+
+
+if __name__ == '__main__':
+    test_beat()
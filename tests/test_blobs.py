@@ -0,0 +1,93 @@
+import os
+import time
+import pickle
+import tempfile
+import threading
+
+import pytest
+
+from odq import Odq
+from odq.blobs import OUT_OF_BAND, BlobStore
+from odq.broker import MemoryBroker
+from odq.worker import run_worker
+
+store = BlobStore(tempfile.mkdtemp(), threshold=1000)
+o = Odq(MemoryBroker(), blob_store=store, result_ttl=60)
+
+
+@o.task(result=True)
+def size(data):
+    return len(data)
+
+
+def count(store, name):
+    return sum(len(files) for _, _, files in
+               os.walk(os.path.join(store.path, name)))
+
+
+def test_blob_store():
+    store = BlobStore(tempfile.mkdtemp(), threshold=1000)
+    assert store.offload((b'small', ), {}, {}) == ((b'small', ), {})
+
+    data = b'x' * 5000
+    a, b = {}, {}
+    assert store.offload((data, ), {'n': 1}, a) == ((), {})
+    store.offload((data, ), {'n': 1}, b)
+    # one pickle stream, shared by both jobs
+    assert len(a['blobs']) == 1
+    assert count(store, 'blobs') == 1
+    assert count(store, 'refs') == 2
+    assert store.load(a) == ((data, ), {'n': 1})
+
+    store.release(a)
+    assert count(store, 'blobs') == 1
+    store.release(b)
+    assert count(store, 'blobs') == 0
+
+    # references of jobs that were never acked expire
+    store.offload((b'y' * 5000, ), {}, {}, ttl=10)
+    assert store.collect() == 0
+    assert store.collect(now=os.path.getmtime(store.path) + 3600) == 1
+    assert count(store, 'refs') == count(store, 'blobs') == 0
+
+
+@pytest.mark.skipif(not OUT_OF_BAND, reason='needs pickle protocol 5')
+def test_out_of_band():
+    store = BlobStore(tempfile.mkdtemp(), threshold=1000)
+    data = bytearray(b'x' * 5000)
+    a, b = {}, {}
+    assert store.offload((pickle.PickleBuffer(data), ), {'n': 1}, a) == \
+        ((), {})
+    store.offload((pickle.PickleBuffer(data), ), {'n': 1}, b)
+    # pickle stream and out-of-band buffer, shared by both jobs
+    assert len(a['blobs']) == 2
+    assert count(store, 'blobs') == 2
+    assert count(store, 'refs') == 4
+
+    args, kwargs = store.load(a)
+    assert isinstance(args[0], memoryview) and args[0].readonly
+    assert bytes(args[0]) == bytes(data) and kwargs == {'n': 1}
+
+    store.release(a)
+    assert count(store, 'blobs') == 2
+    store.release(b)
+    assert count(store, 'blobs') == 0
+
+
+def test_blob_worker():
+    t = threading.Thread(target=run_worker, args=('test_blobs:o', 'size'))
+    t.daemon = True
+    t.start()
+    assert size(b'z' * 100000).get(timeout=5) == 100000
+    # released after the ack, which follows the result
+    deadline = time.time() + 5
+    while count(store, 'blobs') and time.time() < deadline:
+        time.sleep(0.01)
+    assert count(store, 'blobs') == 0
+
+
+if __name__ == '__main__':
+    test_blob_store()
+    if OUT_OF_BAND:
+        test_out_of_band()
+    test_blob_worker()
@@ -0,0 +1,73 @@
+import time
+import threading
+
+import pytest
+
+from odq import Odq
+from odq.broker import MemoryBroker
+from odq.worker import run_worker
+
+o = Odq(MemoryBroker())
+
+
+@o.task(result=True)
+def square(a):
+    return a * a
+
+
+def test_broker():
+    broker = MemoryBroker()
+    a = broker.add_job('q', b'a')
+    b = broker.add_job('q', b'b', delay=1)
+    assert broker.qlen('q') == 1
+    assert broker.qpeek('q', 10) == [[b'q', a, b'a']]
+
+    # delayed jobs are queued by their timer, while GETJOB blocks
+    assert broker.get_job(['q']) == [(b'q', a, b'a')]
+    t0 = time.time()
+    assert broker.get_job(['q'], timeout=2000) == [(b'q', b, b'b')]
+    assert 0.9 < time.time() - t0 < 1.5
+    assert broker.get_job(['q'], timeout=10) == []
+
+    # unacked jobs come back after RETRY, acked ones are gone
+    c = broker.add_job('q', b'c', retry=1)
+    assert broker.get_job(['q']) == [(b'q', c, b'c')]
+    assert broker.get_job(['q'], timeout=2000) == [(b'q', c, b'c')]
+    assert broker.ack_job(a, b, c) == 3
+    assert broker.show(c) is None
+
+    ids = broker.add_jobs('q', [b'x'] * 3, maxlen=2)
+    assert isinstance(ids[-1], Exception)
+    assert len(broker.get_job(['q'], count=10)) == 2
+
+
+def test_broker_aio():
+    # not a client of localhost:7711
+    with pytest.raises(RuntimeError):
+        o.aio_client
+
+
+def test_broker_jscan():
+    ids = o.disque_client.add_jobs('scan', [b'x'] * 250)
+    o.disque_client.get_job(['scan'], count=50)
+    assert sorted(o.iter_jobs('scan', 'queued', 30)) == sorted(ids[50:])
+    assert o.count_jobs('scan', 'active') == 50
+    # the id index follows deletes
+    o.disque_client.ack_job(*ids[:100])
+    assert o.disque_client.ids == sorted(o.disque_client.jobs)
+    assert o.count_jobs('scan', 'queued') == 150
+
+
+def test_broker_worker():
+    t = threading.Thread(target=run_worker, args=('test_broker:o', 'square'))
+    t.daemon = True
+    t.start()
+    results = square.map(range(100))
+    assert o.get_many(results, timeout=5) == [i * i for i in range(100)]
+
+
+if __name__ == '__main__':
+    test_broker()
+    test_broker_aio()
+    test_broker_jscan()
+    test_broker_worker()
@@ -0,0 +1,68 @@
+import threading
+
+from redis.exceptions import ConnectionError
+
+from odq import Odq
+from odq.broker import MemoryBroker
+from odq.cache import ResultCache
+from odq.worker import run_worker
+
+o = Odq(MemoryBroker(), result_ttl=60)
+calls = []
+
+
+@o.task(result=True, cache=60)
+def cached_square(n):
+    calls.append(n)
+    return n * n
+
+
+def test_cache():
+    t = threading.Thread(target=run_worker, args=('test_cache:o',
+                                                  'cached_square'))
+    t.daemon = True
+    t.start()
+    assert cached_square(3).get(timeout=5) == 9
+    assert cached_square(3).get(timeout=5) == 9
+    assert cached_square(4).get(timeout=5) == 16
+    assert calls == [3, 4]
+
+    # shared through the broker
+    o.cache.local.clear()
+    assert cached_square(3).get(timeout=5) == 9
+    assert calls == [3, 4]
+    assert o.cache.stats() == {'cached_square': {'hits': 2, 'misses': 2}}
+    # hits are acked
+    assert o.disque_client.qlen('cached_square') == 0
+
+
+def test_lru():
+    cache = ResultCache(o, size=2)
+    for n in range(3):
+        key = cache.key('cached_square', (n, ), {})
+        cache.set('cached_square', key, n * n)
+    assert len(cache.local) == 2
+    assert cache.get('cached_square',
+                     cache.key('cached_square', (2, ), {})) == (True, 4)
+    # not picklable
+    assert cache.key('cached_square', (lambda: 1, ), {}) is None
+
+
+def test_broker_errors():
+    cache = ResultCache(o)
+
+    def fail(*args):
+        raise ConnectionError('down')
+
+    cache.execute = fail
+    key = cache.key('cached_square', (5, ), {})
+    # broker errors are misses, the local tier still works
+    assert cache.get('cached_square', key) == (False, None)
+    cache.set('cached_square', key, 25)
+    assert cache.get('cached_square', key) == (True, 25)
+
+
+if __name__ == '__main__':
+    test_cache()
+    test_lru()
+    test_broker_errors()
@@ -1,6 +1,14 @@
 import json
+import time
 import logging
-from odq.client import Client
+
+import pytest
+import redis
+from redis.exceptions import ConnectionError, ResponseError
+
+from odq.broker import MemoryBroker
+from odq.client import Client, Node, node_prefix, retry
+from odq.worker import fetch_batch
 
 def test_client():
     logging.basicConfig(level=logging.DEBUG)
@@ -15,5 +23,171 @@ def test_client():
         print(job_id)
         c.ack_job(job_id)
 
+
+def test_add_jobs():
+    c = Client(['localhost:7711'])
+    c.execute_command('DEBUG', 'FLUSHALL')
+    jobs = [json.dumps(["hello", i]) for i in range(5)]
+    job_ids = c.add_jobs("test", jobs, chunk_size=2, maxlen=3)
+    assert len(job_ids) == 5
+    assert all(isinstance(i, bytes) for i in job_ids[:3])
+    assert all(isinstance(i, ResponseError) for i in job_ids[3:])
+
+    results = c.get_job(['test'], count=5)
+    assert [job_id for _, job_id, _ in results] == job_ids[:3]
+    c.ack_job(*job_ids[:3])
+
+
+def test_balance():
+    c = Client(['localhost:7711'], balance='round-robin')
+    c.execute_command('DEBUG', 'FLUSHALL')
+    # a second node, in memory
+    broker = MemoryBroker()
+    node = Node(broker.node_id.encode(), 'memory', 0, broker)
+    c.prefixes[node_prefix(broker.node_id)] = node
+
+    job_ids = [c.add_job('balanced', 'x', balanced=True) for _ in range(4)]
+    assert broker.qlen('balanced') == c.qlen('balanced') == 2
+    assert [c.get_node(job_id) for job_id in job_ids].count(node) == 2
+    # internal queues stay on the connected node
+    c.add_jobs('internal', ['x'] * 4)
+    assert c.qlen('internal') == 4
+
+    # producers pick the shortest queue
+    c.balance = 'qlen'
+    c.get_job(['balanced'], count=2)
+    assert c.pick_node('balanced') is c.connected_node
+    c.add_job('balanced', 'x', balanced=True)
+    assert c.qlen('balanced') == 1
+
+    # workers move to the node holding the most jobs
+    assert c.poll_node(['balanced'], c.connected_node) is node
+    jobs = c.get_job(['balanced'], count=5, node=node)
+    assert len(jobs) == 2
+    # queue lengths are cached for qlen_ttl seconds
+    assert c.queue_counts(['balanced']) == {c.connected_node: 1, node: 2}
+    # acks are routed to the owner
+    c.ack_job(*[job_id for _, job_id, _ in jobs])
+    assert not broker.jobs
+    # batches are topped up from the polled node
+    broker.add_jobs('balanced', ['y'] * 2)
+    jobs = fetch_batch(c, 'balanced', 5, node=node)
+    assert len(jobs) == 2
+    c.ack_job(*[job_id for _, job_id, _ in jobs])
+
+    # names are hashed over all nodes, available or not
+    names = ['q{}'.format(i) for i in range(20)]
+    hashed = [c.hashed_node(name) for name in names]
+    assert set(hashed) == {c.connected_node, node}
+    node.failed()
+    assert [c.hashed_node(name) for name in names] == hashed
+    c.execute_command('DEBUG', 'FLUSHALL')
+
+
+def test_failover():
+    start = time.time()
+    c = Client(['localhost:7799', 'localhost:7711', '127.0.0.1:7711'])
+    assert c.connected_node is c.nodes['localhost:7711']
+    # the dead node is skipped from now on
+    dead = c.nodes['localhost:7799']
+    assert dead.failures == 1 and not dead.available()
+
+    # the connected node dies, commands go to the next node at once
+    node = c.connected_node
+    node.connection = redis.Redis('localhost', 7799)
+    assert c.qlen('failover') == 0
+    assert c.connected_node is c.nodes['127.0.0.1:7711']
+    assert not node.available()
+    assert time.time() - start < 0.5
+
+    # health checks close the circuit of nodes that are back
+    node.connection = c.connected_node.connection
+    node.probe = None
+    assert c.check_health() == [dead]
+    assert node.available() and not node.failures
+    assert not dead.available()
+
+
+sent = []
+
+
+class Reset(redis.Connection):
+    # the node dies once the command is sent
+    def read_response(self):
+        sent.append(1)
+        raise ConnectionError('reset')
+
+
+def dying():
+    return redis.Redis(connection_pool=redis.ConnectionPool(
+        connection_class=Reset, host='localhost', port=7711))
+
+
+def test_writes_not_sent_twice():
+    c = Client(['localhost:7711', '127.0.0.1:7711'])
+    c.execute_command('DEBUG', 'FLUSHALL')
+    del sent[:]
+    node = c.connected_node
+    node.connection = dying()
+    with pytest.raises(ConnectionError):
+        c.add_job('writes', 'x')
+    assert len(sent) == 1
+    assert c.connected_node is not node
+    # reads are sent again, the job was added once
+    other = Node(None, 'localhost', 7711, dying())
+    assert c.execute_on_node(other, 'QLEN', 'writes') == 1
+    with pytest.raises(ConnectionError):
+        c.execute_on_node(Node(None, 'localhost', 7711, dying()),
+                          'ADDJOB', 'writes', 'x', 0)
+    assert len(sent) == 3
+
+    # writes the node didn't get are sent again
+    node.connection = redis.Redis('localhost', 7711)
+    c.connected_node.connection = redis.Redis('localhost', 7799)
+    assert c.add_job('writes', 'x')
+    c.execute_command('DEBUG', 'FLUSHALL')
+
+
+def test_pipelined_writes_not_sent_twice():
+    c = Client(['localhost:7711', '127.0.0.1:7711'])
+    c.execute_command('DEBUG', 'FLUSHALL')
+    del sent[:]
+    node = c.connected_node
+    node.connection = dying()
+    with pytest.raises(ConnectionError):
+        c.add_jobs('pipelined', ['x'] * 3)
+    assert len(sent) == 1
+    # reads are sent again, the jobs were added at most once
+    node.failures = node.down_until = 0
+    c.connected_node = node
+    qlen, = c.execute_pipeline([['QLEN', 'pipelined']])
+    assert qlen <= 3
+    assert c.connected_node is not node
+    c.execute_command('DEBUG', 'FLUSHALL')
+
+
+def test_retry():
+    calls = []
+
+    @retry(retry_count=2)
+    def fail(error):
+        calls.append(error)
+        raise error
+
+    with pytest.raises(ConnectionError):
+        fail(ConnectionError())
+    assert len(calls) == 3
+    # not retryable
+    with pytest.raises(ResponseError):
+        fail(ResponseError())
+    assert len(calls) == 4
+
+
 if __name__ == '__main__':
     test_client()
+    test_add_jobs()
+    test_balance()
+    test_failover()
+    test_writes_not_sent_twice()
+    test_pipelined_writes_not_sent_twice()
+    test_retry()
@@ -0,0 +1,47 @@
+import pytest
+
+from odq import Odq
+from odq.broker import MemoryBroker
+
+o = Odq(MemoryBroker())
+other = Odq(o.disque_client)
+
+
+@o.task(dedup=True, dedup_window=60)
+def reindex(user_id):
+    return user_id
+
+
+@o.task(dedup=lambda user, **kwargs: user['id'])
+def notify(user, message=None):
+    return message
+
+
+def test_dedup():
+    a = reindex(42)
+    assert reindex(42) == a
+    assert reindex(43) != a
+    assert o.disque_client.qlen('reindex') == 2
+
+    # coalesced across producers through the broker
+    other.dedup.local.clear()
+    assert other.dedup.add_job(reindex.__func__, reindex.__func__.__odq__,
+                               (42, ), {}) == a
+
+    # a started job is not reused
+    o.disque_client.get_job(['reindex'], count=2)
+    b = reindex(42)
+    assert b != a
+    assert o.disque_client.qlen('reindex') == 1
+
+    assert notify({'id': 1}, message='x') == notify({'id': 1}, message='y')
+    # map too
+    assert len(set(reindex.map([50, 51, 50, 51]))) == 2
+    assert o.disque_client.qlen('reindex') == 3
+
+    with pytest.raises(ValueError):
+        o.task(dedup=True, result=True)
+
+
+if __name__ == '__main__':
+    test_dedup()
@@ -0,0 +1,80 @@
+import time
+import threading
+
+from odq import Odq
+from odq.broker import MemoryBroker
+from odq.dispatcher import Acker, Dispatcher
+from odq.heartbeat import Heartbeat
+from odq.polling import QueueOrder
+from odq.worker import run_worker
+
+o = Odq(MemoryBroker(), result_ttl=60)
+
+
+@o.task(result=True)
+def dispatched(n):
+    time.sleep(0.01)
+    return n * n
+
+
+def test_acker():
+    calls = []
+    acker = Acker(calls.append, interval=0.1)
+    for i in range(10):
+        acker.add([i])
+    acker.close()
+    assert sum(calls, []) == list(range(10))
+    assert len(calls) < 10
+
+    # jobs that failed to be acked are released
+    def fail(jobs):
+        raise ConnectionError('down')
+
+    released = []
+    acker = Acker(fail, failed=released.extend)
+    acker.add([1, 2])
+    acker.close()
+    assert released == [1, 2]
+
+
+def test_dispatch():
+    heartbeat = Heartbeat()
+    t = threading.Thread(target=run_worker, args=('test_dispatcher:o',
+                                                  'dispatched'),
+                         kwargs={'subworker': 'thread', 'subconcurrency': 4,
+                                 'dispatch': True, 'heartbeat': heartbeat})
+    t.daemon = True
+    t.start()
+    results = dispatched.map(range(100))
+    assert o.get_many(results, timeout=10) == [n * n for n in range(100)]
+
+    heartbeat.stopping.set()
+    t.join(timeout=5)
+    assert not t.is_alive()
+    # every job was acked
+    assert not o.disque_client.jobs
+
+
+def test_nack_on_shutdown():
+    client = MemoryBroker()
+    client.add_jobs('q', [b'job'] * 10)
+    stop = threading.Event()
+    started = []
+
+    def execute(result):
+        started.append(result)
+        stop.set()
+        time.sleep(0.2)
+
+    dispatcher = Dispatcher(client, QueueOrder(['q'], {}), execute, 1,
+                            prefetch=4, stopped=stop.is_set)
+    dispatcher.run()
+    # the running job finished, the prefetched ones are queued again
+    assert len(started) == 1
+    assert client.qlen('q') == 9
+
+
+if __name__ == '__main__':
+    test_acker()
+    test_dispatch()
+    test_nack_on_shutdown()
@@ -0,0 +1,81 @@
+import time
+import threading
+
+from odq import Odq
+from odq.broker import MemoryBroker
+from odq.heartbeat import Heartbeat
+from odq.worker import run_worker
+
+o = Odq(MemoryBroker(), retry=1)
+calls = []
+
+
+@o.task(result=True)
+def slow_heartbeat(n):
+    calls.append(n)
+    time.sleep(2.5)
+    return n
+
+
+def test_heartbeat_keeps_job():
+    heartbeat = Heartbeat()
+    t = threading.Thread(target=run_worker, args=('test_heartbeat:o',
+                                                  'slow_heartbeat'),
+                         kwargs={'heartbeat': heartbeat})
+    t.daemon = True
+    t.start()
+    assert slow_heartbeat(1).get(timeout=5) == 1
+    # not delivered again while it ran longer than its RETRY
+    time.sleep(0.2)
+    assert calls == [1]
+    assert len(heartbeat) == 0
+
+    heartbeat.stopping.set()
+    t.join(timeout=3)
+    assert not t.is_alive()
+
+
+@o.task(result=True, retry=60)
+def overridden_heartbeat(n):
+    calls.append(n)
+    time.sleep(1.5)
+    return n
+
+
+def test_heartbeat_of_call_config():
+    heartbeat = Heartbeat()
+    t = threading.Thread(target=run_worker, args=('test_heartbeat:o',
+                                                  'overridden_heartbeat'),
+                         kwargs={'heartbeat': heartbeat})
+    t.daemon = True
+    t.start()
+    # the job was added with RETRY 1, not the 60 of its task
+    result = overridden_heartbeat.with_config(retry=1)(2)
+    assert result.get(timeout=5) == 2
+    time.sleep(0.2)
+    assert calls.count(2) == 1
+
+    heartbeat.stopping.set()
+    t.join(timeout=3)
+    assert not t.is_alive()
+
+
+def test_nack_all():
+    client = MemoryBroker()
+    client.add_job('q', 'a', retry=0)
+    client.add_job('q', 'b', retry=300)
+    jobs = client.get_job(['q'], count=2)
+    assert client.qlen('q') == 0
+
+    heartbeat = Heartbeat()
+    heartbeat.add(client, 0, jobs[0][1])
+    heartbeat.add(client, 300, jobs[1][1])
+    assert heartbeat.nack_all() == 2
+    assert client.qlen('q') == 2
+    assert len(heartbeat) == 0
+
+
+if __name__ == '__main__':
+    test_heartbeat_keeps_job()
+    test_heartbeat_of_call_config()
+    test_nack_all()
@@ -0,0 +1,90 @@
+import time
+import threading
+
+from odq import Odq
+from odq.broker import MemoryBroker
+from odq.heartbeat import Heartbeat
+from odq.limits import Limiter
+from odq.worker import run_worker
+
+m = Odq(MemoryBroker(), result_ttl=60)
+release = threading.Event()
+
+
+@m.task(result=True)
+def lim_slow():
+    release.wait(5)
+    return 'slow'
+
+
+@m.task(result=True, max_workers=1)
+def lim_one():
+    return 'one'
+
+
+def test_limiter():
+    o = Odq()
+    o.disque_client.execute_command('DEBUG', 'FLUSHALL')
+
+    limiter = Limiter(o, 'add', 2)
+    a = limiter.acquire()
+    b = limiter.acquire()
+    assert a and b and a != b
+    assert limiter.acquire() is None
+
+    limiter.release(a)
+    assert limiter.acquire() == a
+
+    # a lower limit drops queued tokens, a higher one adds tokens
+    limiter.release(a)
+    limiter.release(b)
+    limiter.limit = 1
+    limiter.reconcile()
+    assert o.disque_client.qlen(limiter.slots_queue) == 1
+    limiter.limit = 3
+    limiter.reconcile()
+    assert o.disque_client.qlen(limiter.slots_queue) == 3
+
+
+def test_lease():
+    client = MemoryBroker()
+    heartbeat = Heartbeat()
+    limiter = Limiter(Odq(client), 'lim_lease', 1, lease=1,
+                      heartbeat=heartbeat)
+    token = limiter.acquire()
+    # held past its lease, the heartbeat keeps it
+    time.sleep(1.5)
+    assert limiter.acquire() is None
+    limiter.release(token)
+    assert len(heartbeat) == 0
+    assert limiter.acquire() == token
+
+
+def test_worker_slots():
+    heartbeat = Heartbeat()
+    t = threading.Thread(target=run_worker, args=('test_limits:m', ),
+                         kwargs={'heartbeat': heartbeat})
+    t.daemon = True
+    t.start()
+    slow = lim_slow()
+    deadline = time.time() + 5
+    while m.disque_client.qlen('lim_slow') and time.time() < deadline:
+        time.sleep(0.01)
+
+    # the worker runs a job of another queue, it holds no slot
+    limiter = Limiter(m, 'lim_one', 1)
+    token = limiter.acquire()
+    assert token
+    limiter.release(token)
+
+    release.set()
+    assert slow.get(timeout=5) == 'slow'
+    assert lim_one().get(timeout=5) == 'one'
+    heartbeat.stopping.set()
+    t.join(timeout=5)
+
+
+if __name__ == '__main__':
+    test_limiter()
+    test_lease()
+    test_worker_slots()
@@ -0,0 +1,25 @@
+import time
+
+from odq.metrics import Metrics
+
+
+def test_metrics():
+    metrics = Metrics()
+    now = time.time()
+    metrics.executed('add', [{'t': now - 2}, {}], now, 0.003)
+    metrics.executed('add', [{}], now, 0.2, False)
+    metrics.observe('odq_ack_seconds', 'add', 0.0005)
+
+    text = metrics.render()
+    assert 'odq_jobs_total{task="add",status="ok"} 2' in text
+    assert 'odq_jobs_total{task="add",status="failed"} 1' in text
+    assert 'odq_execution_seconds_bucket{task="add",le="0.005"} 1' in text
+    assert 'odq_execution_seconds_bucket{task="add",le="+Inf"} 2' in text
+    assert 'odq_execution_seconds_count{task="add"} 2' in text
+    assert 'odq_queue_wait_seconds_bucket{task="add",le="1"} 0' in text
+    assert 'odq_queue_wait_seconds_bucket{task="add",le="2.5"} 1' in text
+    assert 'odq_ack_seconds_bucket{task="add",le="0.001"} 1' in text
+
+
+if __name__ == '__main__':
+    test_metrics()
@@ -0,0 +1,36 @@
+from collections import Counter
+
+from odq.polling import QueueOrder
+
+
+def test_weights():
+    order = QueueOrder(['bulk', 'report', 'email'],
+                       {'email': {'weight': 7}, 'report': {'weight': 2}})
+    served = Counter()
+    for _ in range(1000):
+        queue = order.next()[0]
+        served[queue] += 1
+        order.served(queue.encode())
+    assert served == {'email': 700, 'report': 200, 'bulk': 100}
+
+    # an empty queue lends its turns, without saving them up
+    served = Counter()
+    for i in range(1000):
+        queue = [q for q in order.next() if q != 'email' or i >= 900][0]
+        served[queue] += 1
+        order.served(queue)
+    assert abs(served['report'] - 2 * served['bulk']) <= 2
+    assert served['email'] <= 100
+
+
+def test_priority():
+    order = QueueOrder(['bulk', 'email', 'report'],
+                       {'email': {'priority': 2}, 'report': {'priority': 1}})
+    for _ in range(10):
+        assert order.next() == ['email', 'report', 'bulk']
+        order.served('email')
+
+
+if __name__ == '__main__':
+    test_weights()
+    test_priority()
@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+import signal
+import tempfile
+import subprocess
+
+from odq import Odq
+from odq.broker import MemoryBroker
+
+o = Odq(MemoryBroker())
+
+# each child works on a copy of the broker forked from the supervisor, so
+# executions are written to a file
+SUPERVISOR = '''
+import test_prefork
+from odq.prefork import Supervisor
+test_prefork.prefork_job.map(range(10))
+Supervisor('test_prefork:o', 1, queue='prefork_job', max_tasks=2,
+           grace=1).run()
+'''
+
+
+@o.task()
+def prefork_job(n):
+    with open(os.environ['PREFORK_LOG'], 'a') as f:
+        f.write('{} {}\n'.format(os.getpid(), n))
+
+
+def executions(path):
+    """ :return: list of tuple(pid, number of jobs run) """
+    counts = []
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                pid = line.split()[0]
+                if counts and counts[-1][0] == pid:
+                    counts[-1] = (pid, counts[-1][1] + 1)
+                else:
+                    counts.append((pid, 1))
+    return counts
+
+
+def test_recycle():
+    path = os.path.join(tempfile.mkdtemp(), 'executions')
+    here = os.path.dirname(os.path.abspath(__file__))
+    # prepended, dependencies may come from PYTHONPATH
+    paths = [here, os.path.dirname(here), os.environ.get('PYTHONPATH')]
+    env = dict(os.environ, PREFORK_LOG=path,
+               PYTHONPATH=os.pathsep.join(p for p in paths if p))
+    p = subprocess.Popen([sys.executable, '-c', SUPERVISOR], env=env)
+    try:
+        deadline = time.time() + 10
+        while len(executions(path)) < 3 and time.time() < deadline:
+            time.sleep(0.1)
+    finally:
+        p.send_signal(signal.SIGTERM)
+        assert p.wait(timeout=10) == 0
+
+    # children exit after max_tasks jobs, and are replaced by children
+    # that keep running jobs
+    counts = executions(path)
+    assert len(counts) >= 3
+    assert all(count == 2 for _, count in counts[:-1])
+
+
+if __name__ == '__main__':
+    test_recycle()
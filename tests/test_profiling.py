@@ -0,0 +1,77 @@
+import os
+import pstats
+import tempfile
+import threading
+
+from odq import Odq
+from odq.broker import MemoryBroker
+from odq.profiling import Profiler
+from odq.worker import run_worker
+
+o = Odq(MemoryBroker(), result_ttl=60)
+profiler = Profiler(path=tempfile.mkdtemp(), memory=True)
+
+
+@o.task(result=True, profile=1)
+def profiled_sum(n):
+    return sum(list(range(n)))
+
+
+@o.task(result=True)
+def profiled_once(n):
+    return n
+
+
+def test_profiler():
+    p = Profiler(rate=1, memory=True, path=tempfile.mkdtemp())
+    for _ in range(3):
+        with p.profile('alloc'):
+            data = [bytes(1000) for _ in range(100)]
+    assert data
+    assert p.samples['alloc'] == 3
+    assert p.peaks['alloc'] >= 100000
+
+    p.write()
+    stats = pstats.Stats(os.path.join(p.path,
+                                      'alloc.{}.prof'.format(os.getpid())))
+    assert stats.total_calls
+    with open(os.path.join(p.path, 'memory.{}.txt'.format(os.getpid()))) as f:
+        assert f.read().startswith('alloc samples=3 ')
+
+    # not sampled
+    with Profiler().profile('none'):
+        pass
+    assert not Profiler(rate=0).sampled(None)
+
+
+def test_worker():
+    t = threading.Thread(target=run_worker, args=('test_profiling:o',
+                                                  'profiled_sum'),
+                         kwargs={'profiler': profiler})
+    t.daemon = True
+    t.start()
+    results = [profiled_sum(1000) for _ in range(3)]
+    assert o.get_many(results, timeout=5) == [499500] * 3
+    assert profiler.samples['profiled_sum'] == 3
+    assert profiler.peaks['profiled_sum'] > 0
+
+
+def test_write_on_return():
+    # settings instead of a Profiler, as a process pool passes them
+    path = tempfile.mkdtemp()
+    t = threading.Thread(target=run_worker, args=('test_profiling:o',
+                                                  'profiled_once'),
+                         kwargs={'max_tasks': 1, 'profiler': {
+                             'rate': 1, 'path': path, 'interval': 3600}})
+    t.start()
+    assert profiled_once(1).get(timeout=5) == 1
+    t.join(timeout=5)
+    assert not t.is_alive()
+    assert os.path.exists(os.path.join(
+        path, 'profiled_once.{}.prof'.format(os.getpid())))
+
+
+if __name__ == '__main__':
+    test_profiler()
+    test_worker()
+    test_write_on_return()
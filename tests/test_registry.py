@@ -0,0 +1,73 @@
+import sys
+import threading
+
+import pytest
+
+from odq import Odq
+from odq.broker import MemoryBroker
+from odq.worker import run_worker
+
+o = Odq(MemoryBroker(), result_ttl=60, include=['colorsys'])
+
+
+def make_task():
+    @o.task(result=True)
+    def reg_hidden(x):
+        return x + 1
+    return reg_hidden
+
+
+# not a module attribute by its name, found by the registry
+hidden = make_task()
+
+
+def test_registry():
+    assert o.tasks['reg_hidden'] is hidden
+    assert o.registry['test_registry:reg_hidden'] is hidden
+    assert o.get_task('test_registry:reg_hidden') is hidden
+    assert o.get_task('reg_hidden') is hidden
+    assert hidden.qualified_name == 'test_registry:reg_hidden'
+
+
+def test_collision():
+    def reg_hidden(x):
+        return x
+    reg_hidden.__module__ = 'elsewhere'
+    with pytest.raises(ValueError):
+        o.task(reg_hidden)
+    assert o.tasks['reg_hidden'] is hidden
+    assert o.configs['reg_hidden']['result']
+
+
+def test_task_id_collision():
+    def task():
+        pass
+    # crc32 of both names is the same
+    task.__name__ = 'tid_12889'
+    o.task(task)
+    task.__name__ = 'tid_18210042'
+    with pytest.raises(ValueError):
+        o.task(task)
+    assert 'tid_18210042' not in o.configs
+
+
+def test_include():
+    sys.modules.pop('colorsys', None)
+    o.discover()
+    assert 'colorsys' in sys.modules
+
+
+def test_dispatch():
+    t = threading.Thread(target=run_worker, args=('test_registry:o',
+                                                  'reg_hidden'))
+    t.daemon = True
+    t.start()
+    assert hidden(1).get(timeout=5) == 2
+
+
+if __name__ == '__main__':
+    test_registry()
+    test_collision()
+    test_task_id_collision()
+    test_include()
+    test_dispatch()
@@ -0,0 +1,45 @@
+import threading
+
+import pytest
+
+from odq import Odq
+from odq.worker import run_worker
+
+o = Odq()
+
+
+@o.task(result=True)
+def mul(a, b):
+    return a * b
+
+
+@o.task(result=True)
+def div(a, b):
+    return a / b
+
+
+def start_worker(queue):
+    t = threading.Thread(target=run_worker, args=('test_results:o', queue))
+    t.daemon = True
+    t.start()
+
+
+def test_results():
+    o.disque_client.execute_command('DEBUG', 'FLUSHALL')
+    start_worker('mul')
+    start_worker('div')
+
+    assert mul(3, 4).get(timeout=5) == 12
+
+    results = mul.starmap([(i, i) for i in range(100)])
+    assert o.get_many(results, timeout=5) == [i * i for i in range(100)]
+
+    with pytest.raises(ZeroDivisionError):
+        div(1, 0).get(timeout=5)
+
+    with pytest.raises(TimeoutError):
+        mul.with_config(delay=10)(1, 1).get(timeout=0.1)
+
+
+if __name__ == '__main__':
+    test_results()
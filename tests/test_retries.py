@@ -0,0 +1,67 @@
+import time
+import threading
+
+import pytest
+
+from odq import Odq
+from odq.broker import MemoryBroker
+from odq.retries import retry_delay
+from odq.worker import run_worker
+
+o = Odq(MemoryBroker(), result_ttl=60)
+attempts = []
+
+
+@o.task(result=True, max_retries=2, backoff=1)
+def flaky(n):
+    attempts.append(n)
+    if len(attempts) < 2:
+        raise ValueError('flaky')
+    return n
+
+
+@o.task(result=True, max_retries=1, backoff=1)
+def poison(n):
+    raise KeyError(n)
+
+
+def test_retry_delay():
+    config = {'backoff': 2, 'backoff_max': 30}
+    assert [retry_delay(config, i) for i in range(1, 6)] == [2, 4, 8, 16, 30]
+    assert retry_delay({}, 1) == 1
+    # fractional delays are not truncated to 0
+    config = {'backoff': 0.25, 'backoff_max': 1.5}
+    assert [retry_delay(config, i) for i in range(1, 6)] == [1, 1, 1, 2, 2]
+
+
+def test_retries():
+    for queue in ('flaky', 'poison'):
+        t = threading.Thread(target=run_worker, args=('test_retries:o', queue))
+        t.daemon = True
+        t.start()
+
+    # the result of the retried job is sent for the first job
+    assert flaky(7).get(timeout=5) == 7
+    assert attempts == [7, 7]
+
+    result = poison(3)
+    with pytest.raises(KeyError):
+        result.get(timeout=5)
+    dead, = o.dead_jobs(poison)
+    assert dead[1:3] == ('poison', (3, ))
+    assert dead[4]['attempt'] == 2 and dead[4]['id'] == result.id
+    assert 'KeyError' in dead[4]['traceback']
+
+    # requeued with all its attempts, it fails them again
+    assert o.requeue_dead('poison') == 1
+    assert o.dead_jobs('poison') == []
+    deadline = time.time() + 5
+    while not o.dead_jobs('poison') and time.time() < deadline:
+        time.sleep(0.05)
+    again, = o.dead_jobs('poison')
+    assert again[0] != dead[0] and again[4]['attempt'] == 2
+
+
+if __name__ == '__main__':
+    test_retry_delay()
+    test_retries()
@@ -0,0 +1,60 @@
+import pickle
+
+import pytest
+
+from odq.serializers import (PickleSerializer, CompactSerializer, loads,
+                             task_id)
+
+
+def test_pickle():
+    payload = PickleSerializer().dumps('add', (1, 2), {'c': 3})
+    assert pickle.loads(payload) == ['add', (1, 2), {'c': 3}]
+    assert loads(payload) == ('add', (1, 2), {'c': 3}, {})
+
+
+def test_compact():
+    names = {task_id('add'): 'add'}
+    s = CompactSerializer(threshold=100)
+
+    small = s.dumps('add', (1, 2), {})
+    assert small[:2] == b'OQ'
+    assert b'add' not in small
+    assert loads(small, names) == ('add', (1, 2), {}, {})
+
+    big = s.dumps('add', ('x' * 10000, ), {})
+    assert len(big) < 1000
+    assert loads(big, names) == ('add', ('x' * 10000, ), {}, {})
+
+    raw = CompactSerializer(compression=None).dumps('add', ('x' * 10000, ),
+                                                    {})
+    assert len(raw) > 10000
+    assert loads(raw, names) == ('add', ('x' * 10000, ), {}, {})
+    with pytest.raises(ValueError):
+        CompactSerializer(compression='gzip')
+
+    meta = {'reply_to': 'q'}
+    for serializer in (PickleSerializer(), CompactSerializer()):
+        assert loads(serializer.dumps('add', (1, 2), {}, meta), names) == \
+            ('add', (1, 2), {}, meta)
+
+
+def test_mixed():
+    from odq import Odq
+    o = Odq()
+    @o.task(serializer=CompactSerializer())
+    def ser_add(a, b):
+        return a + b
+
+    o.disque_client.execute_command('DEBUG', 'FLUSHALL')
+    ser_add(1, 2)
+    ser_add.with_config(serializer=PickleSerializer())(3, 4)
+    results = o.disque_client.get_job(['ser_add'], count=2)
+    assert [o.decode_job(payload) for _, _, payload in results] == \
+        [('ser_add', (1, 2), {}, {}), ('ser_add', (3, 4), {}, {})]
+    o.disque_client.ack_job(*[jobid for _, jobid, _ in results])
+
+
+if __name__ == '__main__':
+    test_pickle()
+    test_compact()
+    test_mixed()
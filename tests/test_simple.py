@@ -48,6 +48,72 @@ def test_delay():
     assert 0.97 <= t1 - t0 <= 1.03
 
 
+def test_map():
+    o = Odq()
+    @o.task
+    def add(a, b):
+        return a + b
+
+    # flush all
+    o.disque_client.execute_command('DEBUG', 'FLUSHALL')
+
+    jids = add.starmap([(1, 2), (3, 4)], chunk_size=1)
+    results = o.disque_client.get_job(['add'], count=2)
+    assert [jobid for _, jobid, _ in results] == jids
+    assert [pickle.loads(payload)[1] for _, _, payload in results] == \
+        [(1, 2), (3, 4)]
+    o.disque_client.ack_job(*jids)
+
+    assert add.with_config(debug=True).starmap([(1, 2)]) == [3]
+
+
+def test_batch():
+    from odq.worker import fetch_batch
+
+    o = Odq()
+    @o.task(batch=10, batch_wait=100)
+    def add(pairs):
+        return [args[0] + args[1] for args, kwargs in pairs]
+
+    # flush all
+    o.disque_client.execute_command('DEBUG', 'FLUSHALL')
+
+    # debug mode calls with a batch of one
+    assert add.with_config(debug=True)(1, 2) == [3]
+
+    for i in range(5):
+        add(i, i)
+    first = o.disque_client.get_job(['add'])
+    more = fetch_batch(o.disque_client, b'add', 9, 100)
+    assert len(first) + len(more) == 5
+    o.disque_client.ack_job(*[jobid for _, jobid, _ in first + more])
+
+
+def test_stats():
+    o = Odq(stats_ttl=60)
+    @o.task
+    def add(a, b):
+        return a + b
+
+    # flush all
+    o.disque_client.execute_command('DEBUG', 'FLUSHALL')
+
+    add.starmap([(i, i) for i in range(5)])
+    results = o.disque_client.get_job(['add'], count=2)
+    assert len(list(o.iter_jobs('add', 'queued', count=2))) == 3
+    assert o.num_processing('add') == 2
+    assert o.stats.summary(['add']) == {'add': {'queued': 3, 'active': 2}}
+
+    # cached until invalidated
+    o.disque_client.ack_job(*[jobid for _, jobid, _ in results])
+    assert o.num_processing('add') == 2
+    o.stats.invalidate('add')
+    assert o.num_processing('add') == 0
+
+
 if __name__ == '__main__':
     test_simple()
     test_delay()
+    test_map()
+    test_batch()
+    test_stats()
@@ -0,0 +1,91 @@
+import threading
+
+import pytest
+
+from odq import Odq, chain, group, chord
+from odq.broker import MemoryBroker
+from odq.worker import run_worker
+from odq.workflow import chord_done
+
+o = Odq(MemoryBroker(), result_ttl=60)
+
+
+@o.task(result=True)
+def wf_add(x, y):
+    return x + y
+
+
+@o.task(result=True)
+def wf_double(x):
+    return x * 2
+
+
+@o.task(result=True)
+def wf_total(values, offset=0):
+    return sum(values) + offset
+
+
+@o.task(max_retries=0)
+def wf_fail(x):
+    raise ValueError(x)
+
+
+def setup_module():
+    for queue in ('wf_add', 'wf_double', 'wf_total', 'wf_fail'):
+        t = threading.Thread(target=run_worker,
+                             args=('test_workflow:o', queue))
+        t.daemon = True
+        t.start()
+
+
+def test_chain():
+    result = chain(wf_add.s(1, 2), wf_double.s(), wf_double.s())()
+    assert result.get(timeout=5) == 12
+    assert chain(wf_add.s(1, 2))().get(timeout=5) == 3
+
+
+def test_group():
+    results = group(wf_double.s(i) for i in range(5))()
+    assert o.get_many(results, timeout=5) == [0, 2, 4, 6, 8]
+
+
+def test_chord():
+    header = group([wf_double.s(i) for i in range(20)])
+    result = chord(header, wf_total.s(offset=1))()
+    assert result.get(timeout=5) == 381
+    # tokens and results are gone
+    assert o.disque_client.qlen(result.id) == 0
+    assert o.disque_client.qlen(result.id + '.results') == 0
+
+    assert chord([wf_add.s(1, 1)], wf_total.s())().get(timeout=5) == 2
+
+
+def test_chord_failure():
+    result = chord([wf_double.s(1), wf_fail.s(2)], wf_total.s())()
+    with pytest.raises(ValueError):
+        result.get(timeout=5)
+
+
+def test_chord_member_twice():
+    queue = 'odq.chord.twice'
+    config = o.configs['wf_total']
+    meta = {'queue': queue, 'size': 2, 'ttl': 60,
+            'token': o.disque_client.add_job(queue, b'1', retry=0, ttl=60),
+            'callback': wf_total.s().step, 'reply': o.results.meta(config)}
+    chord_done(o, dict(meta, index=0), True, 1)
+    # e.g. redelivered after its worker died before acking it
+    chord_done(o, dict(meta, index=0), True, 1)
+    assert o.disque_client.qlen(queue) == 1
+    chord_done(o, dict(meta, index=1), True, 2)
+    assert o.wrap_result(config, queue).get(timeout=5) == 3
+    assert o.disque_client.qlen(queue) == 0
+    assert o.disque_client.qlen(queue + '.results') == 0
+
+
+if __name__ == '__main__':
+    setup_module()
+    test_chain()
+    test_group()
+    test_chord()
+    test_chord_failure()
+    test_chord_member_twice()